@@ -0,0 +1,191 @@
+"""
+複数動画の一括処理スクリプト
+動画ディレクトリまたはマニフェストの動画をプロセスプールで並列測定
+
+使い方:
+    python batch_runner.py data/input --workers 4
+    python batch_runner.py videos.txt --output-dir data/output/batch
+"""
+
+import argparse
+import hashlib
+import multiprocessing as mp
+import os
+import traceback
+import pandas as pd
+from datetime import datetime
+
+from constants import MODEL_PATH, OUTPUT_DIR, TARGET_ZONES
+
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov", ".mkv")
+
+# ワーカープロセスごとに1回だけロードするモデル
+_model = None
+_model_path = MODEL_PATH
+
+
+def collect_videos(source: str):
+    """ディレクトリ内の動画、またはマニフェスト（1行1パス）の動画一覧を返す"""
+    if os.path.isdir(source):
+        return sorted(
+            os.path.join(source, name)
+            for name in os.listdir(source)
+            if name.lower().endswith(VIDEO_EXTENSIONS)
+        )
+
+    base_dir = os.path.dirname(os.path.abspath(source))
+    videos = []
+    with open(source, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            videos.append(line if os.path.isabs(line) else os.path.join(base_dir, line))
+    return videos
+
+
+def video_output_dir(output_root: str, video_path: str):
+    """
+    動画ごとの出力ディレクトリ（<ファイル名>_<絶対パスのハッシュ8桁>）
+
+    line1/a.mp4 と line2/a.mp4、a.mp4 と a.avi のようにファイル名が同じでも別ディレクトリ・別DBになる
+    """
+    stem = os.path.splitext(os.path.basename(video_path))[0]
+    path_hash = hashlib.sha1(os.path.abspath(video_path).encode("utf-8")).hexdigest()[:8]
+    return os.path.join(output_root, f"{stem}_{path_hash}")
+
+
+def unique_videos(videos: list):
+    """同じ動画（絶対パスが同じ）の重複を除く。重複は同じ出力先を並列に上書きするため処理しない"""
+    seen = set()
+    result = []
+    for video in videos:
+        path = os.path.abspath(video)
+        if path in seen:
+            print(f"⚠️ Skipping duplicate video: {video}")
+            continue
+        seen.add(path)
+        result.append(video)
+    return result
+
+
+def init_worker(model_path: str, torch_threads: int):
+    """ワーカー初期化: CPUスレッド数を分配し、モデルを1回だけロード"""
+    global _model, _model_path
+    import torch
+    from main import load_model
+
+    torch.set_num_threads(torch_threads)
+    _model_path = model_path
+    _model = load_model(model_path)
+
+
+def get_worker_model():
+    """ワーカープロセスでロード済みのモデルを返す"""
+    return _model
+
+
+def create_pool(workers: int, model_path: str = MODEL_PATH):
+    """モデルを1回だけロードするワーカープロセスプールを作成"""
+    torch_threads = max(1, (os.cpu_count() or 1) // workers)
+    print(f"👷 {workers} workers ({torch_threads} threads each)")
+
+    # CUDA を含むため fork ではなく spawn で起動
+    ctx = mp.get_context("spawn")
+    return ctx.Pool(workers, initializer=init_worker, initargs=(model_path, torch_threads))
+
+
+def process_one(video_path: str, output_root: str):
+    """1本の動画を専用の出力ディレクトリ・DBで処理し、サマリー行を返す"""
+    from main import setup_environment, process_video
+
+    output_dir = video_output_dir(output_root, video_path)
+    db_path = os.path.join(output_dir, "cycle_time_data.db")
+    summary = {"video": video_path, "output_dir": output_dir, "status": "ok", "error": "", "cycles": []}
+
+    if _model is None:
+        summary.update(status="failed", error="model not loaded")
+        return summary
+
+    try:
+        setup_environment(db_path, output_dir, source=video_path, model_path=_model_path)
+        video_result = process_video(_model, video_path, output_dir, db_path, _model_path)
+        if not video_result:
+            summary.update(status="failed", error="could not open video")
+            return summary
+
+        zone_states = video_result["zone_states"]
+        for zone in TARGET_ZONES:
+            summary["cycles"].extend(zone_states[zone]["results"])
+    except Exception as e:
+        traceback.print_exc()
+        summary.update(status="failed", error=str(e))
+
+    return summary
+
+
+def write_batch_summary(summaries: list, output_root: str):
+    """全動画のゾーン別集計を1つのCSVにまとめる"""
+    rows = []
+    for summary in summaries:
+        df = pd.DataFrame(summary["cycles"])
+        for zone in TARGET_ZONES:
+            times = df.loc[df["zone_name"] == zone, "adjusted_time_seconds"] if not df.empty else pd.Series(dtype=float)
+            rows.append({
+                "video": summary["video"],
+                "status": summary["status"],
+                "zone_name": zone,
+                "cycles": len(times),
+                "average": round(times.mean(), 2) if len(times) else None,
+                "shortest": round(times.min(), 2) if len(times) else None,
+                "longest": round(times.max(), 2) if len(times) else None,
+                "error": summary["error"],
+            })
+
+    summary_path = os.path.join(output_root, "batch_summary.csv")
+    pd.DataFrame(rows).to_csv(summary_path, index=False)
+    print(f"\n✅ Batch summary exported: {summary_path} ({len(summaries)} videos)")
+    return summary_path
+
+
+def run_batch(videos: list, output_root: str, model_path: str = MODEL_PATH, workers: int = 1):
+    """動画をワーカープロセスに分配して処理"""
+    os.makedirs(output_root, exist_ok=True)
+    videos = unique_videos(videos)
+    workers = max(1, min(workers, len(videos)))
+
+    print(f"🎞️ {len(videos)} videos")
+    print(f"📅 Start time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+
+    with create_pool(workers, model_path) as pool:
+        jobs = [pool.apply_async(process_one, (video, output_root)) for video in videos]
+        summaries = []
+        for video, job in zip(videos, jobs):
+            summary = job.get()
+            icon = "✅" if summary["status"] == "ok" else "❌"
+            print(f"{icon} {os.path.basename(video)}: {len(summary['cycles'])} cycles {summary['error']}")
+            summaries.append(summary)
+
+    print(f"📅 End time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    write_batch_summary(summaries, output_root)
+    return summaries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CycleEye batch runner")
+    parser.add_argument("source", help="動画ディレクトリ または 1行1パスのマニフェストファイル")
+    parser.add_argument("--output-dir", default=os.path.join(OUTPUT_DIR, "batch"), help="出力先ルート")
+    parser.add_argument("--model", default=MODEL_PATH, help="YOLOモデルのパス")
+    parser.add_argument("--workers", type=int, default=1, help="ワーカープロセス数")
+    args = parser.parse_args()
+
+    videos = collect_videos(args.source)
+    if not videos:
+        print(f"❌ No videos found: {args.source}")
+        return None
+
+    return run_batch(videos, args.output_dir, args.model, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,477 @@
+"""
+測定パイプラインのベンチマークスクリプト
+デコード・推論・ゾーン判定・状態更新・描画・エンコード・DB書き込みの時間を段階別に計測
+
+実際のモデルがなくても動くよう、既定では合成動画（ゾーンに周期的に Assembling → Pallet の
+色パッチを描く）と、そのパッチを色で検出するスタブモデルを使う。結果は JSON で保存し、前回の結果と比較できる
+
+使い方:
+    python benchmark.py                                   # 合成動画 + スタブモデル
+    python benchmark.py --video data/input/simulation_video.mp4 --seconds 60
+    python benchmark.py --model data/models/best.pt --output bench.json
+    python benchmark.py --baseline bench_main.json        # 10%以上遅くなったら終了コード1
+    python benchmark.py --trace-memory                    # Python ヒープの最大値も計測（別パス）
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from constants import (
+    FPS, STATIC_ZONES, TARGET_ZONES, INFERENCE_BATCH_SIZE, VIDEO_DECODER, VIDEO_ENCODER, USE_TRACKING
+)
+from database import save_cycle_to_db, close_database
+from detection import CLASS_IDS, infer_detections, filter_detections, analyze_detections, compute_zone_flags
+from drawing import annotate_frame
+from measurement import create_zone_states, update_zone_state, mark_invalid_cycles
+from tracker import ObjectTracker
+from video_utils import open_video, create_video_writer
+from zone_engine import ZoneStateEngine
+
+STAGES = ("decode", "inference", "tracking", "zone_detection", "zone_state", "annotate", "encode", "database")
+
+
+class StageTimer:
+    """段階ごとの経過時間を合計"""
+
+    def __init__(self):
+        self.totals = defaultdict(float)
+
+    @contextmanager
+    def measure(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.totals[stage] += time.perf_counter() - started
+
+
+class _StubTensor:
+    """ultralytics の Tensor の代わり（.cpu().numpy() だけ実装）"""
+
+    def __init__(self, array: np.ndarray):
+        self.array = array
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.array
+
+
+class _StubBoxes:
+    def __init__(self, boxes: np.ndarray, confidences: np.ndarray, class_ids: np.ndarray):
+        self.xyxy = _StubTensor(boxes)
+        self.conf = _StubTensor(confidences)
+        self.cls = _StubTensor(class_ids)
+
+
+class _StubResult:
+    def __init__(self, boxes: np.ndarray, confidences: np.ndarray, class_ids: np.ndarray):
+        self.boxes = _StubBoxes(boxes, confidences, class_ids)
+
+
+# 合成動画に描くパッチの色（BGR）と、スタブモデルが検出に使う色範囲
+PATCH_COLORS = {"Assembling": (0, 0, 255), "Pallet": (0, 255, 0), "Worker": (255, 0, 0)}
+_PATCH_RANGES = {
+    class_name: (np.array([0 if c == 0 else 200 for c in color], dtype=np.uint8),
+                 np.array([50 if c == 0 else 255 for c in color], dtype=np.uint8))
+    for class_name, color in PATCH_COLORS.items()
+}
+WORKER_BOXES = [[300, 100, 380, 300], [900, 100, 980, 300]]
+SYNTHETIC_CYCLE_FRAMES = int(FPS * 6)
+
+
+def synthetic_zone_classes(frame_index: int, cycle_frames: int = SYNTHETIC_CYCLE_FRAMES):
+    """合成動画の各ゾーンの正解クラス（cycle_frames 周期の前半2/3が Assembling、残りが Pallet）"""
+    classes = {}
+    for z, zone in enumerate(TARGET_ZONES):
+        # ゾーンごとに位相をずらす
+        phase = (frame_index + z * cycle_frames // len(TARGET_ZONES)) % cycle_frames
+        classes[zone] = "Assembling" if phase < cycle_frames * 2 // 3 else "Pallet"
+    return classes
+
+
+class StubModel:
+    """
+    YOLO の代わりに合成動画の色パッチを検出するモデル（重みファイル不要）
+
+    create_synthetic_video がゾーン上に描いた Assembling（赤）/ Pallet（緑）と Worker（青）の
+    パッチを色で探して返す。検出結果は渡されたフレームの内容だけで決まるため、ストライド・
+    動き検出・ROI・縮小デコードなど処理するフレームや切り出し方が変わっても同じ正解と比較できる。
+    latency_ms で1フレームあたりの推論時間、drop_rate で検出漏れ（フレーム内容から決まる乱数で
+    各検出を落とす）を模擬できる
+    """
+
+    def __init__(self, latency_ms: float = 0.0, drop_rate: float = 0.0, min_area: int = 100):
+        self.latency_ms = latency_ms
+        self.drop_rate = drop_rate
+        self.min_area = min_area
+
+    def _frame_detections(self, frame):
+        # 1/4 に間引いて色範囲の連結成分を探す
+        step = 4
+        small = frame[::step, ::step]
+        boxes, class_ids = [], []
+        for class_name, (lower, upper) in _PATCH_RANGES.items():
+            count, _, stats, _ = cv2.connectedComponentsWithStats(cv2.inRange(small, lower, upper))
+            for x, y, w, h, area in stats[1:count]:
+                if area * step * step >= self.min_area:
+                    boxes.append([x * step, y * step, (x + w) * step, (y + h) * step])
+                    class_ids.append(CLASS_IDS[class_name])
+
+        boxes = np.array(boxes, dtype=np.float32).reshape(-1, 4)
+        class_ids = np.array(class_ids, dtype=np.float32)
+        if self.drop_rate and len(boxes):
+            rng = np.random.default_rng(zlib.crc32(np.ascontiguousarray(small[::8, ::8]).tobytes()))
+            keep = rng.random(len(boxes)) >= self.drop_rate
+            boxes, class_ids = boxes[keep], class_ids[keep]
+        return boxes, np.full(len(boxes), 0.9, dtype=np.float32), class_ids
+
+    def predict(self, frames, classes=None, **kwargs):
+        if not isinstance(frames, list):
+            frames = [frames]
+        if self.latency_ms:
+            time.sleep(self.latency_ms * len(frames) / 1000)
+
+        results = []
+        for frame in frames:
+            boxes, confidences, class_ids = self._frame_detections(frame)
+            if classes is not None:
+                mask = np.isin(class_ids, classes)
+                boxes, confidences, class_ids = boxes[mask], confidences[mask], class_ids[mask]
+            results.append(_StubResult(boxes, confidences, class_ids))
+        return results
+
+
+def create_synthetic_video(path: str, seconds: float, width: int = 1280, height: int = 720, fps: float = FPS,
+                           cycle_frames: int = SYNTHETIC_CYCLE_FRAMES):
+    """
+    ノイズ入りの合成動画を作成（デコード・エンコードの負荷を実映像に近づける）
+
+    各ゾーンには synthetic_zone_classes の正解クラスの色パッチ、作業者の位置には Worker のパッチを描く
+    """
+    writer = create_video_writer(path, fps, width, height)
+    rng = np.random.default_rng(0)
+    background = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    for i in range(int(seconds * fps)):
+        frame = np.roll(background, i * 4, axis=1)
+        cv2.putText(frame, f"frame {i}", (40, 80), cv2.FONT_HERSHEY_SIMPLEX, 2, (255, 255, 255), 3)
+        # 動画の1フレーム目が frame_number 1
+        for zone, class_name in synthetic_zone_classes(i + 1, cycle_frames).items():
+            x1, y1, x2, y2 = STATIC_ZONES[zone]
+            cv2.rectangle(frame, (x1 - 20, y1 - 20), (x2 + 20, y2 + 20), PATCH_COLORS[class_name], -1)
+        for x1, y1, x2, y2 in WORKER_BOXES:
+            cv2.rectangle(frame, (x1, y1), (x2, y2), PATCH_COLORS["Worker"], -1)
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(video_path: str, model, max_seconds: float = None,
+                  batch_size: int = INFERENCE_BATCH_SIZE, annotate: bool = True,
+                  use_engine: bool = None, decoder: str = VIDEO_DECODER, encoder: str = VIDEO_ENCODER,
+                  decode_width: int = None, use_tracking: bool = USE_TRACKING, trace_memory: bool = False):
+    """
+    動画を順に処理して段階別の時間・メモリ最大値を計測（スレッド分割なし）
+
+    decode_width は描画なし（annotate=False）のときだけ有効（描画には原寸のフレームが必要）。
+    trace_memory=True では tracemalloc で Python ヒープの最大値を取るが、Python 側の処理が
+    数倍遅くなるため、その回の段階別の時間は比較に使わない
+    """
+    video_info = open_video(video_path, decoder, None if annotate else decode_width)
+    if not video_info:
+        return None
+
+    cap = video_info["cap"]
+    fps = video_info["fps"]
+    scale = video_info["scale"]
+    max_frames = int(max_seconds * fps) if max_seconds else None
+    work_dir = tempfile.mkdtemp(prefix="cycleeye_bench_")
+    db_path = os.path.join(work_dir, "cycle_time_data.db")
+
+    from main import setup_environment
+    setup_environment(db_path, work_dir, source=video_path)
+
+    out = None
+    if annotate:
+        out = create_video_writer(os.path.join(work_dir, "bench.mp4"), fps, video_info["width"], video_info["height"],
+                                  encoder)
+
+    timer = StageTimer()
+    zone_states = create_zone_states(use_engine=use_engine)
+    use_engine = isinstance(zone_states, ZoneStateEngine)
+    tracker = ObjectTracker() if use_tracking else None
+    frame_count = 0
+    cycle_seconds = []
+
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        while max_frames is None or frame_count < max_frames:
+            batch = []
+            with timer.measure("decode"):
+                while len(batch) < batch_size and (max_frames is None or frame_count + len(batch) < max_frames):
+                    ret, frame = cap.read()
+                    if not ret:
+                        break
+                    batch.append(frame)
+            if not batch:
+                break
+
+            with timer.measure("inference"):
+                batch_detections = infer_detections(batch, model, None, scale)
+
+            for frame, raw_detections in zip(batch, batch_detections):
+                frame_count += 1
+                current_time_sec = frame_count / fps
+
+                with timer.measure("zone_detection"):
+                    detections = filter_detections(raw_detections)
+                if tracker:
+                    with timer.measure("tracking"):
+                        detections = tracker.update(detections)
+                with timer.measure("zone_detection"):
+                    if use_engine:
+                        worker_count, assembling, pallet = compute_zone_flags(detections)
+                    else:
+                        worker_count, zone_detections = analyze_detections(detections)
+
+                completed_cycles = []
+                with timer.measure("zone_state"):
+                    if worker_count >= 3:
+                        mark_invalid_cycles(zone_states)
+                    if use_engine:
+                        completed_cycles = zone_states.step(assembling, pallet, frame_count, current_time_sec)
+                    else:
+                        for zone in TARGET_ZONES:
+                            cycle_data = update_zone_state(
+                                zone_states[zone], zone_detections[zone]["assembling"],
+                                zone_detections[zone]["pallet"], frame_count, current_time_sec, zone, None
+                            )
+                            if cycle_data:
+                                completed_cycles.append(cycle_data)
+
+                with timer.measure("database"):
+                    for cycle_data in completed_cycles:
+                        save_cycle_to_db(db_path, cycle_data)
+                cycle_seconds.extend(cycle["adjusted_time_seconds"] for cycle in completed_cycles)
+
+                if out:
+                    with timer.measure("annotate"):
+                        annotate_frame(frame, detections, zone_states, worker_count, current_time_sec)
+                    with timer.measure("encode"):
+                        out.write(frame)
+
+        if out:
+            # FFmpeg エンコーダーは別プロセスで処理するため、残りのフレームの書き出し完了までを含める
+            with timer.measure("encode"):
+                out.release()
+            out = None
+
+        with timer.measure("database"):
+            close_database(db_path)
+    finally:
+        cap.release()
+        if out:
+            out.release()
+
+    total_sec = time.perf_counter() - started
+    peak_traced = None
+    if trace_memory:
+        _, peak_traced = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    stages = {}
+    for stage in STAGES:
+        stage_sec = timer.totals.get(stage, 0.0)
+        stages[stage] = {
+            "total_sec": round(stage_sec, 4),
+            "per_frame_ms": round(stage_sec / frame_count * 1000, 4) if frame_count else None,
+            "share": round(stage_sec / total_sec, 4) if total_sec else None
+        }
+
+    return {
+        "frames": frame_count,
+        "cycles": len(cycle_seconds),
+        "cycle_seconds_mean": round(float(np.mean(cycle_seconds)), 3) if cycle_seconds else None,
+        "cycle_seconds_std": round(float(np.std(cycle_seconds)), 3) if cycle_seconds else None,
+        "total_sec": round(total_sec, 3),
+        "fps": round(frame_count / total_sec, 2) if total_sec else None,
+        "zone_engine_used": use_engine,
+        "tracking": use_tracking,
+        "video_io": {
+            "decoder": video_info["decoder"],
+            "decode_size": [video_info["width"], video_info["height"]],
+            "decode_fps": _stage_fps(frame_count, timer.totals.get("decode")),
+            "encoder": encoder if annotate else None,
+            "encode_fps": _stage_fps(frame_count, timer.totals.get("encode")) if annotate else None
+        },
+        "stages": stages,
+        # ru_maxrss は Linux では KB 単位
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "peak_python_heap_mb": round(peak_traced / (1024 * 1024), 1) if peak_traced is not None else None,
+        "trace_memory": trace_memory
+    }
+
+
+def _stage_fps(frames: int, stage_sec: float):
+    """段階単体のスループット（その段階だけを処理した場合の fps）"""
+    return round(frames / stage_sec, 1) if stage_sec else None
+
+
+def compare_to_baseline(result: dict, baseline: dict, max_regression: float):
+    """前回結果と比較して表示し、fps が max_regression 以上低下していれば False"""
+    print("\n" + "="*80)
+    print("📈 Comparison with baseline")
+    print("="*80)
+    if baseline.get("trace_memory", True):
+        # 以前の結果は tracemalloc 有効で計測されており、Python 側の段階が遅く出ている
+        print("⚠️ Baseline was timed with tracemalloc on; re-record it for a fair comparison")
+    for stage in STAGES:
+        before = baseline["stages"].get(stage, {}).get("per_frame_ms")
+        after = result["stages"][stage]["per_frame_ms"]
+        if before and after is not None:
+            print(f"{stage:15s} {before:9.3f}ms → {after:9.3f}ms ({(after - before) / before * 100:+.1f}%)")
+
+    change = (result["fps"] - baseline["fps"]) / baseline["fps"]
+    print(f"{'fps':15s} {baseline['fps']:9.2f}   → {result['fps']:9.2f}   ({change * 100:+.1f}%)")
+    if change < -max_regression:
+        print(f"❌ Throughput regressed by more than {max_regression * 100:.0f}%")
+        return False
+    print("✅ No throughput regression")
+    return True
+
+
+def print_result(result: dict):
+    print("\n" + "="*80)
+    print(f"⏱️ Benchmark: {result['frames']} frames in {result['total_sec']:.2f}s ({result['fps']:.1f} fps)")
+    print("="*80)
+    for stage, stats in result["stages"].items():
+        if stats["per_frame_ms"] is not None:
+            print(f"{stage:15s} {stats['per_frame_ms']:9.3f} ms/frame  {stats['share'] * 100:5.1f}%")
+    video_io = result["video_io"]
+    print(f"Decode: {video_io['decoder']} {video_io['decode_size'][0]}x{video_io['decode_size'][1]} "
+          f"{video_io['decode_fps']} fps")
+    if video_io["encoder"]:
+        print(f"Encode: {video_io['encoder']} {video_io['encode_fps']} fps")
+    print(f"Cycles: {result['cycles']} (mean {result['cycle_seconds_mean']}s, "
+          f"std {result['cycle_seconds_std']}s, tracking {'on' if result['tracking'] else 'off'})")
+    heap = f"{result['peak_python_heap_mb']} MB" if result["peak_python_heap_mb"] is not None else "- (--trace-memory)"
+    print(f"Peak RSS: {result['peak_rss_mb']} MB / Python heap: {heap}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CycleEye pipeline benchmark")
+    parser.add_argument("--video", default=None, help="入力動画（省略時は合成動画を作成）")
+    parser.add_argument("--seconds", type=float, default=30.0, help="処理する秒数（合成動画の長さ）")
+    parser.add_argument("--model", default=None, help="YOLOモデル（省略時はスタブモデル）")
+    parser.add_argument("--stub-latency-ms", type=float, default=0.0, help="スタブモデルの1フレームあたりの推論時間")
+    parser.add_argument("--stub-drop-rate", type=float, default=0.0,
+                        help="スタブモデルで各検出を落とす確率（検出漏れ・ちらつきの模擬）")
+    parser.add_argument("--batch-size", type=int, default=INFERENCE_BATCH_SIZE, help="推論バッチサイズ")
+    parser.add_argument("--no-annotate", action="store_true", help="描画・エンコードを省略（計測のみモード相当）")
+    parser.add_argument("--decoder", choices=["opencv", "ffmpeg"], default=VIDEO_DECODER, help="デコード方式")
+    parser.add_argument("--encoder", default=VIDEO_ENCODER, help="エンコーダー（mp4v / libx264 / h264_nvenc）")
+    parser.add_argument("--decode-width", type=int, default=None,
+                        help="推論用に縮小デコードする幅（--no-annotate 時のみ、ffmpeg デコード）")
+    parser.add_argument("--zone-engine", choices=["auto", "on", "off"], default="auto",
+                        help="ゾーン状態の更新方式（on: 配列エンジン / off: ゾーンごとの辞書 / auto: ゾーン数で選択）")
+    parser.add_argument("--tracking", choices=["on", "off"], default="on" if USE_TRACKING else "off",
+                        help="物体追跡の有無（サイクル数・平均・ばらつきと tracking 段階の時間を比較）")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="計測後に tracemalloc を有効にした別パスを実行し、Python ヒープの最大値を記録")
+    parser.add_argument("--output", default=None, help="結果 JSON の保存先")
+    parser.add_argument("--baseline", default=None, help="比較する前回の結果 JSON")
+    parser.add_argument("--max-regression", type=float, default=0.10, help="許容する fps の低下率")
+    args = parser.parse_args()
+
+    video_path = args.video
+    if video_path is None:
+        video_path = os.path.join(tempfile.mkdtemp(prefix="cycleeye_bench_"), "synthetic.mp4")
+        create_synthetic_video(video_path, args.seconds)
+
+    if args.model:
+        from main import load_model, warmup_model
+        model = load_model(args.model)
+        if not model:
+            return None
+        probe = open_video(video_path)
+        warmup_model(model, probe["width"], probe["height"], args.batch_size)
+        probe["cap"].release()
+    else:
+        model = StubModel(latency_ms=args.stub_latency_ms, drop_rate=args.stub_drop_rate)
+
+    result = run_benchmark(video_path, model, args.seconds, args.batch_size, not args.no_annotate,
+                           {"auto": None, "on": True, "off": False}[args.zone_engine],
+                           args.decoder, args.encoder, args.decode_width, args.tracking == "on")
+    if result is None:
+        return None
+    if args.trace_memory:
+        # tracemalloc は Python 側の処理を数倍遅くするため、時間を計測した回とは別に実行
+        traced = run_benchmark(video_path, model, args.seconds, args.batch_size, not args.no_annotate,
+                               {"auto": None, "on": True, "off": False}[args.zone_engine],
+                               args.decoder, args.encoder, args.decode_width, args.tracking == "on",
+                               trace_memory=True)
+        result["peak_python_heap_mb"] = traced["peak_python_heap_mb"]
+
+    result = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_revision": _git_revision(),
+        "config": {
+            "video": args.video or "synthetic",
+            "seconds": args.seconds,
+            "model": args.model or "stub",
+            "stub_latency_ms": args.stub_latency_ms,
+            "stub_drop_rate": args.stub_drop_rate,
+            "batch_size": args.batch_size,
+            "annotate": not args.no_annotate,
+            "zone_engine": args.zone_engine,
+            "tracking": args.tracking,
+            "decoder": args.decoder,
+            "encoder": args.encoder,
+            "decode_width": args.decode_width
+        },
+        **result
+    }
+    print_result(result)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"\n✅ Benchmark result saved: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if not compare_to_baseline(result, baseline, args.max_regression):
+            sys.exit(1)
+
+    return result
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+ライブクリップ関連
+直近の描画済みフレームをメモリ上限つきで保持し、遅いサイクルの動画を即時に書き出す
+"""
+
+import os
+from collections import deque
+import cv2
+import numpy as np
+from video_utils import create_video_writer
+
+
+class FrameRingBuffer:
+    """JPEG圧縮したフレームを上限バイト数まで保持するリングバッファ"""
+
+    def __init__(self, max_bytes: int, jpeg_quality: int = 85):
+        self.max_bytes = max_bytes
+        self.encode_params = [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality]
+        self.frames = deque()
+        self.total_bytes = 0
+
+    def append(self, frame_number: int, frame):
+        """フレームを追加し、上限を超えた分を古い順に破棄"""
+        ok, encoded = cv2.imencode(".jpg", frame, self.encode_params)
+        if not ok:
+            return
+        self.frames.append((frame_number, encoded))
+        self.total_bytes += encoded.nbytes
+
+        while self.total_bytes > self.max_bytes and len(self.frames) > 1:
+            _, dropped = self.frames.popleft()
+            self.total_bytes -= dropped.nbytes
+
+    def oldest_frame_number(self):
+        """保持している最古のフレーム番号"""
+        return self.frames[0][0] if self.frames else None
+
+    def frames_from(self, frame_number: int):
+        """指定フレーム番号以降の保持フレームを復号して返す"""
+        for number, encoded in self.frames:
+            if number >= frame_number:
+                yield number, cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+
+
+class LiveClipRecorder:
+    """目標時間を超えたサイクルの動画を、前後マージン込みで測定中に書き出す"""
+
+    def __init__(self, output_dir: str, fps: float, width: int, height: int,
+                 margin_sec: float, max_buffer_mb: float, jpeg_quality: int = 85):
+        self.output_dir = output_dir
+        self.fps = fps
+        self.size = (width, height)
+        self.margin_frames = int(margin_sec * fps)
+        self.buffer = FrameRingBuffer(int(max_buffer_mb * 1024 * 1024), jpeg_quality)
+        self.active = []
+        self.frame_number = 0
+        self.written = []
+        os.makedirs(output_dir, exist_ok=True)
+
+    def on_frame(self, frame: np.ndarray):
+        """描画済みフレームを受け取り、バッファと書き出し中のクリップに渡す"""
+        self.frame_number += 1
+        self.buffer.append(self.frame_number, frame)
+
+        for clip in self.active:
+            clip["writer"].write(frame)
+        self._close_finished()
+
+    def request(self, cycle: dict):
+        """完了したサイクルのクリップ書き出しを開始（開始マージン分はバッファから）"""
+        start_frame = max(1, cycle["start_frame"] - self.margin_frames)
+        oldest = self.buffer.oldest_frame_number()
+        if oldest is None:
+            return
+        if oldest > start_frame:
+            print(f"⚠️ [{cycle['zone_name']}] Live clip truncated: buffer holds frames from {oldest} "
+                  f"(needed {start_frame}) - increase LIVE_CLIP_BUFFER_MB")
+
+        output_path = os.path.join(
+            self.output_dir, f"{cycle['zone_name']}_slow_cycle_{cycle['cycle_number']}.mp4"
+        )
+        writer = create_video_writer(output_path, self.fps, *self.size)
+        for _, frame in self.buffer.frames_from(start_frame):
+            writer.write(frame)
+
+        self.active.append({
+            "writer": writer,
+            "output_path": output_path,
+            "end_frame": cycle["end_frame"] + self.margin_frames
+        })
+        self._close_finished()
+
+    def _close_finished(self):
+        for clip in [c for c in self.active if c["end_frame"] <= self.frame_number]:
+            clip["writer"].release()
+            self.active.remove(clip)
+            self.written.append(clip["output_path"])
+            print(f"🎬 Live clip saved: {clip['output_path']}")
+
+    def close(self):
+        """書き出し中のクリップを閉じる（動画終端）"""
+        for clip in self.active:
+            clip["end_frame"] = self.frame_number
+        self._close_finished()
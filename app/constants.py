@@ -25,6 +25,42 @@ OUTPUT_DIR = os.path.join(BASE_DIR, "data", "output")
 DB_PATH = os.path.join(OUTPUT_DIR, "cycle_time_data.db")
 OUTPUT_VIDEO_PATH = os.path.join(OUTPUT_DIR, "result_with_detections.mp4")
 PDF_PATH = os.path.join(OUTPUT_DIR, "performance_report.pdf")
+DETECTIONS_PATH = os.path.join(OUTPUT_DIR, "detections.npz")
+DETECTION_CACHE_DIR = os.path.join(BASE_DIR, "data", "cache")
+
+# ======================
+# 出力設定
+# ======================
+WRITE_ANNOTATED_VIDEO = True   # False: 描画・動画書き出しを省略（CSV/PDFのみ出力）
+SAVE_RAW_DETECTIONS = False    # True: 生の検出結果を保存（render_video.py で後から描画可能）
+USE_DETECTION_CACHE = True     # 動画+モデルごとに検出結果をキャッシュし、2回目以降は推論せず再計測
+INCREMENTAL_REPORTS = True     # サイクル完了ごとに集計・CSV追記（終了時はDBを再集計せずPDF出力）
+QUANTILE_RELATIVE_ACCURACY = 0.01  # パーセンタイル近似の相対誤差
+REPORT_REFRESH_SEC = 300.0     # ライブ映像でのPDF・集計CSVの更新間隔
+
+# ======================
+# メトリクス設定
+# ======================
+METRICS_PORT = 9108              # http://localhost:9108/metrics（0で無効）
+# 待ち受けアドレス（ローカル実行は自ホストのみ。コンテナ内では docker-compose.yml が 0.0.0.0 を指定し、
+# ホスト側の公開範囲は ports で 127.0.0.1 に限定する）
+METRICS_BIND_ADDRESS = os.environ.get("METRICS_BIND_ADDRESS", "127.0.0.1")
+METRICS_LOG_PATH = os.path.join(OUTPUT_DIR, "metrics.jsonl")  # 定期ログ（Noneで無効）
+METRICS_LOG_INTERVAL_SEC = 30.0
+
+# ======================
+# データベース書き込み設定
+# ======================
+DB_FLUSH_EVERY = 50          # N件たまったらまとめてコミット
+DB_FLUSH_INTERVAL_SEC = 5.0  # 前回コミットからT秒経過でもコミット
+RUN_RETENTION_DAYS = 90      # これより古い測定（run）は起動時に削除（None で無期限に保持）
+
+# ======================
+# データエクスポート設定
+# ======================
+EXPORT_CHUNK_ROWS = 50000    # CSV/Parquet へ一度に書き込む行数（メモリ使用量の上限）
+EXPORT_PARQUET = False       # True: 測定終了時に Parquet へ差分エクスポート（pyarrow が必要）
+PARQUET_DIR_NAME = "cycles_parquet"  # 出力先内のデータセット名（date=/zone_name= でパーティション分割）
 
 # ======================
 # YOLOv8 クラス定義
@@ -62,6 +98,69 @@ N_FRAMES_GRACE_STOP = 5   # 終了判定の連続フレーム数
 FRAME_DIFFERENCE = N_FRAMES_GRACE_STOP - N_FRAMES_GRACE_START
 ADJUSTMENT_SECONDS = FRAME_DIFFERENCE / FPS
 
+# 全ゾーンの状態を配列で保持し1フレームを一括更新（False で従来のゾーンごとの辞書）
+# 配列演算の固定コストがあるため、ゾーン数が ZONE_ENGINE_MIN_ZONES 以上のときだけ使用
+USE_ZONE_ENGINE = True
+ZONE_ENGINE_MIN_ZONES = 16
+
+# ======================
+# 推論設定
+# ======================
+INFERENCE_BATCH_SIZE = 8  # まとめて推論するフレーム数（1で逐次推論）
+
+# 推論ストライド（Nフレームに1回だけ推論。1で全フレーム推論）
+INFERENCE_STRIDE = 1
+# 開始/終了判定の途中は全フレーム推論に切り替える
+ADAPTIVE_STRIDE = True
+
+# 物体追跡（SORT 方式。トラック単位でゾーン判定し、推論しないフレームは予測位置で判定）
+# 開始は TRACK_MIN_HITS、終了は見失い中の予測で遅れうるため、サイクル境界・件数が変わる。
+# 実映像で benchmark.py --tracking on/off を比較してから有効化すること
+USE_TRACKING = False
+TRACK_IOU_THRESHOLD = 0.3   # 予測位置と検出を対応づける IoU の下限
+TRACK_MIN_HITS = 2          # 出力するまでに必要な観測回数（1回だけの誤検出を除外）
+TRACK_MAX_AGE = 12          # 検出が途切れても予測位置で出力を続けるフレーム数
+
+# 動き検出による推論スキップ（ゾーン周辺に変化がなければ直前の検出結果を再利用）
+MOTION_GATING = True
+MOTION_ZONE_PADDING = 80          # 差分を見るゾーン周囲の余白(px)
+MOTION_DOWNSCALE = 0.25           # 差分計算用の縮小率
+MOTION_PIXEL_THRESHOLD = 25       # 変化とみなす画素値の差
+MOTION_CHANGED_RATIO = 0.01       # ゾーン内で変化した画素がこの割合以上なら推論
+MOTION_MAX_REUSE_FRAMES = 24      # 変化がなくてもこのフレーム数ごとに推論し直す
+
+# ROI推論設定（STATIC_ZONES周辺だけを切り出して推論）
+USE_ROI_INFERENCE = False
+ROI_PADDING = 80          # ゾーン外接矩形の周囲に加える余白(px)
+ROI_IMGSZ = 640           # ROI推論の入力サイズ
+WORKER_PASS_IMGSZ = 320   # Worker数カウント用の全体推論の入力サイズ（NoneでROI内のWorkerのみ数える）
+
+# 推論バックエンド（GPUのないCPU環境では "onnx" / "openvino" を推奨）
+INFERENCE_BACKEND = "pytorch"     # "pytorch" / "onnx" / "openvino"
+EXPORT_PRECISION = "fp32"         # "fp32" / "fp16"（OpenVINOのみ） / "int8"
+CALIBRATION_FRAMES = 200          # INT8量子化のキャリブレーションに使うフレーム数
+PARITY_TIME_TOLERANCE_SEC = 0.5   # パリティチェックで許容するサイクルタイムの差（秒）
+
+# モデルロード設定
+USE_HALF_PRECISION = True   # CUDA使用時はFP16で推論
+FUSE_MODEL = True           # ロード時に Conv+BN を融合（初回推論での遅延初期化を避ける）
+FIXED_INPUT_SHAPE = True    # 入力形状を固定し、cuDNNの最適アルゴリズムをウォームアップ中に選択
+WARMUP_ITERATIONS = 2       # ダミーフレームでのウォームアップ回数（0で無効）
+
+# パイプライン設定（デコード / 推論 / 描画・書き出しをスレッド分割）
+USE_PIPELINE = True
+PIPELINE_QUEUE_SIZE = 32  # 各ステージ間キューの上限フレーム数
+
+# 長時間動画の時間分割処理（shard_runner.py）
+SHARD_WARMUP_SEC = 60.0         # 各区間の開始前に状態を温める重複区間
+SHARD_MAX_OVERLAP_SEC = 600.0   # 区間終了後、境界をまたぐサイクルを追いかける最大時間
+SHARD_EXACT_SEEK = False        # True: シークせず先頭から読み飛ばす（コーデックでシークがずれる場合）
+
+# ライブ映像（stream_runner.py）
+STREAM_RECONNECT_SEC = 5.0      # 切断時の再接続間隔
+STREAM_STATS_INTERVAL_SEC = 10.0  # 処理fps・遅延・ドロップ数の表示間隔
+MULTI_STREAM_MAX_BATCH = 8      # 複数カメラ処理（multi_stream_runner.py）で1回に推論する最大フレーム数
+
 # ======================
 # 静的ゾーン座標
 # ======================
@@ -72,7 +171,30 @@ STATIC_ZONES = {
     "B2_Assemble": [1150, 260, 1160, 310],
 }
 
+# ======================
+# 動画入出力設定
+# ======================
+# デコード: "opencv"（cv2.VideoCapture）/ "ffmpeg"（FFmpegの別プロセスでマルチスレッドデコード）
+VIDEO_DECODER = "opencv"
+DECODE_THREADS = 0              # FFmpegデコードのスレッド数（0で自動）
+DECODE_HWACCEL = None           # FFmpegのハードウェアデコード（"cuda" など。None でCPU）
+INFERENCE_DECODE_WIDTH = None   # 計測のみモードで推論用に縮小デコードする幅（None で原寸）
+
+# エンコード: "mp4v"（cv2.VideoWriter）/ "libx264" / "h264_nvenc"（FFmpeg）
+VIDEO_ENCODER = "mp4v"
+ENCODE_PRESET = "veryfast"      # libx264 / h264_nvenc のプリセット（速度と圧縮率のトレードオフ）
+ENCODE_CRF = 23                 # 画質（小さいほど高画質・大容量）
+
 # ======================
 # 動画切り出し設定
 # ======================
-VIDEO_MARGIN_SECONDS = 2.0  # 切り出し時の前後マージン
\ No newline at end of file
+VIDEO_MARGIN_SECONDS = 2.0  # 切り出し時の前後マージン
+CLIP_SELECTION = "longest"  # 切り出し対象: "longest" / "top_n" / "outliers"
+CLIP_TOP_N = 3              # "top_n" 時のゾーンごとの件数
+CLIP_OUTLIER_SIGMA = 2.0    # "outliers" 時のしきい値（平均 + σ × 標準偏差）
+CLIP_STREAM_COPY = True     # ffmpegがあれば再エンコードせずキーフレーム単位で切り出し
+
+# ライブクリップ（目標時間を超えたサイクルを測定中に即時書き出し）
+LIVE_CLIPS = False
+LIVE_CLIP_BUFFER_MB = 256       # 直近フレームを保持するリングバッファの上限（JPEG圧縮後）
+LIVE_CLIP_JPEG_QUALITY = 85
\ No newline at end of file
@@ -3,125 +3,440 @@
 SQLiteを使った計測データの保存・集計
 """
 
+import atexit
+import csv
+import json
 import sqlite3
+import threading
+import time
 import pandas as pd
-from datetime import datetime
-from constants import TARGET_ZONES
+from datetime import datetime, timedelta, timezone
+from constants import TARGET_ZONES, DB_FLUSH_EVERY, DB_FLUSH_INTERVAL_SEC, EXPORT_CHUNK_ROWS, RUN_RETENTION_DAYS
+from metrics import STAGE_SECONDS
+
+INSERT_CYCLE_SQL = """
+    INSERT INTO cycle_measurements (
+        zone_name, cycle_number, start_datetime, end_datetime,
+        start_frame, end_frame, elapsed_seconds, adjusted_time_seconds,
+        is_valid, run_id
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# DBパスごとの常駐コネクションとサイクル書き込み器、実行中の run id
+_connections = {}
+_writers = {}
+_active_runs = {}
+_registry_lock = threading.Lock()
+
+
+def get_connection(db_path: str):
+    """DBパスごとの常駐コネクションを取得（初回のみ接続・WAL設定）"""
+    with _registry_lock:
+        conn = _connections.get(db_path)
+        if conn is None:
+            conn = sqlite3.connect(db_path, check_same_thread=False)
+            # 新規DBのみ有効（古い実行を削除した後に incremental_vacuum で領域を返す）
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            _connections[db_path] = conn
+        return conn
+
+
+def _cycle_row(cycle_data: dict, run_id: int = None):
+    """サイクルデータをINSERT用のタプルに変換"""
+    return (
+        cycle_data['zone_name'],
+        cycle_data['cycle_number'],
+        cycle_data['start_datetime'],
+        cycle_data['end_datetime'],
+        cycle_data['start_frame'],
+        cycle_data['end_frame'],
+        cycle_data['elapsed_seconds'],
+        cycle_data['adjusted_time_seconds'],
+        1,
+        run_id
+    )
+
+
+class CycleWriter:
+    """
+    サイクルデータをバッファし、N件またはT秒ごとにまとめてコミット
+
+    サイクルが途切れても（ライブ映像で動きのないラインなど）未コミット分が残り続けないよう、
+    別スレッドが flush_interval ごとに経過時間を確認してコミットする
+    """
+
+    def __init__(self, conn, run_id: int = None, flush_every: int = DB_FLUSH_EVERY,
+                 flush_interval: float = DB_FLUSH_INTERVAL_SEC):
+        self.conn = conn
+        self.run_id = run_id
+        self.flush_every = max(1, flush_every)
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="db-flush", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while not self.stop_event.wait(self.flush_interval):
+            with self.lock:
+                if not self.pending or time.monotonic() - self.last_flush < self.flush_interval:
+                    continue
+                try:
+                    self._flush()
+                except sqlite3.Error as e:
+                    # 次の周期・close で再試行（未コミット分はバッファに残る）
+                    print(f"⚠️ Periodic DB flush failed: {e}")
+
+    def add(self, cycle_data: dict):
+        """1サイクルをバッファに追加（しきい値を超えたらコミット）"""
+        with self.lock:
+            self.pending.append(_cycle_row(cycle_data, self.run_id))
+            if (len(self.pending) >= self.flush_every
+                    or time.monotonic() - self.last_flush >= self.flush_interval):
+                self._flush()
+
+    def flush(self):
+        """バッファ中のサイクルを1トランザクションで書き込み"""
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        """定期コミットのスレッドを止め、残りを書き込み"""
+        self.stop_event.set()
+        self.thread.join()
+        self.flush()
+
+    def _flush(self):
+        if self.pending:
+            with STAGE_SECONDS.time("db_flush"), self.conn:
+                self.conn.executemany(INSERT_CYCLE_SQL, self.pending)
+            self.pending = []
+        self.last_flush = time.monotonic()
+
+
+def get_cycle_writer(db_path: str):
+    """DBパスごとのサイクル書き込み器を取得（サイクルは実行中の run に紐づけて保存）"""
+    conn = get_connection(db_path)
+    with _registry_lock:
+        writer = _writers.get(db_path)
+        if writer is None:
+            writer = CycleWriter(conn, _active_runs.get(db_path))
+            _writers[db_path] = writer
+        return writer
+
+
+def flush_database(db_path: str):
+    """未コミットのサイクルを書き込み（レポート生成前などに呼ぶ）"""
+    writer = _writers.get(db_path)
+    if writer is not None:
+        writer.flush()
+
+
+def close_database(db_path: str):
+    """未コミット分を書き込み、実行中の run に終了時刻・サイクル数を記録してからコネクションを閉じる"""
+    with _registry_lock:
+        writer = _writers.pop(db_path, None)
+        conn = _connections.pop(db_path, None)
+    if writer is not None:
+        writer.close()
+    if conn is not None:
+        run_id = _active_runs.get(db_path)
+        if run_id is not None:
+            _end_run(conn, run_id)
+        conn.close()
+
+
+@atexit.register
+def _close_all_databases():
+    """終了時に全コネクションをフラッシュしてクローズ"""
+    for db_path in list(_connections):
+        close_database(db_path)
 
 
 def init_database(db_path: str):
-    """データベースとテーブルを初期化"""
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS cycle_measurements (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            zone_name TEXT NOT NULL,
-            cycle_number INTEGER NOT NULL,
-            start_datetime TEXT NOT NULL,
-            end_datetime TEXT NOT NULL,
-            start_frame INTEGER,
-            end_frame INTEGER,
-            elapsed_seconds REAL NOT NULL,
-            adjusted_time_seconds REAL NOT NULL,
-            is_valid BOOLEAN NOT NULL DEFAULT 1,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS zone_targets (
-            zone_name TEXT PRIMARY KEY,
-            target_seconds REAL NOT NULL
-        )
-    """)
-
-    conn.commit()
-    conn.close()
+    """データベースとテーブルを初期化（既存DBは run 単位のスキーマに移行）"""
+    conn = get_connection(db_path)
+
+    with conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                started_at TEXT NOT NULL,
+                ended_at TEXT,
+                source TEXT,
+                video_id TEXT,
+                model_hash TEXT,
+                parameters TEXT,
+                cycle_count INTEGER
+            )
+        """)
+
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cycle_measurements (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                run_id INTEGER REFERENCES runs (id),
+                zone_name TEXT NOT NULL,
+                cycle_number INTEGER NOT NULL,
+                start_datetime TEXT NOT NULL,
+                end_datetime TEXT NOT NULL,
+                start_frame INTEGER,
+                end_frame INTEGER,
+                elapsed_seconds REAL NOT NULL,
+                adjusted_time_seconds REAL NOT NULL,
+                is_valid BOOLEAN NOT NULL DEFAULT 1,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS zone_targets (
+                zone_name TEXT PRIMARY KEY,
+                target_seconds REAL NOT NULL
+            )
+        """)
+
+        _migrate_legacy_cycles(conn)
+
+        # 1回分のレポート集計用（run + ゾーン）
+        conn.execute("DROP INDEX IF EXISTS idx_cycle_zone_valid")
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_cycle_run_zone
+            ON cycle_measurements (run_id, zone_name, is_valid)
+        """)
+        # 期間・ゾーン指定の推移集計用（複数の run をまたぐ）
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_cycle_zone_start
+            ON cycle_measurements (zone_name, start_datetime)
+        """)
+
     print("✅ Database initialized")
 
 
+def _utc_timestamp(value: datetime = None):
+    """runs の日時は created_at（SQLite の CURRENT_TIMESTAMP）と同じ UTC の 'YYYY-MM-DD HH:MM:SS'"""
+    return (value or datetime.now(timezone.utc)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _migrate_legacy_cycles(conn):
+    """
+    run_id 列のない旧スキーマのDBに列を追加し、既存サイクルを1件の run（source='legacy'）にまとめる
+
+    開始・終了は既存サイクルの created_at の範囲。移行直後に保持期間で消えないよう、
+    legacy の run は purge_old_runs の自動削除の対象外
+    """
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(cycle_measurements)")]
+    if "run_id" not in columns:
+        conn.execute("ALTER TABLE cycle_measurements ADD COLUMN run_id INTEGER REFERENCES runs (id)")
+
+    legacy = conn.execute("""
+        SELECT MIN(created_at), MAX(created_at), COUNT(*) FROM cycle_measurements WHERE run_id IS NULL
+    """).fetchone()
+    if legacy[2]:
+        cursor = conn.execute("""
+            INSERT INTO runs (started_at, ended_at, source, cycle_count) VALUES (?, ?, 'legacy', ?)
+        """, legacy)
+        conn.execute("UPDATE cycle_measurements SET run_id = ? WHERE run_id IS NULL", (cursor.lastrowid,))
+        print(f"🗂️ Migrated {legacy[2]} existing cycles to run #{cursor.lastrowid}")
+
+
+def start_run(db_path: str, source: str = None, video_id: str = None, model_hash: str = None,
+              parameters: dict = None):
+    """測定1回分の run を登録し、以降に保存するサイクルをこの run に紐づける"""
+    flush_database(db_path)
+    conn = get_connection(db_path)
+
+    with conn:
+        cursor = conn.execute("""
+            INSERT INTO runs (started_at, source, video_id, model_hash, parameters)
+            VALUES (?, ?, ?, ?, ?)
+        """, (_utc_timestamp(), source, video_id, model_hash,
+              json.dumps(parameters, sort_keys=True) if parameters is not None else None))
+    run_id = cursor.lastrowid
+
+    with _registry_lock:
+        _active_runs[db_path] = run_id
+        writer = _writers.get(db_path)
+        if writer is not None:
+            writer.run_id = run_id
+
+    print(f"🗂️ Run #{run_id} started ({source or 'unknown source'})")
+    return run_id
+
+
+def _end_run(conn, run_id: int):
+    with conn:
+        conn.execute("""
+            UPDATE runs SET
+                ended_at = ?,
+                cycle_count = (SELECT COUNT(*) FROM cycle_measurements WHERE run_id = ? AND is_valid = 1)
+            WHERE id = ?
+        """, (_utc_timestamp(), run_id, run_id))
+
+
+def current_run_id(db_path: str):
+    """このプロセスで実行中（または直前に実行した）run の id。なければDB内の最新の run"""
+    run_id = _active_runs.get(db_path)
+    if run_id is not None:
+        return run_id
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT MAX(id) FROM runs").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def list_runs(db_path: str, limit: int = 20):
+    """新しい順に run の一覧を取得"""
+    conn = get_connection(db_path)
+    cursor = conn.execute("""
+        SELECT id, started_at, ended_at, source, video_id, model_hash, parameters, cycle_count
+        FROM runs ORDER BY id DESC LIMIT ?
+    """, (limit,))
+    columns = [description[0] for description in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def purge_old_runs(db_path: str, retention_days: float = RUN_RETENTION_DAYS, include_legacy: bool = False):
+    """
+    retention_days より前に開始した run とそのサイクルを削除し、空き領域を返す
+
+    実行中の run は削除しない。旧スキーマから移行した run（source='legacy'）は
+    include_legacy=True のときだけ削除する。retention_days が None なら何もしない
+    """
+    if retention_days is None:
+        return 0
+    flush_database(db_path)
+    conn = get_connection(db_path)
+    cutoff = _utc_timestamp(datetime.now(timezone.utc) - timedelta(days=retention_days))
+
+    with conn:
+        run_ids = [row[0] for row in conn.execute("""
+            SELECT id FROM runs
+            WHERE started_at < ? AND id IS NOT ? AND (? OR source IS NOT 'legacy')
+        """, (cutoff, _active_runs.get(db_path), include_legacy))]
+        if not run_ids:
+            return 0
+        placeholders = ",".join("?" * len(run_ids))
+        deleted = conn.execute(f"DELETE FROM cycle_measurements WHERE run_id IN ({placeholders})",
+                               run_ids).rowcount
+        conn.execute(f"DELETE FROM runs WHERE id IN ({placeholders})", run_ids)
+
+    # auto_vacuum=INCREMENTAL のDBでは削除した分のページをファイルから解放
+    conn.execute("PRAGMA incremental_vacuum")
+    print(f"🧹 Purged {len(run_ids)} runs older than {retention_days:g} days ({deleted} cycles)")
+    return len(run_ids)
+
+
 def clear_database(db_path: str):
     """データベースの全データを削除（テーブル構造は維持）"""
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
-    cursor.execute("DELETE FROM cycle_measurements")
-    cursor.execute("DELETE FROM zone_targets")
-    
-    conn.commit()
-    conn.close()
+    flush_database(db_path)
+    conn = get_connection(db_path)
+
+    with conn:
+        conn.execute("DELETE FROM cycle_measurements")
+        conn.execute("DELETE FROM runs")
+        conn.execute("DELETE FROM zone_targets")
+
+    with _registry_lock:
+        _active_runs.pop(db_path, None)
+
     print("✅ Database cleared (all data deleted)")
 
 
-def set_zone_targets(db_path: str, target_seconds: float = 5.0):
+def set_zone_targets(db_path: str, target_seconds: float = 5.0, zones: list = TARGET_ZONES):
     """各ゾーンの目標時間を設定"""
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    conn = get_connection(db_path)
 
-    for zone in TARGET_ZONES:
-        cursor.execute("""
+    with conn:
+        conn.executemany("""
             INSERT OR REPLACE INTO zone_targets (zone_name, target_seconds)
             VALUES (?, ?)
-        """, (zone, target_seconds))
+        """, [(zone, target_seconds) for zone in zones])
 
-    conn.commit()
-    conn.close()
     print(f"✅ Target time set: {target_seconds}s for all zones")
 
 
+def get_zone_targets(db_path: str):
+    """各ゾーンの目標時間を取得"""
+    conn = get_connection(db_path)
+    rows = conn.execute("SELECT zone_name, target_seconds FROM zone_targets").fetchall()
+    return dict(rows)
+
+
 def save_cycle_to_db(db_path: str, cycle_data: dict):
-    """1サイクルのデータをデータベースに保存"""
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        INSERT INTO cycle_measurements (
-            zone_name, cycle_number, start_datetime, end_datetime,
-            start_frame, end_frame, elapsed_seconds, adjusted_time_seconds,
-            is_valid
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
-        cycle_data['zone_name'],
-        cycle_data['cycle_number'],
-        cycle_data['start_datetime'],
-        cycle_data['end_datetime'],
-        cycle_data['start_frame'],
-        cycle_data['end_frame'],
-        cycle_data['elapsed_seconds'],
-        cycle_data['adjusted_time_seconds'],
-        1
-    ))
+    """1サイクルのデータを保存（グループコミットでまとめて書き込み）"""
+    get_cycle_writer(db_path).add(cycle_data)
 
-    conn.commit()
-    conn.close()
 
+# LLM分析用CSVの列（report.CYCLE_CSV_COLUMNS と同じ）。1回分の有効サイクルをゾーン・サイクル番号順に取得
+EXPORT_CYCLES_QUERY = """
+    SELECT
+        zone_name,
+        cycle_number,
+        start_datetime,
+        end_datetime,
+        start_frame,
+        end_frame,
+        elapsed_seconds,
+        adjusted_time_seconds,
+        created_at
+    FROM cycle_measurements
+    WHERE run_id = ? AND is_valid = 1
+    ORDER BY zone_name, cycle_number
+"""
 
-def export_cycle_data_csv(db_path: str, output_path: str):
-    """LLM分析用に全サイクルデータをCSVエクスポート"""
-    conn = sqlite3.connect(db_path)
 
-    query = """
-        SELECT
-            zone_name,
-            cycle_number,
-            start_datetime,
-            end_datetime,
-            start_frame,
-            end_frame,
-            elapsed_seconds,
-            adjusted_time_seconds,
-            created_at
-        FROM cycle_measurements
-        WHERE is_valid = 1
-        ORDER BY zone_name, cycle_number
+def export_cycle_data_csv(db_path: str, output_path: str, run_id: int = None):
     """
+    LLM分析用に1回分の全サイクルデータをCSVエクスポートし、DataFrame として返す
 
-    df = pd.read_sql_query(query, conn)
-    conn.close()
+    run_id を省略すると current_run_id（今回の測定）のサイクルを出力。
+    全件をメモリに載せるため、大きなDBを書き出すだけなら write_cycle_data_csv を使う
+    """
+    if run_id is None:
+        run_id = current_run_id(db_path)
+
+    conn = sqlite3.connect(db_path)
+    try:
+        df = pd.read_sql_query(EXPORT_CYCLES_QUERY, conn, params=(run_id,))
+    finally:
+        conn.close()
 
     df.to_csv(output_path, index=False)
     print(f"\n✅ Cycle data CSV exported: {output_path} ({len(df)} records)")
 
-    return df
\ No newline at end of file
+    return df
+
+
+def write_cycle_data_csv(db_path: str, output_path: str, run_id: int = None, chunk_rows: int = EXPORT_CHUNK_ROWS):
+    """
+    export_cycle_data_csv と同じCSVを chunk_rows 件ずつ書き込み、書き込んだ件数を返す
+
+    全件を DataFrame に載せないため、DBの大きさによらずメモリ使用量が一定
+    """
+    if run_id is None:
+        run_id = current_run_id(db_path)
+
+    conn = sqlite3.connect(db_path)
+    count = 0
+    try:
+        cursor = conn.execute(EXPORT_CYCLES_QUERY, (run_id,))
+        with open(output_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow([description[0] for description in cursor.description])
+            while True:
+                rows = cursor.fetchmany(chunk_rows)
+                if not rows:
+                    break
+                writer.writerows(rows)
+                count += len(rows)
+    finally:
+        conn.close()
+
+    print(f"\n✅ Cycle data CSV exported: {output_path} ({count} records)")
+
+    return count
@@ -3,8 +3,29 @@
 YOLOv8を使った検出とゾーン判定
 """
 
+import numpy as np
 from typing import List, Dict
-from constants import CLASS_NAMES, CONFIDENCE_THRESHOLDS, TARGET_ZONES, STATIC_ZONES
+from constants import (
+    CLASS_NAMES, CONFIDENCE_THRESHOLDS, TARGET_ZONES, STATIC_ZONES,
+    ROI_PADDING, ROI_IMGSZ, WORKER_PASS_IMGSZ
+)
+
+# クラス名 → クラスID
+CLASS_IDS = {name: class_id for class_id, name in CLASS_NAMES.items()}
+
+# クラスIDごとの信頼度しきい値（未定義クラスは常に除外）
+_THRESHOLD_TABLE = np.full(max(CLASS_NAMES) + 1, np.inf)
+for _class_id, _threshold in CONFIDENCE_THRESHOLDS.items():
+    _THRESHOLD_TABLE[_class_id] = _threshold
+
+
+def zone_coords_array(static_zones: Dict[str, List[int]], zones: List[str]) -> np.ndarray:
+    """zones順のゾーン座標配列 (Z, 4)"""
+    return np.array([static_zones[zone] for zone in zones], dtype=int).reshape(-1, 4)
+
+
+# TARGET_ZONES順のゾーン座標配列 (Z, 4)
+ZONE_COORDS = zone_coords_array(STATIC_ZONES, TARGET_ZONES)
 
 
 def detect_objects(frame, model):
@@ -13,20 +34,181 @@ def detect_objects(frame, model):
     return results
 
 
-def count_workers(results):
-    """フレーム内のWorker数をカウント"""
-    worker_count = 0
+def detect_objects_batch(frames: List, model):
+    """複数フレームをまとめてYOLOv8で検出（フレーム順の結果リストを返す）"""
+    if not frames:
+        return []
+    results = model.predict(frames, imgsz=640, conf=0.10, verbose=False)
+    return list(results)
+
+
+def compute_roi(static_zones: Dict[str, List[int]], width: int, height: int,
+                padding: int = ROI_PADDING, scale: float = 1.0):
+    """
+    全ゾーンを囲む矩形に余白を加えたROI (x1, y1, x2, y2) を返す
+
+    scale: 元解像度 / フレーム解像度（縮小デコード時はゾーン座標をフレーム座標に換算）
+    """
+    coords = (np.array(list(static_zones.values()), dtype=float).reshape(-1, 4) / scale).astype(int)
+    x1 = max(0, int(coords[:, 0].min()) - padding)
+    y1 = max(0, int(coords[:, 1].min()) - padding)
+    x2 = min(width, int(coords[:, 2].max()) + padding)
+    y2 = min(height, int(coords[:, 3].max()) + padding)
+    return x1, y1, x2, y2
+
+
+def shift_detections(detections: Dict[str, np.ndarray], dx: int, dy: int) -> Dict[str, np.ndarray]:
+    """ROI座標の検出結果をフレーム全体の座標に戻す"""
+    shifted = dict(detections)
+    shifted["boxes"] = detections["boxes"] + np.array([dx, dy, dx, dy], dtype=int)
+    return shifted
+
+
+def scale_detections(detections: Dict[str, np.ndarray], scale: float) -> Dict[str, np.ndarray]:
+    """縮小フレームの検出結果を元解像度の座標に戻す"""
+    scaled = dict(detections)
+    scaled["boxes"] = np.rint(detections["boxes"] * scale).astype(int)
+    return scaled
+
+
+def merge_detections(*detections_list: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """複数パスの検出結果を1つにまとめる"""
+    return {
+        key: np.concatenate([detections[key] for detections in detections_list])
+        for key in ("boxes", "confidences", "class_ids")
+    }
+
+
+def detect_objects_roi_batch(frames: List, model, roi):
+    """
+    ROIを切り出して推論し、フレーム全体座標の検出結果（しきい値適用前）を返す
+
+    ROIパスではゾーン判定に使うPallet/Assemblingのみ、Workerは縮小した全体画像の
+    別パスで数える（WORKER_PASS_IMGSZ が None の場合はROI内のWorkerを使用）
+    """
+    return detect_objects_rois_batch(frames, model, [roi] * len(frames))
+
+
+def detect_objects_rois_batch(frames: List, model, rois: List):
+    """フレームごとに異なるROIで推論（複数カメラのフレームを1バッチにまとめる場合）"""
+    if not frames:
+        return []
+
+    crops = [frame[y1:y2, x1:x2] for frame, (x1, y1, x2, y2) in zip(frames, rois)]
+
+    zone_classes = [CLASS_IDS["Pallet"], CLASS_IDS["Assembling"]]
+    if WORKER_PASS_IMGSZ is None:
+        zone_classes.append(CLASS_IDS["Worker"])
+
+    roi_results = model.predict(crops, imgsz=ROI_IMGSZ, conf=0.10, classes=zone_classes, verbose=False)
+    all_detections = [
+        shift_detections(extract_detections([r]), x1, y1)
+        for r, (x1, y1, _, _) in zip(roi_results, rois)
+    ]
+
+    if WORKER_PASS_IMGSZ is not None:
+        worker_results = model.predict(frames, imgsz=WORKER_PASS_IMGSZ, conf=0.10,
+                                       classes=[CLASS_IDS["Worker"]], verbose=False)
+        all_detections = [
+            merge_detections(detections, extract_detections([r]))
+            for detections, r in zip(all_detections, worker_results)
+        ]
+
+    return all_detections
+
+
+def infer_detections(frames: List, model, roi=None, scale: float = 1.0) -> List[Dict[str, np.ndarray]]:
+    """
+    フレームごとの検出結果（しきい値適用前）を返す。roi 指定時はROI推論
+
+    scale: 縮小デコードしたフレームの場合の 元解像度 / フレーム解像度（座標を元解像度に戻す）
+    """
+    if roi is not None:
+        all_detections = detect_objects_roi_batch(frames, model, roi)
+    else:
+        all_detections = [extract_detections([r]) for r in detect_objects_batch(frames, model)]
+    if scale != 1.0:
+        all_detections = [scale_detections(detections, scale) for detections in all_detections]
+    return all_detections
+
+
+def extract_detections(results) -> Dict[str, np.ndarray]:
+    """検出結果から box / conf / cls を一度だけCPUへ取り出す"""
+    boxes, confidences, class_ids = [], [], []
 
     for r in results:
-        class_ids = r.boxes.cls.cpu().numpy().astype(int)
-        confidences = r.boxes.conf.cpu().numpy()
+        boxes.append(r.boxes.xyxy.cpu().numpy().astype(int))
+        confidences.append(r.boxes.conf.cpu().numpy())
+        class_ids.append(r.boxes.cls.cpu().numpy().astype(int))
+
+    if not boxes:
+        return {
+            "boxes": np.zeros((0, 4), dtype=int),
+            "confidences": np.zeros(0, dtype=np.float32),
+            "class_ids": np.zeros(0, dtype=int)
+        }
+
+    return {
+        "boxes": np.concatenate(boxes).reshape(-1, 4),
+        "confidences": np.concatenate(confidences),
+        "class_ids": np.concatenate(class_ids)
+    }
+
+
+def filter_detections(detections: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """クラスごとの信頼度しきい値をマスクで適用"""
+    class_ids = detections["class_ids"]
+    known = (class_ids >= 0) & (class_ids < len(_THRESHOLD_TABLE))
+    thresholds = _THRESHOLD_TABLE[np.where(known, class_ids, 0)]
+    mask = known & (detections["confidences"] >= thresholds)
+
+    return {key: value[mask] for key, value in detections.items()}
+
+
+def parse_detections(results) -> Dict[str, np.ndarray]:
+    """検出結果を取り出し、しきい値を適用（1フレーム1回のパース）"""
+    return filter_detections(extract_detections(results))
+
+
+def compute_overlap_matrix(boxes: np.ndarray, zone_coords: np.ndarray) -> np.ndarray:
+    """ボックス×ゾーンの重なり行列 (N, Z) をブロードキャストで計算"""
+    bx1, by1, bx2, by2 = (boxes[:, i:i + 1] for i in range(4))
+    zx1, zy1, zx2, zy2 = (zone_coords[:, i] for i in range(4))
+    is_separated = (bx1 > zx2) | (bx2 < zx1) | (by1 > zy2) | (by2 < zy1)
+    return ~is_separated
+
 
-        for class_id, conf in zip(class_ids, confidences):
-            if class_id in CONFIDENCE_THRESHOLDS and conf >= CONFIDENCE_THRESHOLDS[class_id]:
-                label = CLASS_NAMES.get(class_id, "Unknown")
-                if label == "Worker":
-                    worker_count += 1
+def compute_zone_flags(detections: Dict[str, np.ndarray], zone_coords: np.ndarray = ZONE_COORDS):
+    """しきい値適用済みの検出からWorker数とゾーンごとの組立/パレット有無を計算"""
+    class_ids = detections["class_ids"]
+    overlap = compute_overlap_matrix(detections["boxes"], zone_coords)
 
+    worker_count = int(np.count_nonzero(class_ids == CLASS_IDS["Worker"]))
+    assembling = overlap[class_ids == CLASS_IDS["Assembling"]].any(axis=0)
+    pallet = overlap[class_ids == CLASS_IDS["Pallet"]].any(axis=0)
+
+    return worker_count, assembling, pallet
+
+
+def analyze_detections(detections: Dict[str, np.ndarray], zones: List[str] = TARGET_ZONES,
+                       zone_coords: np.ndarray = ZONE_COORDS):
+    """Worker数と各ゾーンの検出結果をまとめて返す"""
+    worker_count, assembling, pallet = compute_zone_flags(detections, zone_coords)
+
+    zone_detections = {
+        zone: {
+            "assembling": bool(assembling[i]),
+            "pallet": bool(pallet[i])
+        }
+        for i, zone in enumerate(zones)
+    }
+
+    return worker_count, zone_detections
+
+
+def count_workers(results):
+    """フレーム内のWorker数をカウント"""
+    worker_count, _ = analyze_detections(parse_detections(results))
     return worker_count
 
 
@@ -40,29 +222,5 @@ def check_overlap(box: List[int], zone_coords: List[int]) -> bool:
 
 def detect_zone_objects(results):
     """各ゾーン内のオブジェクトを検出"""
-    zone_detections = {}
-
-    for zone in TARGET_ZONES:
-        zone_detections[zone] = {
-            "assembling": False,
-            "pallet": False
-        }
-
-    for r in results:
-        boxes = r.boxes.xyxy.cpu().numpy().astype(int)
-        confidences = r.boxes.conf.cpu().numpy()
-        class_ids = r.boxes.cls.cpu().numpy().astype(int)
-
-        for box, conf, class_id in zip(boxes, confidences, class_ids):
-            if class_id in CONFIDENCE_THRESHOLDS and conf >= CONFIDENCE_THRESHOLDS[class_id]:
-                label = CLASS_NAMES.get(class_id, "Unknown")
-
-                for zone in TARGET_ZONES:
-                    zone_coords = STATIC_ZONES[zone]
-                    if check_overlap(box, zone_coords):
-                        if label == "Assembling":
-                            zone_detections[zone]["assembling"] = True
-                        elif label == "Pallet":
-                            zone_detections[zone]["pallet"] = True
-
-    return zone_detections
\ No newline at end of file
+    _, zone_detections = analyze_detections(parse_detections(results))
+    return zone_detections
@@ -0,0 +1,149 @@
+"""
+検出結果の記録・読み込み
+フレームごとの生の検出結果（しきい値適用前）をまとめて保存し、後から再利用
+"""
+
+import hashlib
+import json
+import os
+import numpy as np
+from typing import Dict
+from constants import (
+    DETECTION_CACHE_DIR, ROI_PADDING, ROI_IMGSZ, WORKER_PASS_IMGSZ, INFERENCE_BACKEND, EXPORT_PRECISION,
+    MOTION_GATING, MOTION_ZONE_PADDING, MOTION_DOWNSCALE, MOTION_PIXEL_THRESHOLD, MOTION_CHANGED_RATIO,
+    MOTION_MAX_REUSE_FRAMES, FUSE_MODEL
+)
+
+# 動画フィンガープリントに使う先頭・末尾のバイト数
+FINGERPRINT_CHUNK_BYTES = 16 * 1024 * 1024
+
+# file_checksum の結果（(絶対パス, 更新時刻, サイズ) → SHA-256）
+_checksum_cache = {}
+
+
+class DetectionRecorder:
+    """推論したフレームの検出結果を蓄積し、1つの .npz に保存"""
+
+    def __init__(self):
+        self.frame_numbers = []
+        self.counts = []
+        self.boxes = []
+        self.confidences = []
+        self.class_ids = []
+
+    def add(self, frame_number: int, detections: Dict[str, np.ndarray]):
+        """1フレーム分の検出結果を追加"""
+        self.frame_numbers.append(frame_number)
+        self.counts.append(len(detections["class_ids"]))
+        self.boxes.append(detections["boxes"].astype(np.int32))
+        self.confidences.append(detections["confidences"].astype(np.float32))
+        self.class_ids.append(detections["class_ids"].astype(np.int16))
+
+    def save(self, path: str, meta: dict = None):
+        """フレームごとの件数（オフセット）と連結した配列で保存"""
+        offsets = np.zeros(len(self.counts) + 1, dtype=np.int64)
+        np.cumsum(self.counts, out=offsets[1:])
+
+        # 書き込み途中のファイルをキャッシュとして読まないよう一時ファイル経由で保存
+        tmp_path = f"{os.path.splitext(path)[0]}.tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            frame_numbers=np.array(self.frame_numbers, dtype=np.int64),
+            offsets=offsets,
+            boxes=np.concatenate(self.boxes) if self.boxes else np.zeros((0, 4), dtype=np.int32),
+            confidences=np.concatenate(self.confidences) if self.confidences else np.zeros(0, dtype=np.float32),
+            class_ids=np.concatenate(self.class_ids) if self.class_ids else np.zeros(0, dtype=np.int16),
+            meta=np.array(json.dumps(meta or {}))
+        )
+        os.replace(tmp_path, path)
+        print(f"✅ Detections saved: {path} ({len(self.frame_numbers)} frames)")
+
+
+def load_detections(path: str):
+    """保存した検出結果を読み込む"""
+    with np.load(path) as data:
+        recorded = {key: data[key] for key in data.files}
+    recorded["meta"] = json.loads(str(recorded["meta"]))
+    return recorded
+
+
+def _recorded_entry(recorded: dict, i: int):
+    """i番目に記録されたフレームの検出結果を取り出す"""
+    start, end = recorded["offsets"][i], recorded["offsets"][i + 1]
+    return {
+        "boxes": recorded["boxes"][start:end].astype(int),
+        "confidences": recorded["confidences"][start:end],
+        "class_ids": recorded["class_ids"][start:end].astype(int)
+    }
+
+
+def iter_recorded_detections(recorded: dict):
+    """(フレーム番号, 検出結果) をフレーム順に返す"""
+    for i, frame_number in enumerate(recorded["frame_numbers"]):
+        yield int(frame_number), _recorded_entry(recorded, i)
+
+
+def get_recorded_detections(recorded: dict, frame_number: int):
+    """指定フレームの検出結果を返す（記録がなければ None）"""
+    frame_numbers = recorded["frame_numbers"]
+    i = int(np.searchsorted(frame_numbers, frame_number))
+    if i >= len(frame_numbers) or frame_numbers[i] != frame_number:
+        return None
+    return _recorded_entry(recorded, i)
+
+
+def file_checksum(path: str):
+    """ファイル全体のSHA-256（モデル重みなど小さめのファイル用。更新時刻・サイズが同じ間は再計算しない）"""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    if key not in _checksum_cache:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        _checksum_cache[key] = digest.hexdigest()
+    return _checksum_cache[key]
+
+
+def video_fingerprint(path: str):
+    """動画のフィンガープリント（サイズ + 先頭/末尾のSHA-256。数GBの動画でも即時）"""
+    size = os.path.getsize(path)
+    digest = hashlib.sha256(str(size).encode())
+    with open(path, "rb") as f:
+        digest.update(f.read(FINGERPRINT_CHUNK_BYTES))
+        if size > FINGERPRINT_CHUNK_BYTES:
+            f.seek(max(FINGERPRINT_CHUNK_BYTES, size - FINGERPRINT_CHUNK_BYTES))
+            digest.update(f.read(FINGERPRINT_CHUNK_BYTES))
+    return digest.hexdigest()
+
+
+def detection_cache_path(video_path: str, model_path: str, use_roi: bool, decode_width: int = None,
+                         half: bool = False):
+    """
+    動画・モデル・推論設定から検出キャッシュのパスを決める
+
+    half は実際に FP16 で推論するか（USE_HALF_PRECISION かつ CUDA 使用時）。
+    FP16・Conv+BN 融合で検出結果がわずかに変わるため、実効精度ごとに別キャッシュ
+    """
+    params = {
+        "imgsz": 640, "conf": 0.10, "roi": use_roi,
+        "roi_padding": ROI_PADDING, "roi_imgsz": ROI_IMGSZ, "worker_imgsz": WORKER_PASS_IMGSZ
+    }
+    if INFERENCE_BACKEND == "pytorch":
+        params.update(half=half, fuse=FUSE_MODEL)
+    if INFERENCE_BACKEND != "pytorch":
+        params.update(backend=INFERENCE_BACKEND, precision=EXPORT_PRECISION)
+    if decode_width:
+        params.update(decode_width=decode_width)
+    if MOTION_GATING:
+        # 再利用したフレームの検出結果も記録されるため、判定条件ごとに別キャッシュ
+        params.update(motion=[MOTION_ZONE_PADDING, MOTION_DOWNSCALE, MOTION_PIXEL_THRESHOLD,
+                              MOTION_CHANGED_RATIO, MOTION_MAX_REUSE_FRAMES])
+    key = hashlib.sha256("|".join([
+        video_fingerprint(video_path),
+        file_checksum(model_path),
+        json.dumps(params, sort_keys=True)
+    ]).encode()).hexdigest()[:24]
+
+    video_id = os.path.splitext(os.path.basename(video_path))[0]
+    return os.path.join(DETECTION_CACHE_DIR, f"{video_id}_{key}.npz")
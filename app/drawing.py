@@ -5,32 +5,26 @@
 
 import cv2
 from typing import List, Dict
-from constants import CLASS_NAMES, CONFIDENCE_THRESHOLDS, TARGET_ZONES, STATIC_ZONES
+from constants import CLASS_NAMES, TARGET_ZONES, STATIC_ZONES
 
 
-def draw_detections(frame, results):
-    """検出結果をフレームに描画"""
-    for r in results:
-        boxes = r.boxes.xyxy.cpu().numpy().astype(int)
-        confidences = r.boxes.conf.cpu().numpy()
-        class_ids = r.boxes.cls.cpu().numpy().astype(int)
+def draw_detections(frame, detections: dict):
+    """検出結果（しきい値適用済み）をフレームに描画"""
+    for box, conf, class_id in zip(detections["boxes"], detections["confidences"], detections["class_ids"]):
+        label = CLASS_NAMES.get(class_id, "Unknown")
 
-        for box, conf, class_id in zip(boxes, confidences, class_ids):
-            if class_id in CONFIDENCE_THRESHOLDS and conf >= CONFIDENCE_THRESHOLDS[class_id]:
-                label = CLASS_NAMES.get(class_id, "Unknown")
-
-                x1, y1, x2, y2 = box
-                box_color = (0, 255, 0)
-                thickness = 1
-                if label == "Assembling":
-                    box_color = (255, 0, 0)
+        x1, y1, x2, y2 = box
+        box_color = (0, 255, 0)
+        thickness = 1
+        if label == "Assembling":
+            box_color = (255, 0, 0)
 
-                cv2.rectangle(frame, (x1, y1), (x2, y2), box_color, 2)
-                text = f"{label} {conf:.2f}"
-                if label == "Worker":
-                    cv2.putText(frame, text, (x1, y2 + 15), cv2.FONT_HERSHEY_SIMPLEX, 0.5, box_color, thickness)
-                else:
-                    cv2.putText(frame, text, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, box_color, thickness)
+        cv2.rectangle(frame, (x1, y1), (x2, y2), box_color, 2)
+        text = f"{label} {conf:.2f}"
+        if label == "Worker":
+            cv2.putText(frame, text, (x1, y2 + 15), cv2.FONT_HERSHEY_SIMPLEX, 0.5, box_color, thickness)
+        else:
+            cv2.putText(frame, text, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, box_color, thickness)
 
 
 
@@ -98,9 +92,9 @@ def draw_worker_count(frame, worker_count: int):
                 cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 255, 0), 2)
 
 
-def annotate_frame(frame, results, zone_states: dict, worker_count: int, current_time_sec: float):
+def annotate_frame(frame, detections: dict, zone_states: dict, worker_count: int, current_time_sec: float):
     """フレームに全ての情報を描画"""
-    draw_detections(frame, results)
+    draw_detections(frame, detections)
     draw_static_zones(frame, STATIC_ZONES)
     draw_all_zone_statuses(frame, zone_states, current_time_sec)
     draw_worker_count(frame, worker_count)
\ No newline at end of file
@@ -0,0 +1,70 @@
+"""
+測定履歴の参照・整理
+DBに残した過去の測定（run）の一覧、週ごとのサイクルタイム推移、古い run の削除
+
+使い方:
+    python history.py runs                          # 直近の run 一覧
+    python history.py trend --weeks 12 --output data/output/zone_trend.csv
+    python history.py purge --days 30               # 30日より前の run を削除（旧DBから移行した run は残す）
+    python history.py purge --days 30 --include-legacy
+"""
+
+import argparse
+import json
+from constants import DB_PATH, TARGET_ZONES, RUN_RETENTION_DAYS
+from database import init_database, list_runs, purge_old_runs
+from report import load_zone_trend
+
+
+def print_runs(db_path: str, limit: int = 20):
+    """run 一覧を新しい順に表示"""
+    runs = list_runs(db_path, limit)
+    if not runs:
+        print("⚠️ No runs recorded")
+        return runs
+
+    for run in runs:
+        parameters = json.loads(run["parameters"]) if run["parameters"] else {}
+        stride = parameters.get("inference_stride", "-")
+        print(f"#{run['id']:<5} {run['started_at']} → {run['ended_at'] or 'running':<19} "
+              f"cycles {run['cycle_count'] if run['cycle_count'] is not None else '-':>6} "
+              f"stride {stride} | {run['source'] or '-'} (model {(run['model_hash'] or '-')[:12]})")
+    return runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CycleEye measurement history")
+    parser.add_argument("--db", default=DB_PATH, help="測定履歴のDB")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    runs_parser = subparsers.add_parser("runs", help="run の一覧を表示")
+    runs_parser.add_argument("--limit", type=int, default=20, help="表示件数")
+
+    trend_parser = subparsers.add_parser("trend", help="週ごと・ゾーンごとのサイクルタイム推移")
+    trend_parser.add_argument("--weeks", type=int, default=8, help="集計する週数")
+    trend_parser.add_argument("--zones", nargs="+", default=TARGET_ZONES, help="集計するゾーン")
+    trend_parser.add_argument("--output", default=None, help="CSVの出力先（省略時は表示のみ）")
+
+    purge_parser = subparsers.add_parser("purge", help="古い run とそのサイクルを削除")
+    purge_parser.add_argument("--days", type=float, default=RUN_RETENTION_DAYS, help="保持する日数")
+    purge_parser.add_argument("--include-legacy", action="store_true",
+                              help="旧スキーマから移行した run（source=legacy）も削除対象にする")
+    args = parser.parse_args()
+
+    init_database(args.db)
+
+    if args.command == "runs":
+        return print_runs(args.db, args.limit)
+    if args.command == "purge":
+        return purge_old_runs(args.db, args.days, args.include_legacy)
+
+    trend = load_zone_trend(args.db, args.weeks, args.zones)
+    print(trend.to_string(index=False) if not trend.empty else "⚠️ No cycles in range")
+    if args.output:
+        trend.to_csv(args.output, index=False)
+        print(f"\n✅ Zone trend exported: {args.output}")
+    return trend
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+"""
+推論バックエンド関連
+best.pt を ONNX Runtime / OpenVINO 用に変換し、GPUのないCPU環境で推論
+変換後も ultralytics の YOLO として読み込むため、detect_objects などの呼び出しは共通
+
+使い方:
+    python inference_backend.py export --backend onnx --precision int8 --calibration-video data/input/simulation_video.mp4
+    python inference_backend.py parity data/input/simulation_video.mp4 --backend onnx --precision int8
+"""
+
+import argparse
+import os
+import shutil
+import cv2
+import numpy as np
+from ultralytics import YOLO
+
+from constants import (
+    MODEL_PATH, VIDEO_PATH, TARGET_ZONES, INFERENCE_BATCH_SIZE,
+    INFERENCE_BACKEND, EXPORT_PRECISION, CALIBRATION_FRAMES, PARITY_TIME_TOLERANCE_SEC
+)
+
+BACKENDS = ("pytorch", "onnx", "openvino")
+PRECISIONS = {
+    "onnx": ("fp32", "int8"),
+    "openvino": ("fp32", "fp16", "int8"),
+}
+
+# エクスポート時の入力サイズ（動的形状で出力するためROI推論の入力サイズにも対応）
+EXPORT_IMGSZ = 640
+
+
+def exported_model_path(model_path: str, backend: str, precision: str):
+    """変換後モデルのパス（best_int8.onnx / best_fp16_openvino_model/ など）"""
+    stem = os.path.splitext(model_path)[0]
+    if backend == "onnx":
+        return f"{stem}_{precision}.onnx"
+    return f"{stem}_{precision}_openvino_model"
+
+
+def _check_backend(backend: str, precision: str):
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown inference backend: {backend} (choose from {BACKENDS})")
+    if backend != "pytorch" and precision not in PRECISIONS[backend]:
+        raise ValueError(f"{backend} does not support {precision} (choose from {PRECISIONS[backend]})")
+
+
+def letterbox(frame: np.ndarray, imgsz: int = EXPORT_IMGSZ):
+    """YOLOの前処理と同じレターボックス変換（NCHW float32, 0〜1）"""
+    h, w = frame.shape[:2]
+    scale = min(imgsz / h, imgsz / w)
+    new_w, new_h = int(round(w * scale)), int(round(h * scale))
+    canvas = np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+    top, left = (imgsz - new_h) // 2, (imgsz - new_w) // 2
+    canvas[top:top + new_h, left:left + new_w] = cv2.resize(frame, (new_w, new_h),
+                                                            interpolation=cv2.INTER_LINEAR)
+    image = canvas[:, :, ::-1].transpose(2, 0, 1).astype(np.float32) / 255.0
+    return np.ascontiguousarray(image[None])
+
+
+def sample_frames(video_path: str, num_frames: int):
+    """動画全体から等間隔にフレームを取り出す"""
+    cap = cv2.VideoCapture(video_path)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    indices = np.linspace(0, max(0, total_frames - 1), num=min(num_frames, max(1, total_frames)), dtype=int)
+
+    frames = []
+    for index in indices:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, int(index))
+        ret, frame = cap.read()
+        if ret:
+            frames.append(frame)
+    cap.release()
+    return frames
+
+
+class VideoCalibrationReader:
+    """ONNX Runtime の静的量子化に現場の動画フレームを渡すキャリブレーションデータ"""
+
+    def __init__(self, video_path: str, input_name: str, num_frames: int = CALIBRATION_FRAMES):
+        self.input_name = input_name
+        self.frames = sample_frames(video_path, num_frames)
+        self.iterator = iter(self.frames)
+        print(f"📐 Calibration frames: {len(self.frames)} from {video_path}")
+
+    def get_next(self):
+        frame = next(self.iterator, None)
+        if frame is None:
+            return None
+        return {self.input_name: letterbox(frame)}
+
+    def rewind(self):
+        self.iterator = iter(self.frames)
+
+
+def quantize_onnx_int8(onnx_path: str, output_path: str, calibration_video: str):
+    """ONNXモデルを動画フレームでキャリブレーションしてINT8に静的量子化"""
+    import onnxruntime as ort
+    from onnxruntime.quantization import quantize_static, QuantFormat, QuantType
+
+    input_name = ort.InferenceSession(onnx_path, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+    quantize_static(
+        onnx_path, output_path, VideoCalibrationReader(calibration_video, input_name),
+        quant_format=QuantFormat.QDQ, activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8, per_channel=True
+    )
+
+
+def export_model(model_path: str = MODEL_PATH, backend: str = INFERENCE_BACKEND,
+                 precision: str = EXPORT_PRECISION, calibration_video: str = VIDEO_PATH,
+                 calibration_data: str = None):
+    """
+    best.pt を指定バックエンド用に変換し、変換後モデルのパスを返す
+
+    ONNX の INT8 は calibration_video のフレームで静的量子化。
+    OpenVINO の INT8 は ultralytics のデータセット YAML（calibration_data）が必要
+    """
+    _check_backend(backend, precision)
+    if backend == "pytorch":
+        return model_path
+
+    output_path = exported_model_path(model_path, backend, precision)
+    model = YOLO(model_path)
+    print(f"📦 Exporting {os.path.basename(model_path)} → {backend} ({precision})")
+
+    if backend == "onnx":
+        exported = model.export(format="onnx", imgsz=EXPORT_IMGSZ, dynamic=True, simplify=True)
+        if precision == "int8":
+            quantize_onnx_int8(exported, output_path, calibration_video)
+            os.remove(exported)
+        else:
+            shutil.move(exported, output_path)
+    else:
+        if precision == "int8" and not calibration_data:
+            raise ValueError("OpenVINO int8 export needs a calibration dataset YAML (calibration_data)")
+        exported = model.export(format="openvino", imgsz=EXPORT_IMGSZ, dynamic=True,
+                                half=precision == "fp16", int8=precision == "int8",
+                                data=calibration_data)
+        if os.path.exists(output_path):
+            shutil.rmtree(output_path)
+        shutil.move(exported, output_path)
+
+    print(f"✅ Exported model: {output_path}")
+    return output_path
+
+
+def load_backend_model(model_path: str = MODEL_PATH, backend: str = INFERENCE_BACKEND,
+                       precision: str = EXPORT_PRECISION):
+    """変換済みモデルを読み込む（なければ変換してから読み込む）"""
+    _check_backend(backend, precision)
+    exported_path = exported_model_path(model_path, backend, precision)
+    if not os.path.exists(exported_path):
+        exported_path = export_model(model_path, backend, precision)
+
+    model = YOLO(exported_path, task="detect")
+    print(f"✅ Model loaded on cpu ({backend} {precision}: {exported_path})")
+    return model
+
+
+def _box_iou(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    """(N, 4) と (M, 4) のIoU行列"""
+    x1 = np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+    y1 = np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+    x2 = np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+    y2 = np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1)
+
+
+def match_detections(reference: dict, candidate: dict, iou_threshold: float = 0.5):
+    """同じクラスでIoUが閾値以上の検出を1対1で対応づけ、(対応数, 平均IoU) を返す"""
+    matched, ious = 0, []
+    for class_id in np.union1d(reference["class_ids"], candidate["class_ids"]):
+        ref_boxes = reference["boxes"][reference["class_ids"] == class_id]
+        cand_boxes = candidate["boxes"][candidate["class_ids"] == class_id]
+        if not len(ref_boxes) or not len(cand_boxes):
+            continue
+        iou = _box_iou(ref_boxes, cand_boxes)
+        while iou.size and iou.max() >= iou_threshold:
+            i, j = np.unravel_index(iou.argmax(), iou.shape)
+            ious.append(iou[i, j])
+            matched += 1
+            iou[i, :] = -1
+            iou[:, j] = -1
+    return matched, float(np.mean(ious)) if ious else 0.0
+
+
+def compare_cycles(reference: list, candidate: list, tolerance_sec: float = PARITY_TIME_TOLERANCE_SEC):
+    """ゾーンごとにサイクル数と各サイクルタイムの差を比較"""
+    zone_results = {}
+    for zone in TARGET_ZONES:
+        ref_times = [c["adjusted_time_seconds"] for c in reference if c["zone_name"] == zone]
+        cand_times = [c["adjusted_time_seconds"] for c in candidate if c["zone_name"] == zone]
+        diffs = [abs(a - b) for a, b in zip(ref_times, cand_times)]
+        zone_results[zone] = {
+            "reference_cycles": len(ref_times),
+            "candidate_cycles": len(cand_times),
+            "max_diff_sec": round(max(diffs), 3) if diffs else 0.0,
+            "passed": len(ref_times) == len(cand_times) and all(d <= tolerance_sec for d in diffs)
+        }
+    return zone_results
+
+
+def parity_check(video_path: str = VIDEO_PATH, model_path: str = MODEL_PATH,
+                 backend: str = INFERENCE_BACKEND, precision: str = EXPORT_PRECISION,
+                 max_seconds: float = None, tolerance_sec: float = PARITY_TIME_TOLERANCE_SEC):
+    """
+    PyTorch と変換後モデルで同じ動画を測定し、検出とサイクル結果を比較
+
+    検出は同じクラス・IoU 0.5 以上で対応づけた割合、サイクルはゾーンごとの件数と
+    サイクルタイムの差（tolerance_sec 以内）で判定
+    """
+    from main import load_model, process_frame
+    from detection import infer_detections, filter_detections
+    from measurement import create_zone_states
+    from pipeline import read_frames, iter_batches
+    from video_utils import open_video
+
+    reference_model = load_model(model_path, backend="pytorch")
+    candidate_model = load_backend_model(model_path, backend, precision)
+
+    video_info = open_video(video_path)
+    if not video_info or reference_model is None:
+        return None
+    fps = video_info["fps"]
+    max_frames = int(max_seconds * fps) if max_seconds else None
+
+    states = {"reference": create_zone_states(), "candidate": create_zone_states()}
+    reference_count = candidate_count = matched_count = 0
+    ious = []
+
+    frames = read_frames(video_info["cap"])
+    try:
+        for chunk in iter_batches(frames, INFERENCE_BATCH_SIZE):
+            if max_frames and chunk[0][0] > max_frames:
+                break
+            batch = [frame for _, frame, _ in chunk]
+            outputs = {
+                "reference": infer_detections(batch, reference_model),
+                "candidate": infer_detections(batch, candidate_model)
+            }
+            for i, (current_frame, _, _) in enumerate(chunk):
+                detections = {name: filter_detections(outputs[name][i]) for name in outputs}
+                matched, mean_iou = match_detections(detections["reference"], detections["candidate"])
+                reference_count += len(detections["reference"]["class_ids"])
+                candidate_count += len(detections["candidate"]["class_ids"])
+                matched_count += matched
+                if matched:
+                    ious.append(mean_iou)
+
+                for name in states:
+                    process_frame(detections[name], states[name], current_frame, current_frame / fps, 1, None)
+    finally:
+        frames.close()
+        video_info["cap"].release()
+
+    cycles = {
+        name: [c for zone in TARGET_ZONES for c in zone_states[zone]["results"]]
+        for name, zone_states in states.items()
+    }
+    zone_results = compare_cycles(cycles["reference"], cycles["candidate"], tolerance_sec)
+    result = {
+        "backend": backend,
+        "precision": precision,
+        "detection_recall": round(matched_count / reference_count, 4) if reference_count else 1.0,
+        "detection_precision": round(matched_count / candidate_count, 4) if candidate_count else 1.0,
+        "mean_iou": round(float(np.mean(ious)), 4) if ious else 0.0,
+        "zones": zone_results,
+        "passed": all(zone["passed"] for zone in zone_results.values())
+    }
+
+    print("\n" + "="*80)
+    print(f"🔬 Parity check: pytorch vs {backend} ({precision})")
+    print("="*80)
+    print(f"Detections: recall {result['detection_recall']:.3f} / precision {result['detection_precision']:.3f} "
+          f"/ mean IoU {result['mean_iou']:.3f}")
+    for zone, zone_result in zone_results.items():
+        icon = "✅" if zone_result["passed"] else "❌"
+        print(f"{icon} {zone}: {zone_result['reference_cycles']} vs {zone_result['candidate_cycles']} cycles, "
+              f"max diff {zone_result['max_diff_sec']:.3f}s (tolerance {tolerance_sec}s)")
+    print(f"{'✅ Parity check passed' if result['passed'] else '❌ Parity check failed'}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CycleEye inference backend tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="best.pt を ONNX / OpenVINO に変換")
+    parity_parser = subparsers.add_parser("parity", help="PyTorch との測定結果を比較")
+    parity_parser.add_argument("video", nargs="?", default=VIDEO_PATH, help="比較に使う動画")
+    parity_parser.add_argument("--max-seconds", type=float, default=None, help="先頭から比較する秒数")
+    parity_parser.add_argument("--tolerance", type=float, default=PARITY_TIME_TOLERANCE_SEC,
+                               help="許容するサイクルタイムの差（秒）")
+
+    for subparser in (export_parser, parity_parser):
+        subparser.add_argument("--model", default=MODEL_PATH, help="YOLOモデル（.pt）のパス")
+        subparser.add_argument("--backend", default=INFERENCE_BACKEND if INFERENCE_BACKEND != "pytorch" else "onnx",
+                               choices=BACKENDS[1:], help="変換先バックエンド")
+        subparser.add_argument("--precision", default=EXPORT_PRECISION, choices=("fp32", "fp16", "int8"),
+                               help="変換後の精度")
+    export_parser.add_argument("--calibration-video", default=VIDEO_PATH, help="ONNX INT8 のキャリブレーション動画")
+    export_parser.add_argument("--calibration-data", default=None, help="OpenVINO INT8 のデータセット YAML")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        return export_model(args.model, args.backend, args.precision, args.calibration_video, args.calibration_data)
+    return parity_check(args.video, args.model, args.backend, args.precision, args.max_seconds, args.tolerance)
+
+
+if __name__ == "__main__":
+    main()
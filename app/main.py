@@ -4,6 +4,9 @@
 """
 
 import os
+import shutil
+import time
+import numpy as np
 import torch
 from datetime import datetime
 from ultralytics import YOLO
@@ -11,32 +14,119 @@ from ultralytics import YOLO
 # 自作モジュールのインポート
 from constants import (
     MODEL_PATH, VIDEO_PATH, DB_PATH, OUTPUT_DIR, 
-    OUTPUT_VIDEO_PATH, FPS
+    OUTPUT_VIDEO_PATH, FPS, TARGET_ZONES, INFERENCE_BATCH_SIZE,
+    USE_PIPELINE, PIPELINE_QUEUE_SIZE, INFERENCE_STRIDE, ADAPTIVE_STRIDE,
+    USE_ROI_INFERENCE, STATIC_ZONES, WRITE_ANNOTATED_VIDEO, SAVE_RAW_DETECTIONS, DETECTIONS_PATH,
+    USE_DETECTION_CACHE, INCREMENTAL_REPORTS, CLIP_SELECTION, VIDEO_MARGIN_SECONDS,
+    LIVE_CLIPS, LIVE_CLIP_BUFFER_MB, LIVE_CLIP_JPEG_QUALITY, INFERENCE_BACKEND, EXPORT_PRECISION,
+    USE_HALF_PRECISION, FUSE_MODEL, FIXED_INPUT_SHAPE, WARMUP_ITERATIONS, INFERENCE_DECODE_WIDTH, MOTION_GATING,
+    USE_TRACKING, EXPORT_PARQUET, PARQUET_DIR_NAME, CONFIDENCE_THRESHOLDS, N_FRAMES_GRACE_START,
+    N_FRAMES_GRACE_STOP,
+    METRICS_PORT, METRICS_BIND_ADDRESS, METRICS_LOG_PATH, METRICS_LOG_INTERVAL_SEC
 )
-from database import init_database, clear_database, set_zone_targets
-from detection import detect_objects, count_workers, detect_zone_objects
-from measurement import initialize_zone_states, update_zone_state, mark_invalid_cycles
-from drawing import annotate_frame
-from video_utils import open_video, create_video_writer, extract_longest_cycle_videos
-from report import generate_all_reports
+from database import (
+    init_database, purge_old_runs, start_run, set_zone_targets, close_database, get_zone_targets
+)
+from detection import (
+    infer_detections, extract_detections, filter_detections, analyze_detections, compute_roi,
+    compute_zone_flags, ZONE_COORDS
+)
+from measurement import (
+    create_zone_states, update_zone_state, mark_invalid_cycles, snapshot_zone_states,
+    is_near_transition, get_timing_resolution
+)
+from video_utils import open_video, create_video_writer, extract_cycle_clips
+from report import generate_all_reports, IncrementalReport
+from parquet_export import export_cycle_data_parquet
+from pipeline import read_frames, threaded_read_frames, iter_batches, FrameWriter
+from clip_buffer import LiveClipRecorder
+from inference_backend import load_backend_model
+from motion_gate import MotionGate
+from tracker import ObjectTracker
+from zone_engine import ZoneStateEngine
+from metrics import (
+    MetricsExporter, STAGE_SECONDS, FRAMES_TOTAL, INFERRED_FRAMES_TOTAL, REUSED_FRAMES_TOTAL, CYCLES_TOTAL
+)
+from detection_store import (
+    DetectionRecorder, load_detections, get_recorded_detections, detection_cache_path, file_checksum,
+    video_fingerprint
+)
+
 
+def run_parameters(zones: list = TARGET_ZONES):
+    """測定結果に影響する設定（run ごとにDBへ記録し、履歴の比較に使う）"""
+    return {
+        "zones": list(zones),
+        "fps": FPS,
+        "inference_stride": INFERENCE_STRIDE,
+        "adaptive_stride": ADAPTIVE_STRIDE,
+        "grace_start": N_FRAMES_GRACE_START,
+        "grace_stop": N_FRAMES_GRACE_STOP,
+        "confidence_thresholds": CONFIDENCE_THRESHOLDS,
+        "roi": USE_ROI_INFERENCE,
+        "motion_gating": MOTION_GATING,
+        "tracking": USE_TRACKING,
+        "backend": INFERENCE_BACKEND,
+        "precision": EXPORT_PRECISION
+    }
+
+
+def setup_environment(db_path: str = DB_PATH, output_dir: str = OUTPUT_DIR, zones: list = TARGET_ZONES,
+                      source: str = None, model_path: str = None):
+    """
+    環境セットアップを実行
+
+    DBは消去せず、保持期間を過ぎた run だけを削除してから今回の run を登録する
+    （source が動画ファイルならフィンガープリント、model_path があれば重みのハッシュも記録）
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    init_database(db_path)
+    purge_old_runs(db_path)
+    set_zone_targets(db_path, target_seconds=5.0, zones=zones)
 
-def setup_environment():
-    """環境セットアップを実行"""
-    init_database(DB_PATH)
-    clear_database(DB_PATH)
-    set_zone_targets(DB_PATH, target_seconds=5.0)
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-    print(f"📁 Output directory: {OUTPUT_DIR}\n")
+    video_id = source
+    if source and os.path.isfile(source):
+        video_id = video_fingerprint(source)
+    model_hash = file_checksum(model_path) if model_path and os.path.isfile(model_path) else None
+    run_id = start_run(db_path, source, video_id, model_hash, run_parameters(zones))
+    print(f"📁 Output directory: {output_dir}\n")
+    return run_id
 
 
-def load_model(model_path: str):
-    """YOLOv8モデルをロード"""
+# ウォームアップ済みの (モデル, 幅, 高さ, バッチ, ROI)
+_warmed_up = set()
+
+
+def load_model(model_path: str, backend: str = INFERENCE_BACKEND, precision: str = EXPORT_PRECISION):
+    """
+    YOLOv8モデルをロード（backend が pytorch 以外なら変換済みモデルをCPUで使用）
+
+    CUDA では FP16（USE_HALF_PRECISION）、Conv+BN の融合（FUSE_MODEL）、
+    入力形状固定時の cuDNN ベンチマーク（FIXED_INPUT_SHAPE）を有効にする
+    """
     try:
+        started = time.monotonic()
+        if backend != "pytorch":
+            model = load_backend_model(model_path, backend, precision)
+            print(f"⏱️ Model load: {time.monotonic() - started:.2f}s")
+            return model
+
         device = "cuda" if torch.cuda.is_available() else "cpu"
         model = YOLO(model_path)
         model.to(device)
-        print(f"✅ Model loaded on {device}")
+        if FUSE_MODEL:
+            model.fuse()
+
+        half = use_half_precision()
+        if half:
+            # predict の既定値として全呼び出しに適用
+            model.overrides["half"] = True
+        if FIXED_INPUT_SHAPE and device == "cuda":
+            torch.backends.cudnn.benchmark = True
+
+        print(f"✅ Model loaded on {device} (fp16: {'on' if half else 'off'}, "
+              f"fused: {'on' if FUSE_MODEL else 'off'})")
+        print(f"⏱️ Model load: {time.monotonic() - started:.2f}s")
         return model
     except Exception as e:
         print(f"❌ Error loading model: {model_path}")
@@ -44,72 +134,390 @@ def load_model(model_path: str):
         return None
 
 
-def run_measurement_loop(model, video_info: dict, output_video_path: str):
-    """測定メインループを実行"""
+def warmup_model(model, width: int, height: int, batch_size: int = INFERENCE_BATCH_SIZE, roi=None,
+                 iterations: int = WARMUP_ITERATIONS):
+    """
+    本番と同じ形状のダミーフレームで推論し、遅延初期化（予測器の構築・cuDNNの
+    アルゴリズム選択など）を測定開始前に済ませる。経過時間（秒）を返す
+    """
+    key = (id(model), width, height, batch_size, roi)
+    if iterations <= 0 or key in _warmed_up:
+        return 0.0
+
+    started = time.monotonic()
+    frame = np.zeros((height, width, 3), dtype=np.uint8)
+    # 通常バッチと、適応ストライドの単独推論・最終バッチで使う1枚の形状
+    for size in sorted({batch_size, 1}, reverse=True):
+        for _ in range(iterations):
+            infer_detections([frame] * size, model, roi)
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+    _warmed_up.add(key)
+    elapsed = time.monotonic() - started
+    print(f"🔥 Warmup: {elapsed:.2f}s ({width}x{height}, batch {batch_size})")
+    return elapsed
+
+
+def process_frame(detections: dict, zone_states: dict, current_frame: int, current_time_sec: float,
+                  frame_step: int = 1, db_path: str = DB_PATH,
+                  zones: list = TARGET_ZONES, zone_coords=ZONE_COORDS):
+    """1フレーム分の検出結果でゾーン状態を更新し、Worker数とこのフレームで完了したサイクルを返す"""
+    if isinstance(zone_states, ZoneStateEngine):
+        # 重なり行列のフラグ配列をそのまま渡し、全ゾーンを一括更新
+        worker_count, assembling, pallet = compute_zone_flags(detections, zone_coords)
+        if worker_count >= 3:
+            zone_states.invalidate_measuring()
+        completed_cycles = zone_states.step(assembling, pallet, current_frame, current_time_sec,
+                                            frame_step, db_path)
+        for cycle_data in completed_cycles:
+            CYCLES_TOTAL.labels(cycle_data["zone_name"]).inc()
+        return worker_count, completed_cycles
+
+    # Worker数カウントと各ゾーンの検出（1回のパースでまとめて判定）
+    worker_count, zone_detections = analyze_detections(detections, zones, zone_coords)
+
+    # Worker数チェック
+    if worker_count >= 3:
+        mark_invalid_cycles(zone_states)
+
+    # 各ゾーンの状態更新
+    completed_cycles = []
+    for zone in zones:
+        assembling_detected = zone_detections[zone]["assembling"]
+        pallet_detected = zone_detections[zone]["pallet"]
+
+        cycle_data = update_zone_state(
+            zone_states[zone],
+            assembling_detected,
+            pallet_detected,
+            current_frame,
+            current_time_sec,
+            zone,
+            db_path,
+            frame_step
+        )
+        if cycle_data:
+            completed_cycles.append(cycle_data)
+            CYCLES_TOTAL.labels(zone).inc()
+
+    return worker_count, completed_cycles
+
+
+def infer_or_replay(frame_numbers: list, frames: list, model, roi, recorded: dict = None, scale: float = 1.0):
+    """推論、または記録済み検出結果の再生でフレームごとの検出結果を返す"""
+    if recorded is None:
+        return infer_detections(frames, model, roi, scale)
+
+    empty = extract_detections([])
+    return [get_recorded_detections(recorded, n) or empty for n in frame_numbers]
+
+
+def run_measurement_loop(model, video_info: dict, output_video_path: str,
+                         batch_size: int = INFERENCE_BATCH_SIZE,
+                         use_pipeline: bool = USE_PIPELINE,
+                         stride: int = INFERENCE_STRIDE,
+                         adaptive_stride: bool = ADAPTIVE_STRIDE,
+                         use_roi: bool = USE_ROI_INFERENCE,
+                         db_path: str = DB_PATH,
+                         detections_path: str = None,
+                         recorded: dict = None,
+                         live_clip_dir: str = None,
+                         report: IncrementalReport = None,
+                         motion_gating: bool = MOTION_GATING,
+                         use_tracking: bool = USE_TRACKING):
+    """
+    測定メインループを実行
+
+    output_video_path が None の場合は描画・動画書き出しを行わない（計測のみ）。
+    detections_path を指定すると生の検出結果を保存し、後から render_video.py で描画できる。
+    recorded（保存済み検出結果）を渡すとモデルを使わずに再計測する。
+    live_clip_dir を指定すると目標時間を超えたサイクルの動画を測定中に書き出す。
+    report を渡すと完了したサイクルを都度集計・CSV追記する。
+    motion_gating ではゾーン周辺に変化のないフレームの推論を省き、直前の検出結果を再利用する。
+    use_tracking では検出をトラックに対応づけて判定し、推論しないフレームも予測位置で状態を更新する
+    """
     cap = video_info["cap"]
     fps = video_info["fps"]
     width = video_info["width"]
     height = video_info["height"]
+    # 縮小デコード時の 元解像度 / フレーム解像度（検出座標を元解像度に戻す）
+    scale = video_info.get("scale", 1.0)
+
+    out = None
+    if output_video_path:
+        out = create_video_writer(output_video_path, fps, width, height)
+    recorder = DetectionRecorder() if detections_path else None
+
+    clip_recorder = None
+    zone_targets = {}
+    if out and live_clip_dir:
+        clip_recorder = LiveClipRecorder(live_clip_dir, fps, width, height, VIDEO_MARGIN_SECONDS,
+                                         LIVE_CLIP_BUFFER_MB, LIVE_CLIP_JPEG_QUALITY)
+        zone_targets = get_zone_targets(db_path) if db_path else {}
+
+    zone_states = create_zone_states()
+
+    batch_size = max(1, batch_size)
+    stride = max(1, stride)
+    roi = compute_roi(STATIC_ZONES, width, height, scale=scale) if use_roi else None
+    motion_gate = MotionGate(STATIC_ZONES, width, height, scale) if motion_gating and recorded is None else None
+    tracker = ObjectTracker() if use_tracking else None
+
+    # 推論しないフレームは直前の検出結果を描画に流用
+    last_sampled_frame = 0
+    last_frame = 0
+    detections = filter_detections(extract_detections([]))
+    last_raw_detections = extract_detections([])
+    worker_count = 0
+
+    # デコード・描画/書き出しは別スレッド、推論と状態更新はこのスレッドで実行
+    if recorded is not None and not out:
+        # 再計測かつ動画出力なし → デコードも不要
+        frames = (None for _ in range(recorded["meta"]["frames"]))
+        writer = None
+    elif use_pipeline:
+        frames = threaded_read_frames(cap, PIPELINE_QUEUE_SIZE)
+        writer = FrameWriter(out, PIPELINE_QUEUE_SIZE, clip_recorder) if out else None
+    else:
+        frames = read_frames(cap)
+        writer = FrameWriter(out, clip_recorder=clip_recorder) if out else None
 
-    out = create_video_writer(output_video_path, fps, width, height)
+    print("\n--- Starting 4-zone parallel measurement ---")
+    print(f"📅 Start time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print(f"🧮 Inference batch size: {batch_size} (pipeline: {'on' if use_pipeline else 'off'})")
+    print(f"⏱️ Inference stride: {stride} (adaptive: {'on' if adaptive_stride else 'off'}, "
+          f"resolution: {get_timing_resolution(stride, fps):.3f}s)")
+    print(f"🔲 ROI inference: {roi if roi else 'off'}")
+    print(f"🎯 Tracking: {f'on (min hits {tracker.min_hits}, max age {tracker.max_age})' if tracker else 'off'}")
+    print(f"🏃 Motion gating: {f'on (max reuse {motion_gate.max_reuse} frames)' if motion_gate else 'off'}")
+    print(f"♻️ Detections: {'replayed from cache' if recorded is not None else 'model inference'}")
+    print(f"🎥 Annotated video: {output_video_path if out else 'off (measure-only)'}\n")
+
+    inference_seconds = STAGE_SECONDS.labels("inference")
+    zone_update_seconds = STAGE_SECONDS.labels("zone_update")
+
+    # 最初のバッチまで（コールドスタート）と以降の定常スループットを分けて計測
+    loop_started = time.monotonic()
+    steady_started = None
+    steady_first_frame = 0
+
+    completed = False
+    try:
+        for chunk in iter_batches(frames, batch_size, stride):
+            scheduled = [(n, frame) for n, frame, is_scheduled in chunk if is_scheduled]
+            # ゾーン周辺が前回の推論から変化していないフレームは推論しない
+            reused = set()
+            if motion_gate:
+                with STAGE_SECONDS.time("motion_gate"):
+                    reused = {n for n, frame in scheduled if not motion_gate.should_infer(frame)}
+                scheduled = [(n, frame) for n, frame in scheduled if n not in reused]
+            inference_started = time.perf_counter()
+            batch_detections = iter(infer_or_replay([n for n, _ in scheduled], [f for _, f in scheduled],
+                                                    model, roi, recorded, scale))
+            if scheduled:
+                inference_seconds.observe(time.perf_counter() - inference_started)
+                INFERRED_FRAMES_TOTAL.inc(len(scheduled))
+
+            # フレーム順に状態更新し、描画・書き込みへ渡す
+            for current_frame, frame, is_scheduled in chunk:
+                current_time_sec = current_frame / fps
+                last_frame = current_frame
+
+                raw_detections = None
+                if current_frame in reused:
+                    raw_detections = last_raw_detections
+                    REUSED_FRAMES_TOTAL.inc()
+                elif is_scheduled:
+                    raw_detections = next(batch_detections)
+                elif adaptive_stride and is_near_transition(zone_states):
+                    # 判定の途中はスキップせずこのフレームも推論
+                    with STAGE_SECONDS.time("inference"):
+                        raw_detections = infer_or_replay([current_frame], [frame], model, roi, recorded,
+                                                         scale)[0]
+                    INFERRED_FRAMES_TOTAL.inc()
+
+                if raw_detections is not None:
+                    last_raw_detections = raw_detections
+                    if recorder:
+                        recorder.add(current_frame, raw_detections)
+
+                # 追跡ありでは推論しないフレームもトラックの予測位置で毎フレーム状態更新
+                if raw_detections is not None or tracker:
+                    # 固定ストライドでは猶予カウンタを経過フレーム数で加算（N_FRAMES_GRACE_* を換算）
+                    # 適応モード・追跡ありでは毎フレーム判定するため1フレームずつ加算
+                    frame_step = 1 if adaptive_stride or tracker else current_frame - last_sampled_frame
+                    zone_update_started = time.perf_counter()
+                    if raw_detections is None:
+                        detections = tracker.predict()
+                    else:
+                        detections = filter_detections(raw_detections)
+                        if tracker:
+                            detections = tracker.update(detections)
+                    worker_count, completed_cycles = process_frame(detections, zone_states, current_frame,
+                                                                   current_time_sec, frame_step, db_path)
+                    zone_update_seconds.observe(time.perf_counter() - zone_update_started)
+                    last_sampled_frame = current_frame
+                else:
+                    completed_cycles = []
+
+                if report:
+                    for cycle in completed_cycles:
+                        report.add_cycle(cycle)
+                FRAMES_TOTAL.inc()
+
+                if writer:
+                    writer.write(frame, detections, snapshot_zone_states(zone_states),
+                                 worker_count, current_time_sec)
+
+                    # 目標時間を超えたサイクルはこのフレームまでのバッファからクリップを開始
+                    for cycle in completed_cycles:
+                        target = zone_targets.get(cycle["zone_name"])
+                        if target is not None and cycle["adjusted_time_seconds"] > target:
+                            writer.request_clip(cycle)
+
+            if steady_started is None:
+                steady_started = time.monotonic()
+                steady_first_frame = last_frame
+                print(f"⏱️ First batch measured in {steady_started - loop_started:.2f}s")
+        completed = True
+    finally:
+        frames.close()
+        if writer:
+            # ループが例外で抜けた場合は書き出しのエラーで元の例外を隠さない
+            writer.close(raise_errors=completed)
+        cap.release()
+        if out:
+            out.release()
+
+    if recorder:
+        recorder.save(detections_path, {
+            "fps": fps, "width": width, "height": height, "frames": last_frame,
+            "stride": stride, "adaptive_stride": adaptive_stride, "roi": roi, "tracking": use_tracking
+        })
+
+    if steady_started is not None and last_frame > steady_first_frame:
+        steady_sec = time.monotonic() - steady_started
+        print(f"⚡ Steady-state throughput: {(last_frame - steady_first_frame) / steady_sec:.1f} fps "
+              f"({last_frame - steady_first_frame} frames in {steady_sec:.1f}s)")
+
+    if motion_gate and motion_gate.checked:
+        print(f"💤 Inference skipped (static zones): {motion_gate.skipped}/{motion_gate.checked} frames "
+              f"({motion_gate.skipped / motion_gate.checked * 100:.1f}%)")
+
+    print(f"\n✅ Video processing completed: {output_video_path or 'measure-only'}")
+    print(f"📅 End time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
 
-    zone_states = initialize_zone_states()
+    return zone_states
 
-    current_frame = 0
 
-    print("\n--- Starting 4-zone parallel measurement ---")
-    print(f"📅 Start time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+def use_half_precision():
+    """PyTorch バックエンドで実際に FP16 推論するか（CUDA がなければ USE_HALF_PRECISION でも FP32）"""
+    return USE_HALF_PRECISION and torch.cuda.is_available()
 
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
 
-        current_frame += 1
-        current_time_sec = current_frame / fps
+def inference_decode_width(write_video: bool = WRITE_ANNOTATED_VIDEO):
+    """推論用に縮小デコードする幅（描画動画を書き出す場合は原寸のフレームが必要なため None）"""
+    return None if write_video else INFERENCE_DECODE_WIDTH
 
-        # オブジェクト検出
-        results = detect_objects(frame, model)
 
-        # Worker数カウント
-        worker_count = count_workers(results)
+def find_detection_cache(video_path: str, model_path: str = MODEL_PATH):
+    """動画・モデルに対応する検出キャッシュがあればそのパスを返す"""
+    if not USE_DETECTION_CACHE or not os.path.exists(video_path) or not os.path.exists(model_path):
+        return None
+    cache_path = detection_cache_path(video_path, model_path, USE_ROI_INFERENCE, inference_decode_width(),
+                                      use_half_precision())
+    return cache_path if os.path.exists(cache_path) else None
+
+
+def process_video(model, video_path: str, output_dir: str = OUTPUT_DIR, db_path: str = DB_PATH,
+                  model_path: str = MODEL_PATH):
+    """1本の動画を測定し、レポートと最長サイクル動画を出力"""
+    output_video_path = None
+    if WRITE_ANNOTATED_VIDEO:
+        output_video_path = os.path.join(output_dir, os.path.basename(OUTPUT_VIDEO_PATH))
+    detections_path = None
+    if SAVE_RAW_DETECTIONS:
+        detections_path = os.path.join(output_dir, os.path.basename(DETECTIONS_PATH))
+
+    # 検出キャッシュがあればモデルを使わず再計測、なければ全フレーム推論時にキャッシュを作成
+    recorded = None
+    record_path = detections_path
+    cache_path = find_detection_cache(video_path, model_path)
+    if cache_path:
+        recorded = load_detections(cache_path)
+        record_path = None
+        print(f"♻️ Detection cache hit: {cache_path}")
+    elif USE_DETECTION_CACHE and INFERENCE_STRIDE == 1 and os.path.exists(model_path):
+        cache_path = detection_cache_path(video_path, model_path, USE_ROI_INFERENCE, inference_decode_width(),
+                                          use_half_precision())
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        record_path = cache_path
+
+    if recorded is None and model is None:
+        print("❌ No model and no detection cache. Exiting.")
+        return None
 
-        # 各ゾーンの検出
-        zone_detections = detect_zone_objects(results)
+    # 動画を開く（計測のみモードでは推論用に縮小デコード可）
+    video_info = open_video(video_path, decode_width=inference_decode_width())
+    if not video_info:
+        print("❌ Failed to open video. Exiting.")
+        return None
 
-        # Worker数チェック
-        if worker_count >= 3:
-            mark_invalid_cycles(zone_states)
-
-        # 各ゾーンの状態更新
-        from constants import TARGET_ZONES
-        for zone in TARGET_ZONES:
-            assembling_detected = zone_detections[zone]["assembling"]
-            pallet_detected = zone_detections[zone]["pallet"]
-
-            update_zone_state(
-                zone_states[zone],
-                assembling_detected,
-                pallet_detected,
-                current_frame,
-                current_time_sec,
-                zone,
-                DB_PATH
-            )
-
-        # フレームに描画
-        annotate_frame(frame, results, zone_states, worker_count, current_time_sec)
-
-        # 動画に書き込み
-        out.write(frame)
-
-    cap.release()
-    out.release()
-
-    print(f"\n✅ Video processing completed: {output_video_path}")
-    print(f"📅 End time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    # 本番と同じ形状で事前に推論し、最初のフレームの遅延初期化を避ける
+    if recorded is None:
+        roi = None
+        if USE_ROI_INFERENCE:
+            roi = compute_roi(STATIC_ZONES, video_info["width"], video_info["height"], scale=video_info["scale"])
+        warmup_model(model, video_info["width"], video_info["height"], INFERENCE_BATCH_SIZE, roi)
 
-    return zone_states
+    # 測定ループ実行
+    live_clip_dir = os.path.join(output_dir, "live_clips") if LIVE_CLIPS else None
+    report = IncrementalReport(output_dir, get_zone_targets(db_path)) if INCREMENTAL_REPORTS else None
+    try:
+        zone_states = run_measurement_loop(model, video_info, output_video_path, db_path=db_path,
+                                           detections_path=record_path, recorded=recorded,
+                                           live_clip_dir=live_clip_dir, report=report)
+    finally:
+        if report:
+            report.close()
+
+    if detections_path and cache_path and record_path != detections_path:
+        shutil.copyfile(cache_path, detections_path)
+
+    # 未コミットのサイクルを書き込んでからレポート生成（統計表PDF + CSV）
+    # 累積統計があればDBを再集計せずに出力
+    close_database(db_path)
+    timing_resolution = get_timing_resolution(INFERENCE_STRIDE, video_info["fps"])
+    if report:
+        report.generate(timing_resolution)
+    else:
+        generate_all_reports(db_path, output_dir, timing_resolution)
+
+    # 分析用 Parquet データセットへ前回以降のサイクルを追記
+    if EXPORT_PARQUET:
+        export_cycle_data_parquet(db_path, os.path.join(output_dir, PARQUET_DIR_NAME))
+
+    # 最長（または CLIP_SELECTION で選んだ）サイクル動画を切り出し
+    # 計測のみモードでは動画がないためスキップ
+    extracted_videos = []
+    if output_video_path:
+        print("\n" + "="*70)
+        print(f"🎬 Extracting cycle videos for each zone ({CLIP_SELECTION})")
+        print("="*70)
+
+        extracted_videos = extract_cycle_clips(
+            zone_states,
+            output_video_path,
+            video_info["fps"],
+            output_dir
+        )
+
+    return {
+        "zone_states": zone_states,
+        "output_video_path": output_video_path,
+        "extracted_videos": extracted_videos
+    }
 
 
 def main():
@@ -117,11 +525,9 @@ def main():
     メイン関数 - 4ゾーン並行測定システムのオーケストレーター
 
     処理フロー:
-    1. 環境セットアップ（DB初期化、フォルダ作成）
-    2. モデルと動画のロード
-    3. 測定ループの実行
-    4. レポート生成
-    5. 最長サイクル動画の切り出し
+    1. 環境セットアップ（DB初期化・今回の run の登録、フォルダ作成）
+    2. モデルのロード
+    3. 動画の測定・レポート生成・最長サイクル動画の切り出し
     """
 
     print("="*80)
@@ -132,49 +538,38 @@ def main():
     print(f"GPU available: {torch.cuda.is_available()}")
 
     # 1. 環境セットアップ
-    setup_environment()
+    setup_environment(source=VIDEO_PATH, model_path=MODEL_PATH)
+    metrics_exporter = MetricsExporter(METRICS_PORT, METRICS_LOG_PATH, METRICS_LOG_INTERVAL_SEC, METRICS_BIND_ADDRESS)
 
-    # 2. モデルロード
-    model = load_model(MODEL_PATH)
-    if not model:
-        print("❌ Failed to load model. Exiting.")
-        return None
-
-    # 3. 動画を開く
-    video_info = open_video(VIDEO_PATH)
-    if not video_info:
-        print("❌ Failed to open video. Exiting.")
-        return None
-
-    # 4. 測定ループ実行
-    zone_states = run_measurement_loop(model, video_info, OUTPUT_VIDEO_PATH)
-
-    # 5. レポート生成（統計表PDF + CSV）
-    generate_all_reports(DB_PATH, OUTPUT_DIR)
-
-    # 6. 最長サイクル動画を切り出し
-    print("\n" + "="*70)
-    print("🎬 Extracting longest cycle videos for each zone")
-    print("="*70)
-
-    extracted_videos = extract_longest_cycle_videos(
-        zone_states,
-        OUTPUT_VIDEO_PATH,
-        video_info["fps"]
-    )
-
-    # 7. 完了メッセージ
+    try:
+        # 2. モデルロード（検出キャッシュがあれば不要）
+        model = None
+        if not find_detection_cache(VIDEO_PATH, MODEL_PATH):
+            model = load_model(MODEL_PATH)
+            if not model:
+                print("❌ Failed to load model. Exiting.")
+                return None
+
+        # 3. 測定ループ実行 → レポート生成 → 最長サイクル動画を切り出し
+        video_result = process_video(model, VIDEO_PATH, OUTPUT_DIR, DB_PATH)
+        if not video_result:
+            return None
+    finally:
+        metrics_exporter.close()
+
+    zone_states = video_result["zone_states"]
+
+    # 4. 完了メッセージ
     print("\n" + "="*80)
     print("✅ All processing completed!")
     print("="*80)
     print(f"📁 Results saved to: {OUTPUT_DIR}")
     print(f"📊 PDF Report: {OUTPUT_DIR}/performance_report.pdf")
     print(f"📄 CSV Data: {OUTPUT_DIR}/cycle_data.csv")
-    print(f"🎥 Output Video: {OUTPUT_VIDEO_PATH}")
-    print(f"🎬 Extracted Videos: {len(extracted_videos)} files")
+    print(f"🎥 Output Video: {video_result['output_video_path']}")
+    print(f"🎬 Extracted Videos: {len(video_result['extracted_videos'])} files")
 
-    # 8. 全測定結果を返す
-    from constants import TARGET_ZONES
+    # 5. 全測定結果を返す
     all_results = []
     for zone in TARGET_ZONES:
         all_results.extend(zone_states[zone]["results"])
@@ -4,14 +4,17 @@
 """
 
 from datetime import datetime
-from constants import TARGET_ZONES, N_FRAMES_GRACE_START, N_FRAMES_GRACE_STOP, ADJUSTMENT_SECONDS
+from constants import (
+    TARGET_ZONES, N_FRAMES_GRACE_START, N_FRAMES_GRACE_STOP, FPS, USE_ZONE_ENGINE, ZONE_ENGINE_MIN_ZONES
+)
 from database import save_cycle_to_db
+from zone_engine import ZoneStateEngine
 
 
-def initialize_zone_states():
+def initialize_zone_states(zones: list = TARGET_ZONES):
     """各ゾーンの状態管理辞書を初期化"""
     zone_states = {}
-    for zone in TARGET_ZONES:
+    for zone in zones:
         zone_states[zone] = {
             "measuring": False,
             "start_frame": None,
@@ -20,15 +23,67 @@ def initialize_zone_states():
             "is_valid_cycle": True,
             "assembling_count": 0,
             "pallet_count": 0,
+            "assembling_since_frame": None,
+            "pallet_since_frame": None,
             "cycle_number": 0,
             "results": []
         }
     return zone_states
 
 
+def create_zone_states(zones: list = TARGET_ZONES, use_engine: bool = None):
+    """
+    測定用のゾーン状態（配列エンジン、または従来のゾーンごとの辞書）を作成
+
+    use_engine=None ではゾーン数が ZONE_ENGINE_MIN_ZONES 以上のときだけエンジンを使う
+    """
+    if use_engine is None:
+        use_engine = USE_ZONE_ENGINE and len(zones) >= ZONE_ENGINE_MIN_ZONES
+    if use_engine:
+        return ZoneStateEngine(zones)
+    return initialize_zone_states(zones)
+
+
+def snapshot_zone_states(zone_states: dict):
+    """描画用に各ゾーンの表示項目だけをコピー（別スレッドでの描画用）"""
+    if isinstance(zone_states, ZoneStateEngine):
+        return zone_states.snapshot()
+    return {
+        zone: {
+            "measuring": state["measuring"],
+            "start_time_sec": state["start_time_sec"],
+            "is_valid_cycle": state["is_valid_cycle"]
+        }
+        for zone, state in zone_states.items()
+    }
+
+
+def get_timing_resolution(stride: int, fps: float) -> float:
+    """推論間隔（ストライド）から計測の時間分解能（秒）を返す"""
+    return max(1, stride) / fps
+
+
+def is_near_transition(zone_states: dict) -> bool:
+    """いずれかのゾーンが開始/終了判定の途中（猶予カウント中）か"""
+    if isinstance(zone_states, ZoneStateEngine):
+        return zone_states.near_transition()
+    for state in zone_states.values():
+        if state["measuring"] and state["pallet_count"] > 0:
+            return True
+        if not state["measuring"] and state["assembling_count"] > 0:
+            return True
+    return False
+
+
 def update_zone_state(state: dict, assembling_detected: bool, pallet_detected: bool,
-                     current_frame: int, current_time_sec: float, zone: str, db_path: str):
-    """1ゾーンの状態を更新し、必要に応じてサイクルを記録"""
+                     current_frame: int, current_time_sec: float, zone: str, db_path: str,
+                     frame_step: int = 1):
+    """
+    1ゾーンの状態を更新し、必要に応じてサイクルを記録
+
+    frame_step: 前回の推論フレームからの経過フレーム数。猶予カウンタはフレーム数で
+    加算するため、N_FRAMES_GRACE_START/STOP はストライドに応じて自動的に換算される
+    """
 
     # ================
     # 1. 待機中の処理
@@ -37,12 +92,14 @@ def update_zone_state(state: dict, assembling_detected: bool, pallet_detected: b
         # パターンA: パレット（空）検出 → 待機継続
         if pallet_detected:
             state["assembling_count"] = 0
-            state["pallet_count"] += 1
+            state["pallet_count"] += frame_step
             return None
 
         # パターンB: 組立検出 → 測定開始判定
         elif assembling_detected:
-            state["assembling_count"] += 1
+            if state["assembling_count"] == 0:
+                state["assembling_since_frame"] = current_frame
+            state["assembling_count"] += frame_step
             state["pallet_count"] = 0
 
             # 連続検出が閾値を超えたら測定開始
@@ -68,13 +125,15 @@ def update_zone_state(state: dict, assembling_detected: bool, pallet_detected: b
     else:
         # パターンA: 組立継続 → 測定継続
         if assembling_detected:
-            state["assembling_count"] += 1
+            state["assembling_count"] += frame_step
             state["pallet_count"] = 0
             return None
 
         # パターンB: パレット（完成品）検出 → 測定終了判定
         elif pallet_detected:
-            state["pallet_count"] += 1
+            if state["pallet_count"] == 0:
+                state["pallet_since_frame"] = current_frame
+            state["pallet_count"] += frame_step
             state["assembling_count"] = 0
 
             # 連続検出が閾値を超えたら測定終了
@@ -82,9 +141,12 @@ def update_zone_state(state: dict, assembling_detected: bool, pallet_detected: b
                 state["measuring"] = False
                 end_datetime = datetime.now()
 
-                # 時間計算
+                # 時間計算（開始/終了判定にかかった遅れを補正）
+                # ストライド1では FRAME_DIFFERENCE フレーム = ADJUSTMENT_SECONDS と一致
                 elapsed = current_time_sec - state["start_time_sec"]
-                adjusted_time = elapsed - ADJUSTMENT_SECONDS
+                lag_frames = ((current_frame - state["pallet_since_frame"])
+                              - (state["start_frame"] - state["assembling_since_frame"]))
+                adjusted_time = elapsed - lag_frames / FPS
 
                 # 有効なサイクルのみ保存
                 if state["is_valid_cycle"]:
@@ -102,7 +164,8 @@ def update_zone_state(state: dict, assembling_detected: bool, pallet_detected: b
                     }
 
                     state["results"].append(cycle_data)
-                    save_cycle_to_db(db_path, cycle_data)
+                    if db_path:
+                        save_cycle_to_db(db_path, cycle_data)
 
                     print(f"🔴 [{zone}] Cycle #{state['cycle_number']} completed: {adjusted_time:.2f}s")
                     return cycle_data
@@ -121,6 +184,9 @@ def update_zone_state(state: dict, assembling_detected: bool, pallet_detected: b
 
 def mark_invalid_cycles(zone_states: dict):
     """Worker数が3人以上の場合、測定中の全ゾーンを無効化"""
-    for zone in TARGET_ZONES:
-        if zone_states[zone]["measuring"]:
-            zone_states[zone]["is_valid_cycle"] = False
\ No newline at end of file
+    if isinstance(zone_states, ZoneStateEngine):
+        zone_states.invalidate_measuring()
+        return
+    for state in zone_states.values():
+        if state["measuring"]:
+            state["is_valid_cycle"] = False
\ No newline at end of file
@@ -0,0 +1,308 @@
+"""
+実行時メトリクス関連
+段階別の処理時間ヒストグラム・フレーム数・キュー長・サイクル数を集計し、
+Prometheus 形式の HTTP エンドポイントと定期的な構造化ログ（JSON Lines）で出力
+"""
+
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 段階別処理時間のバケット（秒）
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _format_labels(label_names: tuple, label_values: tuple, extra: str = ""):
+    pairs = [f'{name}="{value}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric(ABC):
+    """ラベルごとの値を持つメトリクスの共通部分（子の生成・出力はサブクラスで定義）"""
+
+    type_name = ""
+
+    def __init__(self, name: str, help_text: str, label_names: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.lock = threading.Lock()
+        self.children = {}
+
+    def labels(self, *label_values):
+        """ラベル値に対応する子メトリクス"""
+        label_values = tuple(str(v) for v in label_values)
+        child = self.children.get(label_values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(label_values, self._new_child())
+        return child
+
+    @abstractmethod
+    def _new_child(self):
+        """ラベル値1組分の値"""
+
+    @abstractmethod
+    def _render_child(self, label_values: tuple, child) -> list:
+        """子1つ分の Prometheus 形式の行"""
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+        for label_values, child in list(self.children.items()):
+            lines.extend(self._render_child(label_values, child))
+        return lines
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self.lock:
+            self.value += amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    """単調増加するカウンタ"""
+
+    type_name = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def _render_child(self, label_values, child):
+        return [f"{self.name}{_format_labels(self.label_names, label_values)} {child.value}"]
+
+
+class Gauge(Counter):
+    """現在値（キュー長など）"""
+
+    type_name = "gauge"
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+
+class _HistogramValue:
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, q: float):
+        """バケット上限による分位点の近似（最後のバケットでは None）"""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for upper, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return upper
+        return None
+
+
+class Histogram(_Metric):
+    """処理時間などの分布"""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, help_text: str, label_names: tuple = (), buckets: tuple = STAGE_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    @contextmanager
+    def time(self, *label_values):
+        """with ブロックの経過時間を記録"""
+        child = self.labels(*label_values)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            child.observe(time.perf_counter() - started)
+
+    def _render_child(self, label_values, child):
+        lines = []
+        cumulative = 0
+        for upper, count in zip(self.buckets, child.counts):
+            cumulative += count
+            le = _format_labels(self.label_names, label_values, f'le="{upper}"')
+            lines.append(f"{self.name}_bucket{le} {cumulative}")
+        le = _format_labels(self.label_names, label_values, 'le="+Inf"')
+        lines.append(f"{self.name}_bucket{le} {child.count}")
+        labels = _format_labels(self.label_names, label_values)
+        lines.append(f"{self.name}_sum{labels} {child.sum}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class MetricsRegistry:
+    """メトリクスの登録とテキスト形式への変換"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name: str, help_text: str, label_names: tuple = ()):
+        return self._register(Counter(name, help_text, label_names))
+
+    def gauge(self, name: str, help_text: str, label_names: tuple = ()):
+        return self._register(Gauge(name, help_text, label_names))
+
+    def histogram(self, name: str, help_text: str, label_names: tuple = (), buckets: tuple = STAGE_BUCKETS):
+        return self._register(Histogram(name, help_text, label_names, buckets))
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Prometheus のテキスト形式"""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# 計測点（各モジュールから直接使う）
+STAGE_SECONDS = REGISTRY.histogram("cycleeye_stage_seconds", "Time spent per pipeline stage call", ("stage",))
+FRAMES_TOTAL = REGISTRY.counter("cycleeye_frames_total", "Frames processed by the measurement loop")
+INFERRED_FRAMES_TOTAL = REGISTRY.counter("cycleeye_inferred_frames_total", "Frames passed to the detector")
+DROPPED_FRAMES_TOTAL = REGISTRY.counter("cycleeye_dropped_frames_total",
+                                        "Live frames replaced before processing")
+REUSED_FRAMES_TOTAL = REGISTRY.counter("cycleeye_reused_frames_total",
+                                       "Frames that reused the previous detections because zones were static")
+CYCLES_TOTAL = REGISTRY.counter("cycleeye_cycles_total", "Completed valid cycles", ("zone",))
+QUEUE_DEPTH = REGISTRY.gauge("cycleeye_queue_depth", "Items waiting in a pipeline queue", ("queue",))
+FPS_GAUGE = REGISTRY.gauge("cycleeye_fps", "Processed frames per second over the last log interval")
+
+
+def snapshot():
+    """構造化ログ用の現在値"""
+    stages = {}
+    for (stage,), child in list(STAGE_SECONDS.children.items()):
+        if child.count == 0:
+            continue
+        p95 = child.quantile(0.95)
+        stages[stage] = {
+            "count": child.count,
+            "mean_ms": round(child.sum / child.count * 1000, 3),
+            "p95_le_ms": round(p95 * 1000, 3) if p95 is not None else None
+        }
+
+    return {
+        "frames": int(FRAMES_TOTAL.labels().value),
+        "inferred_frames": int(INFERRED_FRAMES_TOTAL.labels().value),
+        "dropped_frames": int(DROPPED_FRAMES_TOTAL.labels().value),
+        "reused_frames": int(REUSED_FRAMES_TOTAL.labels().value),
+        "cycles": {zone: int(child.value) for (zone,), child in list(CYCLES_TOTAL.children.items())},
+        "queue_depth": {queue: int(child.value) for (queue,), child in list(QUEUE_DEPTH.children.items())},
+        "stages": stages
+    }
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # アクセスログで測定ログを埋めない
+        pass
+
+
+class MetricsExporter:
+    """
+    メトリクスの HTTP エンドポイント（port=0 で無効）と定期ログ（log_path=None で無効）
+
+    ポートが使用中などで待ち受けできない場合は警告を出し、エンドポイントなしで測定を続ける。
+    ログは interval_sec ごとに1行の JSON を追記し、前回からの処理fpsも記録する
+    """
+
+    def __init__(self, port: int = 0, log_path: str = None, interval_sec: float = 30.0,
+                 host: str = "127.0.0.1"):
+        self.server = None
+        if port:
+            try:
+                self.server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            except OSError as e:
+                print(f"⚠️ Metrics endpoint disabled: cannot listen on {host}:{port} ({e})")
+            else:
+                threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True).start()
+                print(f"📈 Metrics endpoint: http://{host}:{port}/metrics")
+
+        self.log_path = log_path
+        self.interval_sec = interval_sec
+        self.stop_event = threading.Event()
+        self.last_frames = int(FRAMES_TOTAL.labels().value)
+        self.last_time = time.monotonic()
+        self.thread = None
+        if log_path:
+            os.makedirs(os.path.dirname(log_path) or ".", exist_ok=True)
+            self.thread = threading.Thread(target=self._run, name="metrics-log", daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval_sec):
+            self.write_log()
+
+    def write_log(self):
+        """現在値を1行の JSON として追記"""
+        record = snapshot()
+        now = time.monotonic()
+        elapsed = now - self.last_time
+        fps = (record["frames"] - self.last_frames) / elapsed if elapsed > 0 else 0.0
+        FPS_GAUGE.set(round(fps, 2))
+        self.last_frames, self.last_time = record["frames"], now
+
+        record = {"ts": datetime.now().isoformat(timespec="seconds"), "fps": round(fps, 2), **record}
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def close(self):
+        """最終値をログに書いてから停止"""
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+            self.write_log()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
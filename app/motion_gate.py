@@ -0,0 +1,83 @@
+"""
+動き検出による推論スキップ
+ゾーン周辺に変化がないフレームは推論せず、直前の検出結果を再利用する
+"""
+
+import cv2
+import numpy as np
+from typing import Dict, List
+from constants import (
+    MOTION_ZONE_PADDING, MOTION_DOWNSCALE, MOTION_PIXEL_THRESHOLD, MOTION_CHANGED_RATIO,
+    MOTION_MAX_REUSE_FRAMES
+)
+from detection import compute_roi
+
+
+class MotionGate:
+    """
+    ゾーンごとのフレーム差分で推論の要否を判定
+
+    比較対象は最後に推論したフレーム（ゆっくりした変化も蓄積して検出）。
+    各ゾーンの周囲 padding px を縮小・グレースケール化し、pixel_threshold を超えて
+    変化した画素が changed_ratio 以上のゾーンがあれば推論する。
+    変化がなくても max_reuse フレーム連続で再利用したら推論し直し、
+    状態機械が古い検出結果で進み続けないようにする
+    """
+
+    def __init__(self, static_zones: Dict[str, List[int]], width: int, height: int, scale: float = 1.0,
+                 padding: int = MOTION_ZONE_PADDING, downscale: float = MOTION_DOWNSCALE,
+                 pixel_threshold: int = MOTION_PIXEL_THRESHOLD, changed_ratio: float = MOTION_CHANGED_RATIO,
+                 max_reuse: int = MOTION_MAX_REUSE_FRAMES):
+        # 全ゾーンを含む領域だけを切り出して縮小
+        self.roi = compute_roi(static_zones, width, height, padding, scale)
+        x1, y1, x2, y2 = self.roi
+        self.downscale = downscale
+        self.size = (max(1, round((x2 - x1) * downscale)), max(1, round((y2 - y1) * downscale)))
+
+        # 縮小画像上のゾーンごとの判定範囲
+        coords = np.array(list(static_zones.values()), dtype=float).reshape(-1, 4) / scale
+        coords += np.array([-padding, -padding, padding, padding])
+        coords -= np.array([x1, y1, x1, y1])
+        coords = np.clip(coords * downscale, 0, [self.size[0], self.size[1]] * 2)
+        self.zone_windows = [(int(zx1), int(zy1), max(int(zx1) + 1, int(np.ceil(zx2))),
+                              max(int(zy1) + 1, int(np.ceil(zy2))))
+                             for zx1, zy1, zx2, zy2 in coords]
+
+        self.pixel_threshold = pixel_threshold
+        self.changed_ratio = changed_ratio
+        self.max_reuse = max_reuse
+        self.reference = None
+        self.reused = 0
+        self.checked = 0
+        self.skipped = 0
+
+    def _prepare(self, frame):
+        x1, y1, x2, y2 = self.roi
+        small = cv2.resize(frame[y1:y2, x1:x2], self.size, interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        # センサーノイズ・圧縮ノイズを差分に出さない
+        return cv2.GaussianBlur(gray, (5, 5), 0)
+
+    def changed_zones(self, prepared) -> np.ndarray:
+        """ゾーンごとの変化有無（ゾーン順）"""
+        changed = cv2.absdiff(prepared, self.reference) > self.pixel_threshold
+        return np.array([changed[zy1:zy2, zx1:zx2].mean() >= self.changed_ratio
+                         for zx1, zy1, zx2, zy2 in self.zone_windows])
+
+    def should_infer(self, frame) -> bool:
+        """このフレームを推論すべきか（False なら直前の検出結果を再利用）"""
+        self.checked += 1
+        prepared = self._prepare(frame)
+        if self.reference is None or self.reused >= self.max_reuse or self.changed_zones(prepared).any():
+            self.reference = prepared
+            self.reused = 0
+            return True
+
+        self.reused += 1
+        self.skipped += 1
+        return False
+
+    def reset(self):
+        """次のフレームを必ず推論させる（シーク・再接続後など）"""
+        self.reference = None
+        self.reused = 0
@@ -0,0 +1,331 @@
+"""
+複数カメラの同時測定スクリプト
+1プロセス・1モデルで複数の映像ソースを読み、カメラをまたいだバッチで推論
+
+カメラ設定（JSON）:
+    [
+        {"name": "line1_front", "source": "rtsp://192.168.0.10/stream1"},
+        {"name": "line1_back", "source": "rtsp://192.168.0.11/stream1",
+         "zones": {"C_Assemble": [140, 260, 150, 310], "D_Assemble": [550, 260, 560, 310]}}
+    ]
+    zones を省略したカメラは STATIC_ZONES を使用
+
+使い方:
+    python multi_stream_runner.py cameras.json --duration 600
+"""
+
+import argparse
+import json
+import os
+import time
+import threading
+import numpy as np
+import pandas as pd
+from datetime import datetime
+
+from constants import (
+    MODEL_PATH, OUTPUT_DIR, STATIC_ZONES, USE_ROI_INFERENCE, MOTION_GATING, USE_TRACKING,
+    STREAM_RECONNECT_SEC, STREAM_STATS_INTERVAL_SEC, REPORT_REFRESH_SEC, MULTI_STREAM_MAX_BATCH,
+    METRICS_PORT, METRICS_BIND_ADDRESS, METRICS_LOG_INTERVAL_SEC
+)
+from database import flush_database, close_database, get_zone_targets
+from detection import (
+    infer_detections, detect_objects_rois_batch, filter_detections, compute_roi, zone_coords_array
+)
+from measurement import create_zone_states
+from metrics import MetricsExporter, STAGE_SECONDS, FRAMES_TOTAL, INFERRED_FRAMES_TOTAL, REUSED_FRAMES_TOTAL
+from motion_gate import MotionGate
+from pipeline import LatestFrameReader
+from tracker import ObjectTracker
+from report import IncrementalReport
+from video_utils import open_stream
+from zone_stats import ZoneAggregate
+
+
+def load_camera_config(path: str):
+    """カメラ設定を読み込み、zones 未指定のカメラに STATIC_ZONES を補う"""
+    with open(path, encoding="utf-8") as f:
+        cameras = json.load(f)
+
+    names = [camera["name"] for camera in cameras]
+    if len(set(names)) != len(names):
+        raise ValueError(f"duplicate camera names in {path}")
+
+    for camera in cameras:
+        camera.setdefault("zones", dict(STATIC_ZONES))
+    return cameras
+
+
+class CameraStream:
+    """1カメラ分の読み込み・ゾーン状態・出力・処理統計"""
+
+    def __init__(self, camera: dict, output_root: str, notify: threading.Event,
+                 use_roi: bool = USE_ROI_INFERENCE, motion_gating: bool = MOTION_GATING,
+                 use_tracking: bool = USE_TRACKING):
+        from main import setup_environment
+
+        self.name = camera["name"]
+        self.source = camera["source"]
+        self.zones = list(camera["zones"])
+        self.zone_coords = zone_coords_array(camera["zones"], self.zones)
+
+        self.output_dir = os.path.join(output_root, self.name)
+        self.db_path = os.path.join(self.output_dir, "cycle_time_data.db")
+        setup_environment(self.db_path, self.output_dir, self.zones, source=self.source)
+
+        video_info = open_stream(self.source)
+        if not video_info:
+            close_database(self.db_path)
+            raise RuntimeError(f"[{self.name}] could not open {self.source}")
+
+        self.fps = video_info["fps"]
+        self.roi = None
+        if use_roi:
+            self.roi = compute_roi(camera["zones"], video_info["width"], video_info["height"])
+        self.motion_gate = None
+        if motion_gating:
+            self.motion_gate = MotionGate(camera["zones"], video_info["width"], video_info["height"])
+        self.tracker = ObjectTracker() if use_tracking else None
+
+        # 動画ファイルは実時間で再生してカメラとして扱う
+        reopen = None
+        if not video_info["is_file"]:
+            reopen = lambda: (open_stream(self.source) or {}).get("cap")
+        self.reader = LatestFrameReader(video_info["cap"], self.fps, video_info["is_file"], reopen,
+                                        STREAM_RECONNECT_SEC, notify)
+
+        self.zone_states = create_zone_states(self.zones)
+        self.report = IncrementalReport(self.output_dir, get_zone_targets(self.db_path), self.zones)
+        self.last_index = 0
+        self.reconnects = 0
+        self.last_raw_detections = None
+        self.processed = 0
+        self.inference_sec = 0.0
+        self.latency = ZoneAggregate()
+        self.window_latencies = []
+        self.window_processed = 0
+
+    def process(self, capture_index: int, captured_at: float, raw_detections: dict):
+        """1フレーム分の検出結果でこのカメラのゾーン状態を更新"""
+        from main import process_frame
+
+        self.last_raw_detections = raw_detections
+        with STAGE_SECONDS.time("zone_update"):
+            detections = filter_detections(raw_detections)
+            if self.tracker:
+                detections = self.tracker.update(detections, capture_index - self.last_index)
+            _, completed_cycles = process_frame(
+                detections, self.zone_states, capture_index, capture_index / self.fps,
+                capture_index - self.last_index, self.db_path, self.zones, self.zone_coords
+            )
+        FRAMES_TOTAL.inc()
+        self.last_index = capture_index
+        for cycle in completed_cycles:
+            self.report.add_cycle(cycle)
+
+        latency = time.monotonic() - captured_at
+        self.latency.add(latency)
+        self.window_latencies.append(latency)
+        self.processed += 1
+        self.window_processed += 1
+
+    def should_infer(self, frame) -> bool:
+        """ゾーン周辺が前回の推論から変化したか（False なら直前の検出結果を再利用）"""
+        if self.reader.reconnects != self.reconnects:
+            self.reset_after_reconnect()
+        if self.motion_gate is None:
+            return True
+        with STAGE_SECONDS.time("motion_gate"):
+            return self.motion_gate.should_infer(frame)
+
+    def reset_after_reconnect(self):
+        """再接続後は切断前のフレームとの差分・トラックの予測が意味を持たないため初期化"""
+        self.reconnects = self.reader.reconnects
+        if self.motion_gate:
+            self.motion_gate.reset()
+        if self.tracker:
+            self.tracker.reset()
+
+    def service_ratio(self) -> float:
+        """キャプチャしたフレームのうち処理できた割合"""
+        return self.processed / self.reader.captured if self.reader.captured else 0.0
+
+    def close(self):
+        self.reader.close()
+        close_database(self.db_path)
+        self.report.close()
+
+
+def jain_fairness(values: list) -> float:
+    """Jainの公平性指標（全カメラが同じ割合で処理されていれば 1.0、1台に偏るほど 1/N）"""
+    values = np.asarray(values, dtype=float)
+    if not values.size or not values.any():
+        return 1.0
+    return float(values.sum() ** 2 / (values.size * (values ** 2).sum()))
+
+
+def _print_window_stats(streams: list, elapsed: float):
+    """直近区間のカメラ別処理fps・遅延と公平性を表示"""
+    for stream in streams:
+        latencies_ms = np.array(stream.window_latencies or [0.0]) * 1000
+        print(f"📡 [{stream.name}] {stream.window_processed / elapsed:.1f} fps | "
+              f"latency avg {latencies_ms.mean():.0f}ms p95 {np.percentile(latencies_ms, 95):.0f}ms | "
+              f"captured {stream.reader.captured} dropped {stream.reader.dropped}")
+        stream.window_latencies = []
+        stream.window_processed = 0
+    print(f"⚖️ Fairness (Jain, service ratio): {jain_fairness([s.service_ratio() for s in streams]):.3f}")
+
+
+def write_camera_stats(streams: list, elapsed: float, output_root: str):
+    """カメラ別のスループット・遅延・公平性をCSV出力"""
+    rows = []
+    for stream in streams:
+        rows.append({
+            "camera": stream.name,
+            "source": stream.source,
+            "captured": stream.reader.captured,
+            "processed": stream.processed,
+            "dropped": stream.reader.dropped,
+            "service_ratio": round(stream.service_ratio(), 3),
+            "processed_fps": round(stream.processed / elapsed, 2) if elapsed else None,
+            "inference_sec": round(stream.inference_sec, 2),
+            "latency_avg_ms": round(stream.latency.mean * 1000, 1),
+            "latency_p95_ms": round((stream.latency.quantile(0.95) or 0.0) * 1000, 1),
+            "cycles": sum(len(state["results"]) for state in stream.zone_states.values())
+        })
+
+    stats_path = os.path.join(output_root, "camera_stats.csv")
+    pd.DataFrame(rows).to_csv(stats_path, index=False)
+    print(f"\n✅ Camera stats exported: {stats_path}")
+    print(f"⚖️ Fairness (Jain, service ratio): {jain_fairness([s.service_ratio() for s in streams]):.3f}")
+    return stats_path
+
+
+def run_multi_stream(model, cameras: list, output_root: str, duration_sec: float = None,
+                     max_batch: int = MULTI_STREAM_MAX_BATCH, use_roi: bool = USE_ROI_INFERENCE,
+                     motion_gating: bool = MOTION_GATING):
+    """
+    全カメラの最新フレームを集めてまとめて推論し、カメラごとに状態を更新
+
+    1回のバッチには各カメラから最大1フレーム。カメラ数がバッチ上限を超える場合は
+    開始カメラを順に回して偏りなく処理する。ゾーン周辺に変化のないフレームは
+    バッチに入れず、そのカメラの直前の検出結果で状態を更新する
+    """
+    os.makedirs(output_root, exist_ok=True)
+    notify = threading.Event()
+    streams = []
+    try:
+        for camera in cameras:
+            streams.append(CameraStream(camera, output_root, notify, use_roi, motion_gating))
+    except Exception:
+        # 開けなかったカメラより前に開いた読み込みスレッド・DBを閉じる
+        for stream in streams:
+            stream.close()
+        raise
+    max_batch = max(1, max_batch)
+
+    started = time.monotonic()
+    window_started = started
+    report_refreshed = started
+    offset = 0
+
+    print(f"\n--- Starting multi-camera measurement ({len(streams)} cameras) ---")
+    print(f"📅 Start time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+
+    try:
+        while True:
+            notify.wait(0.1)
+            notify.clear()
+
+            batch = []
+            for i in range(len(streams)):
+                stream = streams[(offset + i) % len(streams)]
+                item = stream.reader.poll()
+                if item is None:
+                    continue
+                if not stream.should_infer(item[2]):
+                    stream.process(item[0], item[1], stream.last_raw_detections)
+                    REUSED_FRAMES_TOTAL.inc()
+                    continue
+                batch.append((stream, item))
+                if len(batch) >= max_batch:
+                    break
+            offset = (offset + 1) % len(streams)
+
+            if batch:
+                frames = [frame for _, (_, _, frame) in batch]
+                inference_started = time.monotonic()
+                if use_roi:
+                    batch_detections = detect_objects_rois_batch(frames, model, [s.roi for s, _ in batch])
+                else:
+                    batch_detections = infer_detections(frames, model)
+                batch_inference_sec = time.monotonic() - inference_started
+                STAGE_SECONDS.labels("inference").observe(batch_inference_sec)
+                INFERRED_FRAMES_TOTAL.inc(len(batch))
+                inference_sec = batch_inference_sec / len(batch)
+
+                for (stream, (capture_index, captured_at, _)), raw_detections in zip(batch, batch_detections):
+                    stream.inference_sec += inference_sec
+                    stream.process(capture_index, captured_at, raw_detections)
+            elif all(stream.reader.finished for stream in streams):
+                break
+
+            now = time.monotonic()
+            if now - window_started >= STREAM_STATS_INTERVAL_SEC:
+                _print_window_stats(streams, now - window_started)
+                for stream in streams:
+                    flush_database(stream.db_path)
+                window_started = now
+
+            if now - report_refreshed >= REPORT_REFRESH_SEC:
+                for stream in streams:
+                    stream.report.export_summary_csv()
+                    stream.report.export_pdf()
+                report_refreshed = now
+
+            if duration_sec is not None and now - started >= duration_sec:
+                break
+    except KeyboardInterrupt:
+        print("\n⏹️ Multi-camera measurement stopped")
+    finally:
+        for stream in streams:
+            stream.close()
+
+    elapsed = time.monotonic() - started
+    print(f"📅 End time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+
+    for stream in streams:
+        print(f"\n📷 {stream.name}")
+        stream.report.generate()
+    write_camera_stats(streams, elapsed, output_root)
+
+    return {stream.name: stream.zone_states for stream in streams}
+
+
+def main():
+    from main import load_model
+
+    parser = argparse.ArgumentParser(description="CycleEye multi-camera runner (one shared model)")
+    parser.add_argument("config", help="カメラ設定 JSON（name / source / zones）")
+    parser.add_argument("--duration", type=float, default=None, help="測定時間（秒）。省略時は終了まで継続")
+    parser.add_argument("--output-dir", default=os.path.join(OUTPUT_DIR, "multi"), help="出力先ルート")
+    parser.add_argument("--model", default=MODEL_PATH, help="YOLOモデルのパス")
+    parser.add_argument("--max-batch", type=int, default=MULTI_STREAM_MAX_BATCH, help="1回に推論する最大フレーム数")
+    args = parser.parse_args()
+
+    cameras = load_camera_config(args.config)
+    model = load_model(args.model)
+    if not model:
+        print("❌ Failed to load model. Exiting.")
+        return None
+
+    metrics_exporter = MetricsExporter(METRICS_PORT, os.path.join(args.output_dir, "metrics.jsonl"),
+                                       METRICS_LOG_INTERVAL_SEC, METRICS_BIND_ADDRESS)
+    try:
+        return run_multi_stream(model, cameras, args.output_dir, args.duration, args.max_batch)
+    finally:
+        metrics_exporter.close()
+
+
+if __name__ == "__main__":
+    main()
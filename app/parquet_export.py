@@ -0,0 +1,176 @@
+"""
+Parquet エクスポート
+サイクルデータを日付・ゾーンでパーティション分割した Parquet データセットへ差分エクスポート
+
+使い方:
+    python parquet_export.py                                    # data/output の DB → data/output/cycles_parquet/
+    python parquet_export.py data/output/batch/line1_3f2a9c1e/cycle_time_data.db --output data/lake/cycles
+    python parquet_export.py --full                             # ウォーターマークを無視して作り直し
+
+出力: <output>/date=2026-10-17/zone_name=A_Assemble/part-<先頭id>-<末尾id>.parquet
+分析側は pyarrow.dataset / pandas.read_parquet の filters で必要な日付・ゾーンだけを読み込める
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+from datetime import datetime
+from constants import DB_PATH, OUTPUT_DIR, PARQUET_DIR_NAME, EXPORT_CHUNK_ROWS
+
+WATERMARK_FILE = "_watermark.json"
+PARTITION_COLUMNS = ["date", "zone_name"]
+PARQUET_DIR = os.path.join(OUTPUT_DIR, PARQUET_DIR_NAME)
+
+# 前回エクスポートした id より後の有効サイクルを id 順に取得
+EXPORT_QUERY = """
+    SELECT
+        id,
+        run_id,
+        zone_name,
+        cycle_number,
+        start_datetime,
+        end_datetime,
+        start_frame,
+        end_frame,
+        elapsed_seconds,
+        adjusted_time_seconds,
+        created_at
+    FROM cycle_measurements
+    WHERE id > ? AND is_valid = 1
+    ORDER BY id
+"""
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Parquet export requires pyarrow (pip install pyarrow)")
+    return pa, pq
+
+
+def _schema(pa):
+    return pa.schema([
+        ("id", pa.int64()),
+        ("run_id", pa.int64()),
+        ("zone_name", pa.string()),
+        ("cycle_number", pa.int32()),
+        ("start_datetime", pa.timestamp("ms")),
+        ("end_datetime", pa.timestamp("ms")),
+        ("start_frame", pa.int64()),
+        ("end_frame", pa.int64()),
+        ("elapsed_seconds", pa.float64()),
+        ("adjusted_time_seconds", pa.float64()),
+        ("created_at", pa.timestamp("ms")),
+        ("date", pa.string())
+    ])
+
+
+def _parse_datetime(value: str):
+    return datetime.fromisoformat(value) if value else None
+
+
+def read_watermark(output_dir: str) -> int:
+    """前回エクスポートした最後の id（未エクスポートなら0）"""
+    path = os.path.join(output_dir, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return 0
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)["last_id"]
+
+
+def _write_watermark(output_dir: str, last_id: int):
+    path = os.path.join(output_dir, WATERMARK_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"last_id": last_id, "exported_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S')}, f)
+    os.replace(tmp_path, path)
+
+
+def _clear_dataset(output_dir: str):
+    """エクスポーターが作ったもの（date=* のパーティションとウォーターマーク）だけを削除"""
+    for name in os.listdir(output_dir):
+        path = os.path.join(output_dir, name)
+        if name.startswith(f"{PARTITION_COLUMNS[0]}=") and os.path.isdir(path):
+            shutil.rmtree(path)
+        elif name in (WATERMARK_FILE, WATERMARK_FILE + ".tmp"):
+            os.remove(path)
+
+
+def _to_table(pa, rows: list):
+    """SQLite の行（EXPORT_QUERY の列順）を Arrow テーブルに変換し、開始日の date 列を追加"""
+    columns = list(zip(*rows))
+    start_datetimes = [_parse_datetime(value) for value in columns[4]]
+    arrays = [
+        columns[0], columns[1], columns[2], columns[3],
+        start_datetimes,
+        [_parse_datetime(value) for value in columns[5]],
+        columns[6], columns[7], columns[8], columns[9],
+        [_parse_datetime(value) for value in columns[10]],
+        [value.strftime('%Y-%m-%d') for value in start_datetimes]
+    ]
+    schema = _schema(pa)
+    return pa.Table.from_arrays([pa.array(array, type=field.type) for array, field in zip(arrays, schema)],
+                                schema=schema)
+
+
+def export_cycle_data_parquet(db_path: str, output_dir: str = PARQUET_DIR, full: bool = False,
+                              chunk_rows: int = EXPORT_CHUNK_ROWS):
+    """
+    前回のウォーターマーク（最後にエクスポートした id）以降の有効サイクルを Parquet に追記
+
+    chunk_rows 件ずつ読み出して書き込み、チャンクごとにウォーターマークを進める。
+    ファイル名はチャンクの id 範囲で決まるため、途中で止まっても再実行で同じファイルを上書きするだけ。
+    full=True ならデータセット（date=* のパーティションとウォーターマーク）を削除して全件を書き直す。
+    output_dir 内のそれ以外のファイル・ディレクトリには触れない
+    """
+    pa, pq = _import_pyarrow()
+
+    os.makedirs(output_dir, exist_ok=True)
+    if full:
+        _clear_dataset(output_dir)
+
+    since_id = read_watermark(output_dir)
+    conn = sqlite3.connect(db_path)
+    try:
+        max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM cycle_measurements").fetchone()[0]
+        if since_id > max_id:
+            print(f"⚠️ Parquet watermark (id {since_id}) is ahead of the database (max id {max_id}); "
+                  f"use --full to rebuild {output_dir}")
+            return 0
+
+        cursor = conn.execute(EXPORT_QUERY, (since_id,))
+        count = 0
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                break
+            first_id, last_id = rows[0][0], rows[-1][0]
+            pq.write_to_dataset(_to_table(pa, rows), output_dir, partition_cols=PARTITION_COLUMNS,
+                                basename_template=f"part-{first_id:012d}-{last_id:012d}-{{i}}.parquet",
+                                existing_data_behavior="overwrite_or_ignore")
+            _write_watermark(output_dir, last_id)
+            count += len(rows)
+    finally:
+        conn.close()
+
+    print(f"✅ Cycle data Parquet exported: {output_dir} ({count} new records since id {since_id})")
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CycleEye Parquet export")
+    parser.add_argument("db_path", nargs="?", default=DB_PATH, help="サイクルデータのDB")
+    parser.add_argument("--output", default=PARQUET_DIR, help="Parquet データセットの出力先")
+    parser.add_argument("--full", action="store_true", help="ウォーターマークを無視して全件を書き直す")
+    parser.add_argument("--chunk-rows", type=int, default=EXPORT_CHUNK_ROWS, help="一度に書き込む行数")
+    args = parser.parse_args()
+
+    return export_cycle_data_parquet(args.db_path, args.output, args.full, args.chunk_rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""
+パイプライン処理関連
+デコード・推論・描画/書き出しをスレッドで並列化
+"""
+
+import queue
+import threading
+import time
+from drawing import annotate_frame
+from metrics import STAGE_SECONDS, QUEUE_DEPTH, DROPPED_FRAMES_TOTAL
+
+# キュー終端を表す番兵
+_END = object()
+
+_DECODE_SECONDS = STAGE_SECONDS.labels("decode")
+_ANNOTATE_SECONDS = STAGE_SECONDS.labels("annotate")
+_ENCODE_SECONDS = STAGE_SECONDS.labels("encode")
+
+
+def _put(q: queue.Queue, item, stop_event: threading.Event) -> bool:
+    """停止要求を確認しながらキューに投入（満杯ならブロック = バックプレッシャー）"""
+    while not stop_event.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def read_frames(cap):
+    """動画からフレームを順に読み込む（同一スレッド）"""
+    while cap.isOpened():
+        started = time.perf_counter()
+        ret, frame = cap.read()
+        if not ret:
+            break
+        _DECODE_SECONDS.observe(time.perf_counter() - started)
+        yield frame
+
+
+def threaded_read_frames(cap, queue_size: int):
+    """デコーダースレッドでフレームを先読みし、順番通りに返す"""
+    frame_queue = queue.Queue(maxsize=max(1, queue_size))
+    queue_depth = QUEUE_DEPTH.labels("decode")
+    stop_event = threading.Event()
+    errors = []
+
+    def decode():
+        try:
+            for frame in read_frames(cap):
+                if not _put(frame_queue, frame, stop_event):
+                    return
+        except Exception as e:
+            errors.append(e)
+        finally:
+            _put(frame_queue, _END, stop_event)
+
+    thread = threading.Thread(target=decode, name="decoder", daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            frame = frame_queue.get()
+            if frame is _END:
+                break
+            queue_depth.set(frame_queue.qsize())
+            yield frame
+    finally:
+        stop_event.set()
+        thread.join()
+        queue_depth.set(0)
+
+    if errors:
+        raise errors[0]
+
+
+class LatestFrameReader:
+    """
+    ライブ映像を別スレッドで読み続け、最新フレームだけを保持
+
+    推論が追いつかない場合は古いフレームを捨てて遅延を一定に保つ。realtime=True では
+    動画ファイルを fps に合わせて再生し、ライブ映像として扱う。reopen を渡すと
+    読み込み失敗時に再接続し、reconnects を増やす（読み出し側はこれを見て切断前との差分を捨てる）。
+    notify（threading.Event）を渡すと新しいフレームごとにセットする
+    """
+
+    def __init__(self, cap, fps: float, realtime: bool = False, reopen=None,
+                 reconnect_sec: float = 5.0, notify: threading.Event = None):
+        self.cap = cap
+        self.fps = fps
+        self.realtime = realtime
+        self.reopen = reopen
+        self.reconnect_sec = reconnect_sec
+        self.notify = notify
+        self.latest = None
+        self.captured = 0
+        self.dropped = 0
+        self.reconnects = 0
+        self.ended = False
+        self.condition = threading.Condition()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="stream-reader", daemon=True)
+        self.thread.start()
+
+    def _reconnect(self) -> bool:
+        self.cap.release()
+        while not self.stop_event.wait(self.reconnect_sec):
+            cap = self.reopen()
+            if cap is not None:
+                self.cap = cap
+                self.reconnects += 1
+                print("🔌 Stream reconnected")
+                return True
+        return False
+
+    def _run(self):
+        started = time.monotonic()
+        try:
+            while not self.stop_event.is_set():
+                ret, frame = self.cap.read()
+                if not ret:
+                    if self.reopen is not None and self._reconnect():
+                        continue
+                    break
+
+                self.captured += 1
+                if self.realtime:
+                    # ファイル再生時は実時間に合わせる
+                    delay = started + self.captured / self.fps - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+
+                with self.condition:
+                    if self.latest is not None:
+                        self.dropped += 1
+                        DROPPED_FRAMES_TOTAL.inc()
+                    # (キャプチャ通し番号, キャプチャ時刻, フレーム)
+                    self.latest = (self.captured, time.monotonic(), frame)
+                    self.condition.notify()
+                if self.notify:
+                    self.notify.set()
+        finally:
+            # キャプチャはこのスレッドだけが使うため、読み込み中に解放されないよう終了時にここで解放
+            self.cap.release()
+
+        with self.condition:
+            self.ended = True
+            self.condition.notify()
+        if self.notify:
+            self.notify.set()
+
+    def read(self):
+        """最新フレームを取得（新しいフレームが来るまで待つ）。終端では None"""
+        with self.condition:
+            while self.latest is None and not self.ended:
+                self.condition.wait()
+            item, self.latest = self.latest, None
+            return item
+
+    def poll(self):
+        """新しいフレームがあれば取得（待たない）。なければ None"""
+        with self.condition:
+            item, self.latest = self.latest, None
+            return item
+
+    @property
+    def finished(self) -> bool:
+        """終端に達し、未取得のフレームも残っていないか"""
+        with self.condition:
+            return self.ended and self.latest is None
+
+    def close(self):
+        """
+        読み込みスレッドを停止（ライブ映像の読み込み待ちで止まらないよう待機は有限）
+
+        キャプチャはスレッドが終了時に解放する。読み込み・再接続の途中で待機が切れた場合も
+        使用中のキャプチャは解放せず、スレッド（daemon）が戻った時点で解放される
+        """
+        self.stop_event.set()
+        self.thread.join(timeout=self.reconnect_sec)
+        if self.thread.is_alive():
+            print("⚠️ Stream reader is still blocked in a read; the capture is released when it returns")
+
+
+def iter_batches(frames, batch_size: int, stride: int = 1, first_frame: int = 1):
+    """
+    フレーム列を推論バッチ単位のチャンクに分割
+
+    各要素は (フレーム番号, フレーム, 推論対象か) のタプル。stride フレームごとに
+    1枚を推論対象とし、推論対象が batch_size 枚たまった時点でチャンクを返す
+    """
+    stride = max(1, stride)
+    chunk = []
+    scheduled = 0
+
+    for frame_number, frame in enumerate(frames, start=first_frame):
+        is_scheduled = (frame_number - first_frame) % stride == 0
+        chunk.append((frame_number, frame, is_scheduled))
+        scheduled += is_scheduled
+        if scheduled >= batch_size:
+            yield chunk
+            chunk = []
+            scheduled = 0
+    if chunk:
+        yield chunk
+
+
+class FrameWriter:
+    """
+    描画と動画書き出しを行うステージ（queue_size > 0 で別スレッド実行）
+
+    clip_recorder を渡すと描画済みフレームをライブクリップ用のバッファにも流す
+    """
+
+    def __init__(self, out, queue_size: int = 0, clip_recorder=None):
+        self.out = out
+        self.clip_recorder = clip_recorder
+        self.errors = []
+        self.thread = None
+
+        if queue_size > 0:
+            self.queue = queue.Queue(maxsize=queue_size)
+            self.stop_event = threading.Event()
+            self.thread = threading.Thread(target=self._run, name="writer", daemon=True)
+            self.thread.start()
+
+    def _write(self, frame, detections: dict, zone_states: dict, worker_count: int, current_time_sec: float):
+        started = time.perf_counter()
+        annotate_frame(frame, detections, zone_states, worker_count, current_time_sec)
+        annotated = time.perf_counter()
+        self.out.write(frame)
+        _ANNOTATE_SECONDS.observe(annotated - started)
+        _ENCODE_SECONDS.observe(time.perf_counter() - annotated)
+        if self.clip_recorder:
+            self.clip_recorder.on_frame(frame)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is _END:
+                break
+            try:
+                func, args = item
+                func(*args)
+            except Exception as e:
+                self.errors.append(e)
+                self.stop_event.set()
+                break
+
+    def _submit(self, func, *args):
+        """処理を書き出しスレッドに順番通り投入（同期モードでは即実行）"""
+        if self.thread is None:
+            func(*args)
+            return
+
+        if not _put(self.queue, (func, args), self.stop_event):
+            raise self.errors[0]
+        QUEUE_DEPTH.labels("writer").set(self.queue.qsize())
+
+    def write(self, frame, detections: dict, zone_states: dict, worker_count: int, current_time_sec: float):
+        """1フレームを描画して書き出し（スレッド時はキューに投入）"""
+        self._submit(self._write, frame, detections, zone_states, worker_count, current_time_sec)
+
+    def request_clip(self, cycle: dict):
+        """直前までに書き出したフレームを使ってサイクルのライブクリップを開始"""
+        if self.clip_recorder:
+            self._submit(self.clip_recorder.request, cycle)
+
+    def close(self, raise_errors: bool = True):
+        """
+        キューを流し切ってスレッドを終了
+
+        書き出しスレッドのエラーは raise_errors=True なら送出する。呼び出し側で既に例外が
+        伝播中（finally 内など）なら False を渡し、元の例外を隠さないよう表示だけにする
+        """
+        if self.thread is not None:
+            _put(self.queue, _END, self.stop_event)
+            self.thread.join()
+            self.thread = None
+            QUEUE_DEPTH.labels("writer").set(0)
+        if self.clip_recorder:
+            self.clip_recorder.close()
+        if self.errors:
+            if raise_errors:
+                raise self.errors[0]
+            print(f"⚠️ Frame writer failed: {self.errors[0]!r}")
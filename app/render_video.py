@@ -0,0 +1,100 @@
+"""
+保存済み検出結果からの動画描画スクリプト
+計測のみモードで保存した検出結果を使い、推論せずに注釈付き動画・クリップを作成
+
+使い方:
+    python render_video.py data/input/simulation_video.mp4 data/output/detections.npz
+    python render_video.py video.mp4 detections.npz --start 120 --end 180 --output clip.mp4
+"""
+
+import argparse
+import os
+
+from constants import OUTPUT_VIDEO_PATH
+from detection import extract_detections, filter_detections
+from detection_store import load_detections, iter_recorded_detections
+from drawing import annotate_frame
+from measurement import create_zone_states
+from pipeline import read_frames
+from tracker import ObjectTracker
+from video_utils import open_video, create_video_writer
+
+
+def render_video(video_path: str, detections_path: str, output_path: str,
+                 start_sec: float = 0.0, end_sec: float = None):
+    """検出結果を再生して状態機械を再現し、指定範囲を描画して書き出す"""
+    from main import process_frame
+
+    recorded = load_detections(detections_path)
+    adaptive_stride = recorded["meta"].get("adaptive_stride", False)
+    tracker = ObjectTracker() if recorded["meta"].get("tracking", False) else None
+
+    video_info = open_video(video_path)
+    if not video_info:
+        return None
+
+    cap = video_info["cap"]
+    fps = video_info["fps"]
+    out = create_video_writer(output_path, fps, video_info["width"], video_info["height"])
+
+    zone_states = create_zone_states()
+    recorded_iter = iter_recorded_detections(recorded)
+    next_recorded = next(recorded_iter, None)
+
+    detections = filter_detections(extract_detections([]))
+    worker_count = 0
+    last_sampled_frame = 0
+    written = 0
+
+    frames = read_frames(cap)
+    try:
+        for current_frame, frame in enumerate(frames, start=1):
+            current_time_sec = current_frame / fps
+            if end_sec is not None and current_time_sec > end_sec:
+                break
+
+            # 記録のあるフレームだけ状態を更新（計測時と同じ加算方法）
+            # 追跡ありで計測した場合は記録のないフレームもトラックの予測位置で更新
+            is_recorded = next_recorded is not None and next_recorded[0] == current_frame
+            if is_recorded or tracker:
+                frame_step = 1 if adaptive_stride or tracker else current_frame - last_sampled_frame
+                if is_recorded:
+                    detections = filter_detections(next_recorded[1])
+                    if tracker:
+                        detections = tracker.update(detections)
+                    next_recorded = next(recorded_iter, None)
+                else:
+                    detections = tracker.predict()
+                worker_count, _ = process_frame(detections, zone_states, current_frame, current_time_sec,
+                                                frame_step, None)
+                last_sampled_frame = current_frame
+
+            if current_time_sec >= start_sec:
+                annotate_frame(frame, detections, zone_states, worker_count, current_time_sec)
+                out.write(frame)
+                written += 1
+    finally:
+        frames.close()
+        cap.release()
+        out.release()
+
+    print(f"✅ Rendered video: {output_path} ({written} frames)")
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render annotated video from saved detections")
+    parser.add_argument("video", help="元の入力動画")
+    parser.add_argument("detections", help="保存した検出結果 (.npz)")
+    parser.add_argument("--output", default=None, help="出力動画パス")
+    parser.add_argument("--start", type=float, default=0.0, help="開始時刻（秒）")
+    parser.add_argument("--end", type=float, default=None, help="終了時刻（秒）")
+    args = parser.parse_args()
+
+    output_path = args.output or os.path.join(os.path.dirname(args.detections),
+                                              os.path.basename(OUTPUT_VIDEO_PATH))
+    return render_video(args.video, args.detections, output_path, args.start, args.end)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,34 @@
 """
 レポート生成関連
-統計レポートのPDF出力
+統計レポートのPDF出力、サイクル完了ごとの集計・CSV追記
 """
 
+import csv
+import os
 import sqlite3
 import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_pdf import PdfPages
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from constants import TARGET_ZONES
+from zone_stats import ZoneAggregate
 
+# cycle_data.csv の列（export_cycle_data_csv と同じ）
+CYCLE_CSV_COLUMNS = [
+    "zone_name", "cycle_number", "start_datetime", "end_datetime", "start_frame", "end_frame",
+    "elapsed_seconds", "adjusted_time_seconds", "created_at"
+]
 
-def export_report_to_pdf(db_path: str, pdf_path: str):
-    """統計レポートをPDFとして出力"""
+# 集計CSVに出力するパーセンタイル
+SUMMARY_QUANTILES = {"P50": 0.50, "P90": 0.90, "P95": 0.95}
+
+
+def load_zone_summary(db_path: str, run_id: int = None):
+    """1回分（省略時は今回の測定）のサイクルからゾーン別の統計表を集計"""
+    from database import current_run_id
+
+    if run_id is None:
+        run_id = current_run_id(db_path)
     conn = sqlite3.connect(db_path)
 
     query = """
@@ -25,19 +41,58 @@ def export_report_to_pdf(db_path: str, pdf_path: str):
             ROUND((zt.target_seconds / AVG(cm.adjusted_time_seconds)) * 100, 1) as Achievement
         FROM cycle_measurements cm
         LEFT JOIN zone_targets zt ON cm.zone_name = zt.zone_name
-        WHERE cm.is_valid = 1
+        WHERE cm.run_id = ? AND cm.is_valid = 1
         GROUP BY cm.zone_name
     """
 
-    df = pd.read_sql_query(query, conn)
+    df = pd.read_sql_query(query, conn, params=(run_id,))
+    conn.close()
+    return df
+
+
+def load_zone_trend(db_path: str, weeks: int = 8, zones: list = TARGET_ZONES):
+    """直近 weeks 週の全 run のサイクルから、週×ゾーンの件数・平均・最短/最長を集計"""
+    since = (datetime.now() - timedelta(weeks=weeks)).strftime('%Y-%m-%d')
+    conn = sqlite3.connect(db_path)
+
+    # (zone_name, start_datetime) インデックスでゾーンごとに期間内だけを読む
+    query = f"""
+        SELECT
+            strftime('%Y-W%W', start_datetime) as Week,
+            zone_name as Zone,
+            COUNT(DISTINCT run_id) as Runs,
+            COUNT(*) as Cycles,
+            ROUND(AVG(adjusted_time_seconds), 2) as Average,
+            ROUND(MIN(adjusted_time_seconds), 1) as Shortest,
+            ROUND(MAX(adjusted_time_seconds), 1) as Longest
+        FROM cycle_measurements
+        WHERE zone_name IN ({",".join("?" * len(zones))})
+          AND start_datetime >= ?
+          AND is_valid = 1
+        GROUP BY Week, Zone
+        ORDER BY Week, Zone
+    """
+
+    df = pd.read_sql_query(query, conn, params=(*zones, since))
     conn.close()
+    return df
+
+
+def export_report_to_pdf(db_path: str, pdf_path: str, timing_resolution_sec: float = None):
+    """統計レポートをPDFとして出力"""
+    render_report_pdf(load_zone_summary(db_path), pdf_path, timing_resolution_sec)
+
 
+def render_report_pdf(df: pd.DataFrame, pdf_path: str, timing_resolution_sec: float = None,
+                      zones: list = TARGET_ZONES):
+    """ゾーン別の統計表（Zone/Average/Shortest/Longest/Target/Achievement）をPDFに描画"""
     if df.empty:
         print("⚠️ No data to export to PDF")
         return
 
     # ゾーン名の順序を指定
-    df['Zone'] = pd.Categorical(df['Zone'], categories=TARGET_ZONES, ordered=True)
+    df = df.copy()
+    df['Zone'] = pd.Categorical(df['Zone'], categories=zones, ordered=True)
     df = df.sort_values('Zone')
 
     # 達成率に応じた評価（○×△）
@@ -64,6 +119,8 @@ def export_report_to_pdf(db_path: str, pdf_path: str):
     ax.axis('off')
 
     title_text = f'Assembly Performance Report\n{datetime.now().strftime("%Y-%m-%d")}'
+    if timing_resolution_sec is not None:
+        title_text += f'\nTiming resolution: {timing_resolution_sec:.3f}s'
     plt.title(title_text, fontsize=16, pad=20, fontweight='bold')
 
     table = ax.table(cellText=df.values, colLabels=df.columns,
@@ -91,9 +148,9 @@ def export_report_to_pdf(db_path: str, pdf_path: str):
     print(f"\n✅ PDF report exported: {pdf_path}")
 
 
-def generate_all_reports(db_path: str, output_dir: str):
+def generate_all_reports(db_path: str, output_dir: str, timing_resolution_sec: float = None):
     """統計レポートとCSVを生成"""
-    from database import export_cycle_data_csv
+    from database import write_cycle_data_csv
     
     print("\n" + "="*80)
     print("📊 Generating Reports")
@@ -101,12 +158,99 @@ def generate_all_reports(db_path: str, output_dir: str):
 
     # 1. LLM用CSV - 全サイクルデータ
     csv_path = f"{output_dir}/cycle_data.csv"
-    export_cycle_data_csv(db_path, csv_path)
+    write_cycle_data_csv(db_path, csv_path)
 
     # 2. 基本統計レポート（PDF）
     pdf_path = f"{output_dir}/performance_report.pdf"
-    export_report_to_pdf(db_path, pdf_path)
+    export_report_to_pdf(db_path, pdf_path, timing_resolution_sec)
 
     print("\n" + "="*80)
     print("✅ All reports generated successfully")
-    print("="*80)
\ No newline at end of file
+    print("="*80)
+
+
+class IncrementalReport:
+    """
+    サイクル完了ごとにゾーン別の累積統計を更新し、cycle_data.csv に追記
+
+    統計表・PDFはいつでも累積統計から O(ゾーン数) で再生成できる（DBの再集計不要）。
+    CSVの行は完了順（export_cycle_data_csv はゾーン・サイクル番号順）
+    """
+
+    def __init__(self, output_dir: str, zone_targets: dict = None, zones: list = TARGET_ZONES):
+        self.output_dir = output_dir
+        self.zone_targets = zone_targets or {}
+        self.zones = list(zones)
+        self.aggregates = {zone: ZoneAggregate() for zone in self.zones}
+
+        self.csv_path = os.path.join(output_dir, "cycle_data.csv")
+        self.csv_file = open(self.csv_path, "w", newline="", encoding="utf-8")
+        self.csv_writer = csv.DictWriter(self.csv_file, fieldnames=CYCLE_CSV_COLUMNS, extrasaction="ignore")
+        self.csv_writer.writeheader()
+        self.csv_file.flush()
+
+    def add_cycle(self, cycle_data: dict):
+        """完了した有効サイクルを集計に加え、CSVに1行追記"""
+        self.aggregates.setdefault(cycle_data["zone_name"], ZoneAggregate()).add(
+            cycle_data["adjusted_time_seconds"]
+        )
+        created_at = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        self.csv_writer.writerow(dict(cycle_data, created_at=created_at))
+        self.csv_file.flush()
+
+    def summary(self):
+        """累積統計からゾーン別の統計表を作成（サイクルのないゾーンは除外）"""
+        rows = []
+        for zone, aggregate in self.aggregates.items():
+            if aggregate.count == 0:
+                continue
+            target = self.zone_targets.get(zone)
+            row = {
+                "Zone": zone,
+                "Cycles": aggregate.count,
+                "Average": round(aggregate.mean, 1),
+                "Std": round(aggregate.std, 2),
+                "Shortest": round(aggregate.min, 1),
+                "Longest": round(aggregate.max, 1),
+                "Target": target,
+                "Achievement": round(target / aggregate.mean * 100, 1) if target else float("nan")
+            }
+            for name, q in SUMMARY_QUANTILES.items():
+                row[name] = round(aggregate.quantile(q), 1)
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+    def export_summary_csv(self):
+        """ゾーン別の統計表（パーセンタイル付き）をCSV出力"""
+        summary_path = os.path.join(self.output_dir, "zone_summary.csv")
+        self.summary().to_csv(summary_path, index=False)
+        return summary_path
+
+    def export_pdf(self, timing_resolution_sec: float = None):
+        """累積統計から統計レポートPDFを出力"""
+        pdf_path = os.path.join(self.output_dir, "performance_report.pdf")
+        df = self.summary()
+        if not df.empty:
+            df = df[["Zone", "Average", "Shortest", "Longest", "Target", "Achievement"]]
+        render_report_pdf(df, pdf_path, timing_resolution_sec, self.zones)
+        return pdf_path
+
+    def generate(self, timing_resolution_sec: float = None):
+        """集計CSVとPDFを再生成（CSVは追記済み）"""
+        print("\n" + "="*80)
+        print("📊 Generating Reports")
+        print("="*80)
+
+        count = sum(aggregate.count for aggregate in self.aggregates.values())
+        print(f"\n✅ Cycle data CSV exported: {self.csv_path} ({count} records)")
+        print(f"✅ Zone summary exported: {self.export_summary_csv()}")
+        self.export_pdf(timing_resolution_sec)
+
+        print("\n" + "="*80)
+        print("✅ All reports generated successfully")
+        print("="*80)
+
+    def close(self):
+        """CSVファイルを閉じる"""
+        if not self.csv_file.closed:
+            self.csv_file.close()
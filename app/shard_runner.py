@@ -0,0 +1,298 @@
+"""
+長時間動画の時間分割処理スクリプト
+1本の動画を重複つきの時間区間に分け、プロセスプールで並列測定して結合
+
+境界の扱い:
+    ゾーンで N_FRAMES_GRACE_STOP フレーム連続してパレットが検出された時点（同期点）以降は、
+    それ以前の履歴によらず状態機械の状態が一意に決まる。前の区間は終了後も全ゾーンが
+    境界以降の最初の同期点に達するまで処理を続け、次の区間はその同期点より後に始まった
+    サイクルだけを採用する。これにより境界をまたぐサイクルはちょうど1回だけ記録される。
+    追跡ありでは、予測だけで出力中・未確定のトラックが残っている間は同期点としない
+    （トラッカーの状態も区間の読み始め位置によらず揃うまで待つ）。
+
+    同期点が見つからないゾーンは境界で切るため、境界をまたぐサイクルが欠ける・重複することがある
+    （件数を結合結果の表示に出す）。--verify では動画全体を1区間で測定した結果と照合する。
+
+使い方:
+    python shard_runner.py data/input/shift_8h.mp4 --segments 8 --workers 4
+    python shard_runner.py data/input/shift_8h.mp4 --segments 8 --verify   # 逐次処理と不一致なら終了コード1
+"""
+
+import argparse
+import os
+import sys
+from datetime import datetime
+
+from constants import (
+    MODEL_PATH, OUTPUT_DIR, TARGET_ZONES, STATIC_ZONES, N_FRAMES_GRACE_STOP,
+    INFERENCE_BATCH_SIZE, USE_ROI_INFERENCE, INFERENCE_STRIDE, USE_TRACKING,
+    SHARD_WARMUP_SEC, SHARD_MAX_OVERLAP_SEC, SHARD_EXACT_SEEK, TRACK_MAX_AGE, TRACK_MIN_HITS
+)
+from batch_runner import create_pool, get_worker_model
+
+
+def plan_segments(total_frames: int, num_segments: int, warmup_frames: int):
+    """動画を num_segments 個の区間に分割（フレーム番号は1始まり、end は含まない）"""
+    num_segments = max(1, min(num_segments, total_frames))
+    length = -(-total_frames // num_segments)
+
+    segments = []
+    for index in range(num_segments):
+        start = 1 + index * length
+        end = min(total_frames + 1, start + length)
+        segments.append({
+            "index": index,
+            "start": start,
+            "end": end,
+            "read_start": max(1, start - warmup_frames),
+            "is_last": index == num_segments - 1
+        })
+    return segments
+
+
+def _reached_sync(state: dict, frame_number: int, boundary: int, tracker=None) -> bool:
+    """境界以降の N_FRAMES_GRACE_STOP フレームが連続してパレットか（同期点）。追跡ありではトラックも確定済みか"""
+    return (frame_number - N_FRAMES_GRACE_STOP + 1 >= boundary
+            and state["pallet_count"] >= N_FRAMES_GRACE_STOP
+            and (tracker is None or tracker.is_settled()))
+
+
+def measure_segment(video_path: str, segment: dict, batch_size: int = INFERENCE_BATCH_SIZE,
+                    use_roi: bool = USE_ROI_INFERENCE, use_tracking: bool = USE_TRACKING):
+    """1区間を測定し、サイクル・サイクル開始フレーム・境界の同期点を返す（ワーカーで実行）"""
+    from main import process_frame
+    from detection import infer_detections, filter_detections, compute_roi
+    from measurement import create_zone_states
+    from pipeline import read_frames, iter_batches
+    from tracker import ObjectTracker
+    from video_utils import open_video, seek_frame
+
+    model = get_worker_model()
+    video_info = open_video(video_path)
+    if model is None or not video_info:
+        raise RuntimeError(f"segment {segment['index']}: model or video unavailable")
+
+    cap = video_info["cap"]
+    fps = video_info["fps"]
+    roi = compute_roi(STATIC_ZONES, video_info["width"], video_info["height"]) if use_roi else None
+    max_overlap_frames = int(SHARD_MAX_OVERLAP_SEC * fps)
+
+    zone_states = create_zone_states()
+    # 追跡は読み始め（ウォームアップ）から run_measurement_loop と同じく毎フレーム更新
+    tracker = ObjectTracker() if use_tracking else None
+    cycle_starts = {zone: [] for zone in TARGET_ZONES}
+    start_syncs = {zone: [] for zone in TARGET_ZONES}
+    end_syncs = {zone: None for zone in TARGET_ZONES}
+    last_frame = segment["read_start"] - 1
+
+    if not seek_frame(cap, segment["read_start"] - 1, SHARD_EXACT_SEEK):
+        cap.release()
+        raise RuntimeError(f"segment {segment['index']}: seek failed")
+
+    print(f"🧩 Segment {segment['index']}: frames {segment['start']}-{segment['end'] - 1} "
+          f"(warm-up from {segment['read_start']})")
+
+    frames = read_frames(cap)
+    try:
+        for chunk in iter_batches(frames, batch_size, first_frame=segment["read_start"]):
+            batch_detections = infer_detections([frame for _, frame, _ in chunk], model, roi)
+
+            for (current_frame, _, _), raw_detections in zip(chunk, batch_detections):
+                cycle_numbers = {zone: state["cycle_number"] for zone, state in zone_states.items()}
+                detections = filter_detections(raw_detections)
+                if tracker:
+                    detections = tracker.update(detections)
+                process_frame(detections, zone_states, current_frame, current_frame / fps, 1, None)
+                last_frame = current_frame
+
+                for zone, state in zone_states.items():
+                    # 無効サイクルも含めた開始フレーム（全体での通し番号付けに使用）
+                    if state["cycle_number"] != cycle_numbers[zone]:
+                        cycle_starts[zone].append(current_frame)
+                    # 境界後の同期点は重複範囲内ですべて記録（前の区間の同期点と一致するものを使う）
+                    if (current_frame <= segment["start"] + max_overlap_frames
+                            and _reached_sync(state, current_frame, segment["start"], tracker)):
+                        start_syncs[zone].append(current_frame)
+                    if end_syncs[zone] is None and _reached_sync(state, current_frame, segment["end"], tracker):
+                        end_syncs[zone] = current_frame
+
+            # 区間終了後は全ゾーンが次の境界の同期点に達するまで続行（上限あり）
+            if not segment["is_last"] and last_frame >= segment["end"] - 1:
+                if all(end_syncs.values()) or last_frame >= segment["end"] + max_overlap_frames:
+                    break
+    finally:
+        frames.close()
+        cap.release()
+
+    cycles = []
+    for zone in TARGET_ZONES:
+        cycles.extend(zone_states[zone]["results"])
+
+    return {
+        "index": segment["index"],
+        "start": segment["start"],
+        "end": segment["end"],
+        "processed_until": last_frame,
+        "start_syncs": start_syncs,
+        "end_syncs": end_syncs,
+        "cycle_starts": cycle_starts,
+        "cycles": cycles
+    }
+
+
+def _boundary_cut(previous: dict, current: dict, zone: str):
+    """
+    区間境界でのゾーンごとの切り替えフレームと、同期点で切り替えたか（False なら境界そのもの）
+
+    前の区間の最初の同期点が次の区間でも同期点なら、そこで切り替える。追跡ありでは
+    次の区間（履歴が短くトラックが少ない）の方が先に同期点に達することがあるため、最初同士では比べない
+    """
+    sync_frame = previous["end_syncs"][zone]
+    if sync_frame is not None and sync_frame in current["start_syncs"][zone]:
+        return sync_frame, True
+
+    print(f"⚠️ [{zone}] No sync point shared by segments {previous['index']}/{current['index']} "
+          f"- splitting at frame {current['start']} (increase SHARD_MAX_OVERLAP_SEC / SHARD_WARMUP_SEC)")
+    return current["start"], False
+
+
+def stitch_segments(segment_results: list):
+    """
+    区間ごとの結果を境界の同期点で結合し、サイクル番号を全体で振り直す
+
+    (サイクル一覧, 同期点がなく境界で切った (ゾーン, 前の区間, 次の区間) の一覧) を返す
+    """
+    segment_results = sorted(segment_results, key=lambda r: r["index"])
+    stitched = []
+    fallbacks = []
+
+    for zone in TARGET_ZONES:
+        cuts = [0]
+        for previous, current in zip(segment_results, segment_results[1:]):
+            cut, synced = _boundary_cut(previous, current, zone)
+            if not synced:
+                fallbacks.append((zone, previous["index"], current["index"]))
+            cuts.append(cut)
+        cuts.append(float("inf"))
+
+        all_starts = []
+        zone_cycles = []
+        for result, low, high in zip(segment_results, cuts, cuts[1:]):
+            all_starts.extend(f for f in result["cycle_starts"][zone] if low <= f < high)
+            zone_cycles.extend(
+                c for c in result["cycles"]
+                if c["zone_name"] == zone and low <= c["start_frame"] < high
+            )
+
+        # 通し番号 = 無効サイクルも含めた開始順
+        start_order = {frame: number for number, frame in enumerate(sorted(all_starts), start=1)}
+        for cycle in sorted(zone_cycles, key=lambda c: c["start_frame"]):
+            stitched.append(dict(cycle, cycle_number=start_order[cycle["start_frame"]]))
+
+    return stitched, fallbacks
+
+
+def _cycle_key(cycle: dict):
+    return (cycle["zone_name"], cycle["cycle_number"], cycle["start_frame"], cycle["end_frame"],
+            round(cycle["adjusted_time_seconds"], 6))
+
+
+def compare_cycles(stitched: list, sequential: list):
+    """結合結果と逐次処理の結果を照合し、一方にしかないサイクルを表示。一致すれば True"""
+    stitched_keys = set(map(_cycle_key, stitched))
+    sequential_keys = set(map(_cycle_key, sequential))
+    missing = sorted(sequential_keys - stitched_keys)
+    extra = sorted(stitched_keys - sequential_keys)
+
+    for key in missing:
+        print(f"   - missing  {key[0]} #{key[1]} frames {key[2]}-{key[3]} ({key[4]:.2f}s)")
+    for key in extra:
+        print(f"   + extra    {key[0]} #{key[1]} frames {key[2]}-{key[3]} ({key[4]:.2f}s)")
+    if missing or extra:
+        print(f"❌ Sharded result differs from the sequential run "
+              f"({len(missing)} missing, {len(extra)} extra of {len(sequential)} cycles)")
+        return False
+    print(f"✅ Sharded result matches the sequential run ({len(sequential)} cycles)")
+    return True
+
+
+def run_sharded(video_path: str, output_dir: str, model_path: str = MODEL_PATH,
+                segments: int = 4, workers: int = 4, verify: bool = False):
+    """
+    1本の動画を区間分割して並列測定し、DB・レポートを出力
+
+    verify=True では動画全体を1区間として同じプールで測定し、結合結果と一致しなければ
+    DBに保存せず None を返す
+    """
+    from main import setup_environment
+    from database import save_cycle_to_db, close_database
+    from measurement import get_timing_resolution
+    from report import generate_all_reports
+    from video_utils import open_video
+
+    db_path = os.path.join(output_dir, "cycle_time_data.db")
+    setup_environment(db_path, output_dir, source=video_path, model_path=model_path)
+
+    video_info = open_video(video_path)
+    if not video_info:
+        return None
+    video_info["cap"].release()
+
+    if INFERENCE_STRIDE != 1:
+        print("⚠️ Sharded runs always infer every frame (INFERENCE_STRIDE is ignored)")
+
+    # 追跡ありでは前の区間から続くトラックが確定・消滅するまでウォームアップが必要
+    warmup_frames = int(SHARD_WARMUP_SEC * video_info["fps"])
+    if USE_TRACKING:
+        warmup_frames = max(warmup_frames, TRACK_MAX_AGE + TRACK_MIN_HITS)
+    plan = plan_segments(video_info["total_frames"], segments, warmup_frames)
+    workers = max(1, min(workers, len(plan)))
+
+    print(f"📅 Start time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    with create_pool(workers, model_path) as pool:
+        sequential_job = None
+        if verify:
+            whole = plan_segments(video_info["total_frames"], 1, 0)[0]
+            sequential_job = pool.apply_async(measure_segment, (video_path, whole))
+        jobs = [pool.apply_async(measure_segment, (video_path, segment)) for segment in plan]
+        segment_results = [job.get() for job in jobs]
+        sequential_result = sequential_job.get() if sequential_job else None
+    print(f"📅 End time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+
+    cycles, fallbacks = stitch_segments(segment_results)
+    print(f"🧵 Stitched {len(plan)} segments: {len(cycles)} cycles "
+          f"({len(fallbacks)} of {(len(plan) - 1) * len(TARGET_ZONES)} zone boundaries split without a sync point)")
+
+    if sequential_result is not None:
+        sequential_cycles, _ = stitch_segments([sequential_result])
+        if not compare_cycles(cycles, sequential_cycles):
+            close_database(db_path)
+            return None
+
+    for cycle in cycles:
+        save_cycle_to_db(db_path, cycle)
+    close_database(db_path)
+
+    generate_all_reports(db_path, output_dir, get_timing_resolution(1, video_info["fps"]))
+    return cycles
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CycleEye sharded runner for long videos")
+    parser.add_argument("video", help="入力動画")
+    parser.add_argument("--output-dir", default=os.path.join(OUTPUT_DIR, "sharded"), help="出力先")
+    parser.add_argument("--model", default=MODEL_PATH, help="YOLOモデルのパス")
+    parser.add_argument("--segments", type=int, default=4, help="時間区間の数")
+    parser.add_argument("--workers", type=int, default=4, help="ワーカープロセス数")
+    parser.add_argument("--verify", action="store_true",
+                        help="動画全体を1区間でも測定し、結合結果が一致しなければ終了コード1")
+    args = parser.parse_args()
+
+    cycles = run_sharded(args.video, args.output_dir, args.model, args.segments, args.workers, args.verify)
+    if cycles is None:
+        sys.exit(1)
+    return cycles
+
+
+if __name__ == "__main__":
+    main()
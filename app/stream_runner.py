@@ -0,0 +1,188 @@
+"""
+ライブ映像の測定スクリプト
+RTSP / USBカメラ / GStreamer の映像を読み続け、遅延を抑えながら測定を継続
+
+使い方:
+    python stream_runner.py rtsp://192.168.0.10/stream1
+    python stream_runner.py 0                                   # USBカメラ
+    python stream_runner.py data/input/simulation_video.mp4 --realtime   # ファイルをライブとして再生
+"""
+
+import argparse
+import os
+import time
+import numpy as np
+from datetime import datetime
+
+from constants import (
+    MODEL_PATH, OUTPUT_DIR, STATIC_ZONES, USE_ROI_INFERENCE, MOTION_GATING, USE_TRACKING,
+    EXPORT_PARQUET, PARQUET_DIR_NAME, STREAM_RECONNECT_SEC, STREAM_STATS_INTERVAL_SEC,
+    REPORT_REFRESH_SEC, METRICS_PORT, METRICS_BIND_ADDRESS, METRICS_LOG_INTERVAL_SEC
+)
+from database import flush_database, close_database, get_zone_targets
+from detection import infer_detections, filter_detections, compute_roi
+from measurement import create_zone_states
+from metrics import MetricsExporter, STAGE_SECONDS, FRAMES_TOTAL, INFERRED_FRAMES_TOTAL, REUSED_FRAMES_TOTAL
+from motion_gate import MotionGate
+from parquet_export import export_cycle_data_parquet
+from pipeline import LatestFrameReader
+from tracker import ObjectTracker
+from report import IncrementalReport
+from video_utils import open_stream
+
+
+def _print_stream_stats(processed: int, elapsed: float, latencies: list, reader: LatestFrameReader):
+    """処理fps・キャプチャ→状態更新の遅延・ドロップ数を表示"""
+    if not latencies:
+        return
+    latencies_ms = np.array(latencies) * 1000
+    print(f"📡 {processed / elapsed:.1f} fps | latency avg {latencies_ms.mean():.0f}ms "
+          f"p95 {np.percentile(latencies_ms, 95):.0f}ms max {latencies_ms.max():.0f}ms | "
+          f"captured {reader.captured} dropped {reader.dropped}")
+
+
+def run_stream_loop(model, source: str, db_path: str, output_dir: str, realtime: bool = False,
+                    duration_sec: float = None, use_roi: bool = USE_ROI_INFERENCE,
+                    motion_gating: bool = MOTION_GATING, use_tracking: bool = USE_TRACKING):
+    """
+    ライブ映像を最新フレーム優先で測定（終端・指定時間・Ctrl+C まで継続）
+
+    cycle_data.csv は完了ごとに追記、統計表PDF・zone_summary.csv（・Parquet）は REPORT_REFRESH_SEC ごとに更新
+    """
+    from main import process_frame, warmup_model
+
+    video_info = open_stream(source)
+    if not video_info:
+        return None
+
+    fps = video_info["fps"]
+    roi = compute_roi(STATIC_ZONES, video_info["width"], video_info["height"]) if use_roi else None
+    warmup_model(model, video_info["width"], video_info["height"], 1, roi)
+    motion_gate = MotionGate(STATIC_ZONES, video_info["width"], video_info["height"]) if motion_gating else None
+    tracker = ObjectTracker() if use_tracking else None
+
+    # ファイル以外は切断時に再接続
+    reopen = None
+    if not video_info["is_file"]:
+        reopen = lambda: (open_stream(source) or {}).get("cap")
+
+    reader = LatestFrameReader(video_info["cap"], fps, realtime, reopen, STREAM_RECONNECT_SEC)
+    zone_states = create_zone_states()
+    report = IncrementalReport(output_dir, get_zone_targets(db_path))
+    parquet_dir = os.path.join(output_dir, PARQUET_DIR_NAME)
+
+    last_index = 0
+    reconnects = 0
+    started = time.monotonic()
+    report_refreshed = started
+    window_started = started
+    window_processed = 0
+    latencies = []
+
+    print("\n--- Starting live stream measurement ---")
+    print(f"📅 Start time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+
+    try:
+        while True:
+            item = reader.read()
+            if item is None:
+                break
+
+            capture_index, captured_at, frame = item
+            current_time_sec = capture_index / fps
+
+            # 再接続後は切断前のフレームとの差分・トラックの予測が意味を持たないため初期化
+            if reader.reconnects != reconnects:
+                reconnects = reader.reconnects
+                if motion_gate:
+                    motion_gate.reset()
+                if tracker:
+                    tracker.reset()
+
+            # ゾーン周辺が変化していなければ直前の検出結果を再利用
+            infer = True
+            if motion_gate:
+                with STAGE_SECONDS.time("motion_gate"):
+                    infer = motion_gate.should_infer(frame)
+            if infer:
+                with STAGE_SECONDS.time("inference"):
+                    raw_detections = infer_detections([frame], model, roi)[0]
+                INFERRED_FRAMES_TOTAL.inc()
+            else:
+                REUSED_FRAMES_TOTAL.inc()
+
+            # 捨てたフレーム分は経過フレーム数として猶予カウンタ・トラックの予測に加算
+            with STAGE_SECONDS.time("zone_update"):
+                detections = filter_detections(raw_detections)
+                if tracker:
+                    detections = tracker.update(detections, capture_index - last_index)
+                _, completed_cycles = process_frame(detections, zone_states, capture_index, current_time_sec,
+                                                    capture_index - last_index, db_path)
+            FRAMES_TOTAL.inc()
+            last_index = capture_index
+            for cycle in completed_cycles:
+                report.add_cycle(cycle)
+
+            now = time.monotonic()
+            latencies.append(now - captured_at)
+            window_processed += 1
+
+            if now - window_started >= STREAM_STATS_INTERVAL_SEC:
+                _print_stream_stats(window_processed, now - window_started, latencies, reader)
+                flush_database(db_path)
+                window_started, window_processed, latencies = now, 0, []
+
+            if now - report_refreshed >= REPORT_REFRESH_SEC:
+                report.export_summary_csv()
+                report.export_pdf()
+                if EXPORT_PARQUET:
+                    flush_database(db_path)
+                    export_cycle_data_parquet(db_path, parquet_dir)
+                report_refreshed = now
+
+            if duration_sec is not None and now - started >= duration_sec:
+                break
+    except KeyboardInterrupt:
+        print("\n⏹️ Stream measurement stopped")
+    finally:
+        reader.close()
+        close_database(db_path)
+        report.close()
+
+    report.generate()
+    if EXPORT_PARQUET:
+        export_cycle_data_parquet(db_path, parquet_dir)
+
+    print(f"📅 End time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    return zone_states
+
+
+def main():
+    from main import setup_environment, load_model
+
+    parser = argparse.ArgumentParser(description="CycleEye live stream measurement")
+    parser.add_argument("source", help="RTSP URL / カメラ番号 / GStreamer パイプライン / 動画ファイル")
+    parser.add_argument("--realtime", action="store_true", help="動画ファイルを実時間で再生（ライブの再現）")
+    parser.add_argument("--duration", type=float, default=None, help="測定時間（秒）。省略時は終了まで継続")
+    parser.add_argument("--output-dir", default=os.path.join(OUTPUT_DIR, "stream"), help="出力先")
+    parser.add_argument("--model", default=MODEL_PATH, help="YOLOモデルのパス")
+    args = parser.parse_args()
+
+    db_path = os.path.join(args.output_dir, "cycle_time_data.db")
+    setup_environment(db_path, args.output_dir, source=args.source, model_path=args.model)
+
+    model = load_model(args.model)
+    if not model:
+        print("❌ Failed to load model. Exiting.")
+        return None
+
+    metrics_exporter = MetricsExporter(METRICS_PORT, os.path.join(args.output_dir, "metrics.jsonl"),
+                                       METRICS_LOG_INTERVAL_SEC, METRICS_BIND_ADDRESS)
+    try:
+        return run_stream_loop(model, args.source, db_path, args.output_dir, args.realtime, args.duration)
+    finally:
+        metrics_exporter.close()
+
+
+if __name__ == "__main__":
+    main()
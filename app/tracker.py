@@ -0,0 +1,186 @@
+"""
+物体追跡関連（SORT 方式）
+検出結果をフレーム間で対応づけ、ゾーン判定をトラック単位で行う
+"""
+
+import numpy as np
+from typing import Dict
+from constants import TRACK_IOU_THRESHOLD, TRACK_MIN_HITS, TRACK_MAX_AGE
+
+# 状態ベクトル: [cx, cy, w, h, vx, vy]（中心は等速、サイズは一定）
+_DIM = 6
+_H = np.hstack([np.eye(4), np.zeros((4, 2))])
+# 観測ノイズ・プロセスノイズ（px^2、フレーム単位）
+_R = np.diag([4.0, 4.0, 16.0, 16.0])
+_Q = np.diag([1.0, 1.0, 1.0, 1.0, 0.5, 0.5])
+_P0 = np.diag([16.0, 16.0, 64.0, 64.0, 100.0, 100.0])
+
+
+def _transition(dt: float) -> np.ndarray:
+    F = np.eye(_DIM)
+    F[0, 4] = F[1, 5] = dt
+    return F
+
+
+def _to_xyxy(state: np.ndarray) -> np.ndarray:
+    cx, cy, w, h = state[:, 0], state[:, 1], state[:, 2], state[:, 3]
+    return np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+
+
+def _to_cxcywh(boxes: np.ndarray) -> np.ndarray:
+    boxes = boxes.astype(float)
+    w = boxes[:, 2] - boxes[:, 0]
+    h = boxes[:, 3] - boxes[:, 1]
+    return np.stack([boxes[:, 0] + w / 2, boxes[:, 1] + h / 2, w, h], axis=1)
+
+
+def iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """ボックス×ボックスの IoU 行列 (A, B)"""
+    ix1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    iy1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    ix2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    iy2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(ix2 - ix1, 0, None) * np.clip(iy2 - iy1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-9), 0.0)
+
+
+def greedy_match(iou: np.ndarray, threshold: float):
+    """IoU の大きい組から順に1対1で対応づけ、(トラック, 検出) のペアを返す"""
+    pairs = []
+    if iou.size == 0:
+        return pairs
+    candidates = np.argwhere(iou >= threshold)
+    order = np.argsort(-iou[candidates[:, 0], candidates[:, 1]], kind="stable")
+    used_tracks, used_detections = set(), set()
+    for t, d in candidates[order]:
+        if t in used_tracks or d in used_detections:
+            continue
+        pairs.append((int(t), int(d)))
+        used_tracks.add(t)
+        used_detections.add(d)
+    return pairs
+
+
+class ObjectTracker:
+    """
+    IoU 対応づけ + カルマンフィルタによる軽量トラッカー（SORT 方式）
+
+    全トラックの状態を配列で持ち、予測・更新を一括で行う。同じクラスの検出だけを対応づけ、
+    min_hits 回以上観測されたトラックだけを出力する（1フレームだけの誤検出を除外）。
+    検出が途切れても max_age フレームまでは予測位置で出力を続ける（検出のちらつきを吸収）。
+    ただし見失ったトラックに別クラスの検出が重なった場合（組立 → パレットの切り替わりなど）は
+    その場で削除し、古いクラスが残って状態遷移を遅らせないようにする
+    """
+
+    def __init__(self, iou_threshold: float = TRACK_IOU_THRESHOLD, min_hits: int = TRACK_MIN_HITS,
+                 max_age: int = TRACK_MAX_AGE):
+        self.iou_threshold = iou_threshold
+        self.min_hits = min_hits
+        self.max_age = max_age
+        self.next_id = 1
+        self.reset()
+
+    def reset(self):
+        """全トラックを破棄（シーク・再接続で前後のフレームがつながらない場合。ID は振り直さない）"""
+        self.state = np.zeros((0, _DIM))
+        self.covariance = np.zeros((0, _DIM, _DIM))
+        self.class_ids = np.zeros(0, dtype=int)
+        self.confidences = np.zeros(0, dtype=np.float32)
+        self.track_ids = np.zeros(0, dtype=int)
+        self.hits = np.zeros(0, dtype=int)
+        self.missed_frames = np.zeros(0, dtype=int)
+
+    def predict(self, frame_step: int = 1) -> Dict[str, np.ndarray]:
+        """検出のないフレーム: トラックを frame_step フレーム分進めて出力"""
+        self._advance(frame_step)
+        return self._output()
+
+    def update(self, detections: Dict[str, np.ndarray], frame_step: int = 1) -> Dict[str, np.ndarray]:
+        """検出のあるフレーム: 予測位置と検出を対応づけて補正し、確定トラックを出力"""
+        self._advance(frame_step)
+
+        boxes = detections["boxes"]
+        class_ids = detections["class_ids"].astype(int)
+        overlap = iou_matrix(_to_xyxy(self.state), boxes.astype(float))
+        same_class = self.class_ids[:, None] == class_ids[None, :]
+        pairs = greedy_match(np.where(same_class, overlap, 0.0), self.iou_threshold)
+
+        matched_tracks = np.array([t for t, _ in pairs], dtype=int)
+        matched_detections = np.array([d for _, d in pairs], dtype=int)
+        if pairs:
+            self._correct(matched_tracks, _to_cxcywh(boxes[matched_detections]))
+            self.confidences[matched_tracks] = detections["confidences"][matched_detections]
+            self.hits[matched_tracks] += 1
+
+        # 対応しなかったトラックは見失ったフレーム数を加算し、max_age を超えたら削除
+        # 未確定のトラック・別クラスの検出に置き換わったトラックはすぐに削除
+        unmatched = np.ones(len(self.state), dtype=bool)
+        unmatched[matched_tracks] = False
+        self.missed_frames[unmatched] += frame_step
+        self.missed_frames[matched_tracks] = 0
+        replaced = (np.where(same_class, 0.0, overlap) >= self.iou_threshold).any(axis=1)
+        tentative = self.hits < self.min_hits
+        self._drop((self.missed_frames > self.max_age) | (unmatched & (replaced | tentative)))
+
+        new = np.ones(len(boxes), dtype=bool)
+        new[matched_detections] = False
+        if new.any():
+            self._add(boxes[new], class_ids[new], detections["confidences"][new])
+
+        return self._output()
+
+    def is_settled(self) -> bool:
+        """全トラックが直前の検出で観測済みかつ確定済みか（予測だけで出力中・未確定のトラックがない）"""
+        return bool(np.all(self.missed_frames == 0) and np.all(self.hits >= self.min_hits))
+
+    def _advance(self, frame_step: int):
+        if not len(self.state):
+            return
+        F = _transition(frame_step)
+        self.state = self.state @ F.T
+        self.covariance = F @ self.covariance @ F.T + _Q * frame_step
+
+    def _correct(self, tracks: np.ndarray, measurements: np.ndarray):
+        P = self.covariance[tracks]
+        S = _H @ P @ _H.T + _R
+        K = P @ _H.T @ np.linalg.inv(S)
+        residual = measurements - self.state[tracks] @ _H.T
+        self.state[tracks] += np.einsum("tij,tj->ti", K, residual)
+        self.covariance[tracks] = (np.eye(_DIM) - K @ _H) @ P
+
+    def _add(self, boxes: np.ndarray, class_ids: np.ndarray, confidences: np.ndarray):
+        count = len(boxes)
+        state = np.hstack([_to_cxcywh(boxes), np.zeros((count, 2))])
+        self.state = np.vstack([self.state, state])
+        self.covariance = np.concatenate([self.covariance, np.repeat(_P0[None], count, axis=0)])
+        self.class_ids = np.concatenate([self.class_ids, class_ids])
+        self.confidences = np.concatenate([self.confidences, confidences.astype(np.float32)])
+        self.track_ids = np.concatenate([self.track_ids, np.arange(self.next_id, self.next_id + count)])
+        self.hits = np.concatenate([self.hits, np.ones(count, dtype=int)])
+        self.missed_frames = np.concatenate([self.missed_frames, np.zeros(count, dtype=int)])
+        self.next_id += count
+
+    def _drop(self, mask: np.ndarray):
+        if not mask.any():
+            return
+        keep = ~mask
+        self.state = self.state[keep]
+        self.covariance = self.covariance[keep]
+        self.class_ids = self.class_ids[keep]
+        self.confidences = self.confidences[keep]
+        self.track_ids = self.track_ids[keep]
+        self.hits = self.hits[keep]
+        self.missed_frames = self.missed_frames[keep]
+
+    def _output(self) -> Dict[str, np.ndarray]:
+        """確定トラック（min_hits 回以上観測）の現在位置を検出結果と同じ形式で返す"""
+        confirmed = self.hits >= self.min_hits
+        return {
+            "boxes": np.rint(_to_xyxy(self.state[confirmed])).astype(int).reshape(-1, 4),
+            "confidences": self.confidences[confirmed],
+            "class_ids": self.class_ids[confirmed],
+            "track_ids": self.track_ids[confirmed]
+        }
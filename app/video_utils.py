@@ -3,12 +3,191 @@
 動画の読み込み、書き出し、切り出し
 """
 
+import fcntl
+import os
+import shutil
+import subprocess
 import cv2
-from constants import FPS, OUTPUT_DIR, VIDEO_MARGIN_SECONDS, TARGET_ZONES
+import numpy as np
+from constants import (
+    FPS, OUTPUT_DIR, VIDEO_MARGIN_SECONDS, TARGET_ZONES,
+    CLIP_SELECTION, CLIP_TOP_N, CLIP_OUTLIER_SIGMA, CLIP_STREAM_COPY,
+    VIDEO_DECODER, DECODE_THREADS, DECODE_HWACCEL, VIDEO_ENCODER, ENCODE_PRESET, ENCODE_CRF
+)
 
 
-def open_video(video_path: str):
-    """動画ファイルを開く"""
+class FFmpegVideoReader:
+    """
+    FFmpeg の別プロセスでデコードし、パイプから BGR フレームを読む
+
+    cv2.VideoCapture と同じ read / grab / get / set / release を持つため、そのまま置き換えられる。
+    デコードは FFmpeg 側のスレッド（threads=0 で自動）とハードウェアデコード（hwaccel）で行い、
+    scale_width を指定すると FFmpeg 内で縮小してから渡す。
+    パイプには YUV420 のまま流し（BGR の半分のデータ量）、BGR 変換は OpenCV で行う
+    """
+
+    def __init__(self, video_path: str, fps: float, width: int, height: int, total_frames: int,
+                 threads: int = 0, hwaccel: str = None, scale_width: int = None):
+        self.video_path = video_path
+        self.fps = fps
+        self.total_frames = total_frames
+        self.threads = threads
+        self.hwaccel = hwaccel
+        self.width, self.height = width, height
+        if scale_width and scale_width < width:
+            # yuv/bgr 変換のため偶数に丸める
+            self.width = scale_width - scale_width % 2
+            self.height = max(2, round(height * self.width / width / 2) * 2)
+        self.scaled = (self.width, self.height) != (width, height)
+        # YUV420 は偶数サイズのみ（奇数なら BGR のまま受け取る）
+        self.yuv = self.width % 2 == 0 and self.height % 2 == 0
+        if self.yuv:
+            self.buffer_shape = (self.height * 3 // 2, self.width)
+        else:
+            self.buffer_shape = (self.height, self.width, 3)
+        self.frame_bytes = int(np.prod(self.buffer_shape))
+        self.position = 0
+        self.proc = None
+        self._start(0)
+
+    def _start(self, frame_index: int):
+        command = [shutil.which("ffmpeg"), "-nostdin", "-loglevel", "error"]
+        if self.hwaccel:
+            command += ["-hwaccel", self.hwaccel]
+        command += ["-threads", str(self.threads)]
+        if frame_index > 0:
+            # 入力側の -ss はキーフレームから再デコードして指定位置で揃える
+            command += ["-ss", f"{frame_index / self.fps:.6f}"]
+        command += ["-i", self.video_path, "-map", "0:v:0", "-an", "-sn"]
+        if self.scaled:
+            command += ["-vf", f"scale={self.width}:{self.height}:flags=area"]
+        command += ["-f", "rawvideo", "-pix_fmt", "yuv420p" if self.yuv else "bgr24",
+                    "-vsync", "passthrough", "pipe:1"]
+
+        self.proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                     bufsize=self.frame_bytes)
+        if hasattr(fcntl, "F_SETPIPE_SZ"):
+            # 既定の 64KB ではフレームごとにプロセス切り替えが多発するため拡張
+            try:
+                fcntl.fcntl(self.proc.stdout.fileno(), fcntl.F_SETPIPE_SZ, 1 << 20)
+            except OSError:
+                pass
+        self.position = frame_index
+
+    def isOpened(self) -> bool:
+        return self.proc is not None
+
+    def read(self):
+        """次のフレームを (ret, frame) で返す"""
+        if self.proc is None:
+            return False, None
+        buffer = np.empty(self.buffer_shape, dtype=np.uint8)
+        view = memoryview(buffer).cast("B")
+        filled = 0
+        while filled < self.frame_bytes:
+            n = self.proc.stdout.readinto(view[filled:])
+            if not n:
+                return False, None
+            filled += n
+        self.position += 1
+        if self.yuv:
+            return True, cv2.cvtColor(buffer, cv2.COLOR_YUV2BGR_I420)
+        return True, buffer
+
+    def grab(self) -> bool:
+        """BGR 変換せずに1フレーム読み飛ばす"""
+        if self.proc is None:
+            return False
+        skipped = self.proc.stdout.read(self.frame_bytes)
+        if len(skipped) < self.frame_bytes:
+            return False
+        self.position += 1
+        return True
+
+    def get(self, prop_id: int) -> float:
+        values = {
+            cv2.CAP_PROP_POS_FRAMES: self.position,
+            cv2.CAP_PROP_FRAME_COUNT: self.total_frames,
+            cv2.CAP_PROP_FPS: self.fps,
+            cv2.CAP_PROP_FRAME_WIDTH: self.width,
+            cv2.CAP_PROP_FRAME_HEIGHT: self.height
+        }
+        return float(values.get(prop_id, 0.0))
+
+    def set(self, prop_id: int, value: float) -> bool:
+        """CAP_PROP_POS_FRAMES のみ対応（FFmpeg を指定位置から起動し直す）"""
+        if prop_id != cv2.CAP_PROP_POS_FRAMES:
+            return False
+        self.release()
+        self._start(int(value))
+        return True
+
+    def release(self):
+        if self.proc is None:
+            return
+        self.proc.stdout.close()
+        self.proc.kill()
+        self.proc.wait()
+        self.proc = None
+
+
+class FFmpegVideoWriter:
+    """
+    フレームを FFmpeg の標準入力へ送り H.264 などでエンコード
+
+    cv2.VideoWriter と同じ write / release / isOpened を持つ
+    """
+
+    def __init__(self, output_path: str, fps: float, width: int, height: int,
+                 codec: str = VIDEO_ENCODER, preset: str = ENCODE_PRESET, crf: int = ENCODE_CRF):
+        command = [
+            shutil.which("ffmpeg"), "-y", "-nostdin", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}", "-r", f"{fps}",
+            "-i", "pipe:0", "-c:v", codec
+        ]
+        if codec == "h264_nvenc":
+            command += ["-preset", preset if preset.startswith("p") else "p4", "-cq", str(crf)]
+        else:
+            command += ["-preset", preset, "-crf", str(crf)]
+        if width % 2 or height % 2:
+            # yuv420p は偶数サイズのみ
+            command += ["-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2"]
+        command += ["-pix_fmt", "yuv420p", "-movflags", "+faststart", output_path]
+
+        self.output_path = output_path
+        self.proc = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def isOpened(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    def write(self, frame):
+        try:
+            self.proc.stdin.write(memoryview(np.ascontiguousarray(frame)).cast("B"))
+        except BrokenPipeError:
+            pass
+
+    def release(self):
+        if self.proc is None:
+            return
+        try:
+            self.proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        stderr = self.proc.stderr.read()
+        if self.proc.wait() != 0:
+            print(f"❌ ffmpeg encode failed: {self.output_path}: {stderr.decode(errors='replace').strip()}")
+        self.proc.stderr.close()
+        self.proc = None
+
+
+def open_video(video_path: str, decoder: str = VIDEO_DECODER, decode_width: int = None):
+    """
+    動画ファイルを開く
+
+    decoder="ffmpeg" では FFmpeg の別プロセスでデコード（ffmpeg がなければ OpenCV）。
+    decode_width を指定すると縮小したフレームを返し、scale に元サイズとの倍率を入れる
+    （検出結果の座標は scale 倍して元解像度に戻す）
+    """
     cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
         print(f"❌ Error opening video: {video_path}")
@@ -22,86 +201,251 @@ def open_video(video_path: str):
     height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
     total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
 
-    print(f"✅ Video opened: {width}x{height} @ {fps}fps ({total_frames} frames)")
+    if decoder == "ffmpeg" and not shutil.which("ffmpeg"):
+        print("⚠️ ffmpeg not found - decoding with OpenCV")
+        decoder = "opencv"
+    if decoder == "ffmpeg":
+        cap.release()
+        cap = FFmpegVideoReader(video_path, fps, width, height, total_frames,
+                                DECODE_THREADS, DECODE_HWACCEL, decode_width)
+    elif decode_width:
+        print("⚠️ Downscaled decode requires ffmpeg - decoding at full resolution")
+
+    frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    resized = f" → {frame_width}x{frame_height}" if frame_width != width else ""
+    print(f"✅ Video opened: {width}x{height}{resized} @ {fps}fps ({total_frames} frames, decoder: {decoder})")
+
+    return {
+        "cap": cap,
+        "fps": fps,
+        "width": frame_width,
+        "height": frame_height,
+        "total_frames": total_frames,
+        "decoder": decoder,
+        "scale": width / frame_width
+    }
+
+
+def open_stream(source: str):
+    """
+    ライブ映像ソースを開く
+
+    source: RTSP/HTTP URL、カメラ番号（"0" など）、GStreamer パイプライン（"... ! appsink"）、
+    または動画ファイル（ストリームとして再生する場合）
+    """
+    if source.isdigit():
+        cap = cv2.VideoCapture(int(source))
+    elif "appsink" in source:
+        cap = cv2.VideoCapture(source, cv2.CAP_GSTREAMER)
+    else:
+        cap = cv2.VideoCapture(source)
+
+    if not cap.isOpened():
+        print(f"❌ Error opening stream: {source}")
+        return None
+
+    # 内部バッファを最小にして古いフレームが溜まらないようにする
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    if fps < 1.0 or fps > 240.0:
+        fps = FPS
+
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    print(f"✅ Stream opened: {source} {width}x{height} @ {fps}fps")
 
     return {
         "cap": cap,
         "fps": fps,
         "width": width,
         "height": height,
-        "total_frames": total_frames
+        "total_frames": 0,
+        "is_file": os.path.isfile(source)
     }
 
 
-def create_video_writer(output_path: str, fps: float, width: int, height: int):
-    """動画書き出し用のWriterを作成"""
+def seek_frame(cap, frame_index: int, exact: bool = False):
+    """指定フレーム（0始まり）へ移動。exact=True ではシークせず先頭から読み飛ばす"""
+    if frame_index <= 0:
+        return True
+
+    if not exact:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+        if int(cap.get(cv2.CAP_PROP_POS_FRAMES)) == frame_index:
+            return True
+        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+    # デコードのみ（画像変換なし）で読み飛ばし
+    for _ in range(frame_index):
+        if not cap.grab():
+            return False
+    return True
+
+
+def create_video_writer(output_path: str, fps: float, width: int, height: int,
+                        encoder: str = VIDEO_ENCODER):
+    """動画書き出し用のWriterを作成（"mp4v" 以外は FFmpeg でエンコード、ffmpeg がなければ mp4v）"""
+    if encoder != "mp4v" and shutil.which("ffmpeg"):
+        return FFmpegVideoWriter(output_path, fps, width, height, encoder)
+
     fourcc = cv2.VideoWriter_fourcc(*"mp4v")
     out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
     return out
 
 
-def extract_cycle_video(source_video_path: str, output_path: str, start_time: float, end_time: float, margin: float, fps: float):
-    """動画から指定範囲を切り出し"""
+def select_clip_cycles(zone_states: dict, selection: str = CLIP_SELECTION, top_n: int = CLIP_TOP_N):
+    """
+    切り出し対象のサイクルを選ぶ
+
+    selection: "longest"（各ゾーン最長）/ "top_n"（各ゾーン上位N件）/
+               "outliers"（平均 + CLIP_OUTLIER_SIGMA × 標準偏差を超えるサイクル）
+    """
+    selected = []
+
+    for zone in TARGET_ZONES:
+        results = zone_states[zone]["results"]
+
+        if len(results) == 0:
+            print(f"\n⚠️ [{zone}] No measurement data - skipping video extraction")
+            continue
+
+        ranked = sorted(results, key=lambda x: x['adjusted_time_seconds'], reverse=True)
+
+        if selection == "top_n":
+            cycles = ranked[:top_n]
+        elif selection == "outliers":
+            times = [c['adjusted_time_seconds'] for c in results]
+            mean = sum(times) / len(times)
+            std = (sum((t - mean) ** 2 for t in times) / len(times)) ** 0.5
+            cycles = [c for c in ranked if c['adjusted_time_seconds'] > mean + CLIP_OUTLIER_SIGMA * std]
+        else:
+            cycles = ranked[:1]
+
+        for cycle in cycles:
+            label = "longest_cycle" if selection == "longest" else "cycle"
+            print(f"\n🔴 [{zone}] Cycle #{cycle['cycle_number']}: {cycle['adjusted_time_seconds']}s")
+            selected.append((zone, cycle, label))
+
+    return selected
+
+
+def stream_copy_clip(source_video_path: str, output_path: str, start_time: float, end_time: float):
+    """ffmpegのストリームコピーで切り出し（再エンコードなし、開始はキーフレーム単位）"""
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg:
+        return False
+
+    command = [
+        ffmpeg, "-y", "-loglevel", "error",
+        "-ss", f"{start_time:.3f}", "-i", source_video_path,
+        "-t", f"{end_time - start_time:.3f}",
+        "-c", "copy", "-avoid_negative_ts", "make_zero",
+        output_path
+    ]
+    result = subprocess.run(command, capture_output=True)
+    return result.returncode == 0 and os.path.exists(output_path)
+
+
+def extract_clips_single_pass(source_video_path: str, clips: list, fps: float):
+    """複数の切り出し範囲を1回の順次読み込みでまとめて書き出す"""
+    if not clips:
+        return []
+
     cap = cv2.VideoCapture(source_video_path)
     if not cap.isOpened():
         print(f"❌ Error opening video: {source_video_path}")
-        return False
+        return []
 
     frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-
-    extract_start_time = max(0, start_time - margin)
-    extract_end_time = min(total_frames / fps, end_time + margin)
-
-    start_frame = int(extract_start_time * fps)
-    end_frame = int(extract_end_time * fps)
 
-    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-    out = cv2.VideoWriter(output_path, fourcc, fps, (frame_width, frame_height))
+    pending = sorted(clips, key=lambda c: c["start_frame"])
+    last_frame = max(c["end_frame"] for c in pending)
+    active = []
+    written = []
+    frame_index = 0
 
-    cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
-    current_frame = start_frame
+    while frame_index <= last_frame and (pending or active):
+        # どのクリップにも含まれないフレームはデコードのみで読み飛ばす
+        if not active and pending[0]["start_frame"] > frame_index:
+            if not cap.grab():
+                break
+            frame_index += 1
+            continue
 
-    while current_frame <= end_frame and cap.isOpened():
         ret, frame = cap.read()
         if not ret:
             break
-        out.write(frame)
-        current_frame += 1
+
+        while pending and pending[0]["start_frame"] <= frame_index:
+            clip = pending.pop(0)
+            clip["writer"] = create_video_writer(clip["output_path"], fps, frame_width, frame_height)
+            active.append(clip)
+
+        for clip in active:
+            clip["writer"].write(frame)
+
+        for clip in [c for c in active if c["end_frame"] <= frame_index]:
+            clip["writer"].release()
+            active.remove(clip)
+            written.append(clip["output_path"])
+
+        frame_index += 1
+
+    for clip in active:
+        clip["writer"].release()
+        written.append(clip["output_path"])
 
     cap.release()
-    out.release()
+    return written
 
-    duration = extract_end_time - extract_start_time
-    print(f"✅ Video extracted: {output_path} (Duration: {duration:.2f}s)")
-    return True
 
+def extract_cycle_clips(zone_states: dict, output_video_path: str, fps: float,
+                        output_dir: str = OUTPUT_DIR, selection: str = CLIP_SELECTION,
+                        stream_copy: bool = CLIP_STREAM_COPY):
+    """選んだサイクルの動画を切り出し（ストリームコピー優先、不可なら1パスで再エンコード）"""
+    cap = cv2.VideoCapture(output_video_path)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    clips = []
+    for zone, cycle, label in select_clip_cycles(zone_states, selection):
+        extract_start_time = max(0, cycle['start_time_sec'] - VIDEO_MARGIN_SECONDS)
+        extract_end_time = min(total_frames / fps, cycle['end_time_sec'] + VIDEO_MARGIN_SECONDS)
+        clips.append({
+            "output_path": f"{output_dir}/{zone}_{label}_{cycle['cycle_number']}.mp4",
+            "start_time": extract_start_time,
+            "end_time": extract_end_time,
+            "start_frame": int(extract_start_time * fps),
+            "end_frame": int(extract_end_time * fps)
+        })
 
-def extract_longest_cycle_videos(zone_states: dict, output_video_path: str, fps: float):
-    """各ゾーンの最長サイクル動画を切り出し"""
     extracted_videos = []
+    remaining = []
+    for clip in clips:
+        if stream_copy and stream_copy_clip(output_video_path, clip["output_path"],
+                                            clip["start_time"], clip["end_time"]):
+            extracted_videos.append(clip["output_path"])
+        else:
+            remaining.append(clip)
 
-    for zone in TARGET_ZONES:
-        results = zone_states[zone]["results"]
+    extracted_videos.extend(extract_clips_single_pass(output_video_path, remaining, fps))
 
-        if len(results) == 0:
-            print(f"\n⚠️ [{zone}] No measurement data - skipping video extraction")
+    extracted = set(extracted_videos)
+    for clip in clips:
+        if clip["output_path"] not in extracted:
+            print(f"⚠️ Failed to extract video: {clip['output_path']}")
             continue
+        duration = clip["end_time"] - clip["start_time"]
+        print(f"✅ Video extracted: {clip['output_path']} (Duration: {duration:.2f}s)")
+
+    return extracted_videos
 
-        # 最長サイクルのみ抽出
-        longest = max(results, key=lambda x: x['adjusted_time_seconds'])
-        longest_output = f"{OUTPUT_DIR}/{zone}_longest_cycle_{longest['cycle_number']}.mp4"
-        print(f"\n🔴 [{zone}] Longest cycle #{longest['cycle_number']}: {longest['adjusted_time_seconds']}s")
-
-        extract_cycle_video(
-            output_video_path,
-            longest_output,
-            longest['start_time_sec'],
-            longest['end_time_sec'],
-            VIDEO_MARGIN_SECONDS,
-            fps
-        )
-        extracted_videos.append(longest_output)
-
-    return extracted_videos
\ No newline at end of file
+
+def extract_longest_cycle_videos(zone_states: dict, output_video_path: str, fps: float,
+                                 output_dir: str = OUTPUT_DIR):
+    """各ゾーンの最長サイクル動画を切り出し"""
+    return extract_cycle_clips(zone_states, output_video_path, fps, output_dir, "longest")
\ No newline at end of file
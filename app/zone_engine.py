@@ -0,0 +1,185 @@
+"""
+配列ベースのゾーン状態エンジン
+全ゾーンのカウンタ・フラグを NumPy 配列で持ち、1フレーム分を一括で更新
+（update_zone_state と同じ状態遷移。ゾーン数が多いカメラ向け）
+"""
+
+from collections.abc import Mapping
+from datetime import datetime
+import numpy as np
+from constants import TARGET_ZONES, N_FRAMES_GRACE_START, N_FRAMES_GRACE_STOP, FPS
+from database import save_cycle_to_db
+
+_NO_FRAME = -1
+
+
+class ZoneStateEngine(Mapping):
+    """
+    全ゾーンの状態を配列で保持する状態機械
+
+    step() にゾーン順の組立/パレット検出フラグを渡すと全ゾーンを一度に進め、
+    完了した有効サイクルを返す。Python での処理はサイクルの開始・終了時だけ。
+    engine[zone] は initialize_zone_states と同じキーを持つ読み取り専用の辞書を返す
+    """
+
+    def __init__(self, zones: list = TARGET_ZONES):
+        self.zones = list(zones)
+        self.index = {zone: i for i, zone in enumerate(self.zones)}
+        size = len(self.zones)
+
+        self.measuring = np.zeros(size, dtype=bool)
+        self.is_valid_cycle = np.ones(size, dtype=bool)
+        self.assembling_count = np.zeros(size, dtype=np.int64)
+        self.pallet_count = np.zeros(size, dtype=np.int64)
+        self.assembling_since_frame = np.full(size, _NO_FRAME, dtype=np.int64)
+        self.pallet_since_frame = np.full(size, _NO_FRAME, dtype=np.int64)
+        self.start_frame = np.full(size, _NO_FRAME, dtype=np.int64)
+        self.start_time_sec = np.zeros(size, dtype=np.float64)
+        self.cycle_number = np.zeros(size, dtype=np.int64)
+
+        # 開始・終了時にだけ触るもの
+        self.start_datetime = [None] * size
+        self.results = [[] for _ in range(size)]
+
+    # ================
+    # 状態更新
+    # ================
+    def invalidate_measuring(self):
+        """Worker数が3人以上の場合、測定中の全ゾーンを無効化"""
+        self.is_valid_cycle[self.measuring] = False
+
+    def step(self, assembling: np.ndarray, pallet: np.ndarray, current_frame: int,
+             current_time_sec: float, frame_step: int = 1, db_path: str = None):
+        """1フレーム分の検出フラグ（ゾーン順）で全ゾーンを更新し、完了した有効サイクルを返す"""
+        assembling = np.asarray(assembling, dtype=bool)
+        pallet = np.asarray(pallet, dtype=bool)
+        measuring = self.measuring
+
+        # 待機中はパレット優先、測定中は組立優先（update_zone_state と同じ分岐順）
+        # 組立をカウント: 測定中の組立 / 待機中のパレットなし組立
+        # パレットをカウント: 待機中のパレット / 測定中の組立なしパレット
+        count_assembling = assembling & (measuring | ~pallet)
+        count_pallet = pallet & ~(measuring & assembling)
+        waiting_assembling = count_assembling & ~measuring
+        measuring_pallet = count_pallet & measuring
+
+        # 連続検出の開始フレーム（カウンタが0からのときだけ記録）
+        self.assembling_since_frame[waiting_assembling & (self.assembling_count == 0)] = current_frame
+        self.pallet_since_frame[measuring_pallet & (self.pallet_count == 0)] = current_frame
+
+        self.assembling_count += frame_step
+        self.assembling_count *= count_assembling
+        self.pallet_count += frame_step
+        self.pallet_count *= count_pallet
+
+        starts = waiting_assembling & (self.assembling_count >= N_FRAMES_GRACE_START)
+        ends = measuring_pallet & (self.pallet_count >= N_FRAMES_GRACE_STOP)
+        if not (starts.any() or ends.any()):
+            return []
+
+        starts = np.flatnonzero(starts)
+        ends = np.flatnonzero(ends)
+
+        if starts.size:
+            self._start_cycles(starts, current_frame, current_time_sec)
+        if ends.size:
+            return self._end_cycles(ends, current_frame, current_time_sec, db_path)
+        return []
+
+    def _start_cycles(self, starts: np.ndarray, current_frame: int, current_time_sec: float):
+        self.measuring[starts] = True
+        self.start_frame[starts] = current_frame
+        self.start_time_sec[starts] = current_time_sec
+        self.cycle_number[starts] += 1
+        self.is_valid_cycle[starts] = True
+
+        now = datetime.now()
+        for i in starts:
+            self.start_datetime[i] = now
+            print(f"🟢 [{self.zones[i]}] Cycle #{self.cycle_number[i]} started at {current_time_sec:.2f}s")
+
+    def _end_cycles(self, ends: np.ndarray, current_frame: int, current_time_sec: float, db_path: str):
+        self.measuring[ends] = False
+        end_datetime = datetime.now()
+
+        # 時間計算（開始/終了判定にかかった遅れを補正）
+        elapsed = current_time_sec - self.start_time_sec[ends]
+        lag_frames = ((current_frame - self.pallet_since_frame[ends])
+                      - (self.start_frame[ends] - self.assembling_since_frame[ends]))
+        adjusted_time = elapsed - lag_frames / FPS
+
+        completed_cycles = []
+        for i, elapsed_sec, adjusted_sec in zip(ends, elapsed.tolist(), adjusted_time.tolist()):
+            zone = self.zones[i]
+            if not self.is_valid_cycle[i]:
+                print(f"⚠️ [{zone}] Cycle #{self.cycle_number[i]} invalidated (3+ workers)")
+                continue
+
+            cycle_data = {
+                "zone_name": zone,
+                "cycle_number": int(self.cycle_number[i]),
+                "start_datetime": self.start_datetime[i].strftime('%Y-%m-%d %H:%M:%S.%f')[:-3],
+                "end_datetime": end_datetime.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3],
+                "start_frame": int(self.start_frame[i]),
+                "end_frame": current_frame,
+                "elapsed_seconds": round(elapsed_sec, 3),
+                "adjusted_time_seconds": round(adjusted_sec, 3),
+                "start_time_sec": round(float(self.start_time_sec[i]), 2),
+                "end_time_sec": round(current_time_sec, 2)
+            }
+
+            self.results[i].append(cycle_data)
+            if db_path:
+                save_cycle_to_db(db_path, cycle_data)
+
+            print(f"🔴 [{zone}] Cycle #{cycle_data['cycle_number']} completed: {adjusted_sec:.2f}s")
+            completed_cycles.append(cycle_data)
+
+        return completed_cycles
+
+    # ================
+    # 参照用
+    # ================
+    def near_transition(self) -> bool:
+        """いずれかのゾーンが開始/終了判定の途中（猶予カウント中）か"""
+        return bool(np.any(np.where(self.measuring, self.pallet_count, self.assembling_count) > 0))
+
+    def snapshot(self):
+        """描画用に各ゾーンの表示項目だけをコピー"""
+        measuring = self.measuring.tolist()
+        started = (self.start_frame != _NO_FRAME).tolist()
+        start_time_sec = self.start_time_sec.tolist()
+        is_valid_cycle = self.is_valid_cycle.tolist()
+        return {
+            zone: {
+                "measuring": measuring[i],
+                "start_time_sec": start_time_sec[i] if started[i] else None,
+                "is_valid_cycle": is_valid_cycle[i]
+            }
+            for i, zone in enumerate(self.zones)
+        }
+
+    def __getitem__(self, zone: str):
+        i = self.index[zone]
+        started = self.start_frame[i] != _NO_FRAME
+        return {
+            "measuring": bool(self.measuring[i]),
+            "start_frame": int(self.start_frame[i]) if started else None,
+            "start_time_sec": float(self.start_time_sec[i]) if started else None,
+            "start_datetime": self.start_datetime[i],
+            "is_valid_cycle": bool(self.is_valid_cycle[i]),
+            "assembling_count": int(self.assembling_count[i]),
+            "pallet_count": int(self.pallet_count[i]),
+            "assembling_since_frame": (int(self.assembling_since_frame[i])
+                                       if self.assembling_since_frame[i] != _NO_FRAME else None),
+            "pallet_since_frame": (int(self.pallet_since_frame[i])
+                                   if self.pallet_since_frame[i] != _NO_FRAME else None),
+            "cycle_number": int(self.cycle_number[i]),
+            "results": self.results[i]
+        }
+
+    def __iter__(self):
+        return iter(self.zones)
+
+    def __len__(self):
+        return len(self.zones)
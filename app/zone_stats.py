@@ -0,0 +1,85 @@
+"""
+ゾーン別の累積統計
+サイクル完了ごとに件数・平均・分散・最小/最大・パーセンタイルを更新（全件を保持しない）
+"""
+
+import math
+from constants import QUANTILE_RELATIVE_ACCURACY
+
+
+class QuantileSketch:
+    """
+    対数バケットによるパーセンタイル近似（DDSketch 方式）
+
+    値を相対誤差 relative_accuracy 以内のバケットに数えるだけなので、
+    メモリはサイクル数ではなく値の範囲（桁数）に比例する
+    """
+
+    def __init__(self, relative_accuracy: float = QUANTILE_RELATIVE_ACCURACY):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, value: float):
+        """値を1件追加"""
+        self.count += 1
+        if value <= 0:
+            self.zero_count += 1
+            return
+        index = math.ceil(math.log(value) / self.log_gamma)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def quantile(self, q: float):
+        """q（0〜1）分位点の近似値。データがなければ None"""
+        if self.count == 0:
+            return None
+
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+
+class ZoneAggregate:
+    """1ゾーン分の累積統計（Welford法で平均・分散を更新）"""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.sketch = QuantileSketch()
+
+    def add(self, value: float):
+        """サイクルタイムを1件追加"""
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.sketch.add(value)
+
+    @property
+    def variance(self):
+        """標本分散（2件未満では 0）"""
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    def quantile(self, q: float):
+        """パーセンタイルの近似値（実測の最小/最大の範囲に収める）"""
+        value = self.sketch.quantile(q)
+        if value is None:
+            return None
+        return min(max(value, self.min), self.max)